@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Benchmarks for the experience replay implementations
+
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+
+import binary_heap
+import old_rank_based
+import rank_based
+import storage
+
+"""
+python benchmark.py dqn --sizes 10000 100000 1000000 10000000 --json results.json
+python benchmark.py rebalance --sizes 1000000 --steps 2000
+dqn drives each engine through a DQN loop on a full buffer: store one transition, sample a batch,
+update the batch priorities, every step. It reports calls per second and p50 / p99 latency of
+each call, the startup time (constructor, build_distributions and the distribution used once
+the buffer is full), the prefill time and the peak RSS. Every (engine, size) runs in a fresh
+process so the peak RSS is its own. --json writes the results with the run settings and
+platform details, so runs of different commits / engines can be compared.
+The other benchmarks fill a replay, then run sample / update_priority steps and print one line per
+configuration. rebalance compares exact rank lookup with sampling by heap array position, with
+and without periodic / adaptive sorting of the heap. rank error is the mean distance between
+the sampled position and the true rank of the experience found there, as a fraction of the size.
+ranking compares the exact rank index with the bucketed one (rank_based ranking='bucket'), its
+rank error is measured the same way and printed next to the one the index reports.
+"""
+
+
+def fill(experience, size, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(size):
+        experience.store((i, 0, 0.0, i + 1, False))
+    experience.update_priority(list(range(1, size + 1)), rng.random(size).tolist())
+
+
+def rank_error(heap, rank_list, e_ids):
+    # true rank of each sampled experience against the rank it was sampled for
+    priorities = heap.get_priorities(e_ids)
+    true_ranks = [heap.rank_index.count_above(p) for p in priorities]
+    return float(np.mean(np.abs(np.array(true_ranks) - np.array(rank_list)))) / heap.get_size()
+
+
+def bench_rebalance(size=100000, steps=1000, batch_size=32, seed=0, out=sys.stdout):
+    """
+    :param size: replay size
+    :param steps: sample / update_priority steps per configuration
+    :return: list of result dicts
+    """
+    configs = [('exact', {}),
+               ('position', {'rank_mode': 'position'}),
+               ('position, sort every 100 steps', {'rank_mode': 'position', 'rebalance_interval': 100}),
+               ('position, sort when disorder > 0.2', {'rank_mode': 'position', 'rebalance_disorder': 0.2})]
+    results = []
+    for name, extra in configs:
+        conf = {'size': size, 'batch_size': batch_size, 'learn_start': batch_size,
+                'steps': steps + size, 'partition_num': 1}
+        conf.update(extra)
+        experience = old_rank_based.Experience(conf)
+        fill(experience, size, seed)
+        rng = np.random.default_rng(seed + 1)
+        random.seed(seed)
+        heap = experience.priority_queue
+        sample_time = 0.0
+        errors = []
+        for step in range(steps):
+            start = time.perf_counter()
+            _, _, e_id = experience.sample(size + step)
+            sample_time += time.perf_counter() - start
+            if step % 50 == 0:
+                # ranks the sampled ids were drawn for: their array positions in position mode
+                positions = [heap.position[e] + 1 for e in e_id] if extra else None
+                if positions is not None:
+                    errors.append(rank_error(heap, positions, e_id))
+            experience.update_priority(e_id, rng.random(len(e_id)).tolist())
+        result = {'config': name, 'size': size, 'steps': steps,
+                  'sample_us': sample_time / steps * 1e6,
+                  'rank_error': float(np.mean(errors)) if errors else 0.0,
+                  'rebalances': experience.rebalance_count}
+        out.write('{config:<36} {sample_us:10.1f} us/sample  rank error {rank_error:.4f}  '
+                  'rebalances {rebalances}\n'.format(**result))
+        results.append(result)
+    return results
+
+
+def bench_ranking(size=100000, steps=1000, batch_size=32, seed=0, out=sys.stdout):
+    """
+    :param size: replay size
+    :param steps: sample / update_priority_batch steps per configuration
+    :return: list of result dicts
+    """
+    results = []
+    for ranking in rank_based.RANKINGS:
+        experience = rank_based.Experience(max_size=size, batch_size=batch_size,
+                                           learn_start=batch_size, total_steps=steps + size,
+                                           partition_num=1, seed=seed, ranking=ranking)
+        experience.store_batch((np.arange(size), np.zeros(size), np.zeros(size),
+                                np.arange(size), np.zeros(size)))
+        rng = np.random.default_rng(seed + 1)
+        experience.update_priority_batch(np.arange(1, size + 1), rng.standard_normal(size))
+        sample_time = update_time = 0.0
+        for step in range(steps):
+            start = time.perf_counter()
+            _, _, e_id = experience.sample(size + step)
+            sample_time += time.perf_counter() - start
+            delta = rng.standard_normal(len(e_id))
+            start = time.perf_counter()
+            experience.update_priority(e_id, delta)
+            update_time += time.perf_counter() - start
+
+        # measured error: ranks drawn uniformly against the true rank of the id found
+        heap = experience.queue
+        ranks = rng.integers(1, size + 1, 1000)
+        found = heap.priority_to_experience(ranks)
+        descending = -np.sort(-np.asarray(heap.get_priorities(), dtype=np.float64))
+        priorities = np.asarray(heap.get_priorities(found), dtype=np.float64)
+        true_ranks = np.searchsorted(-descending, -priorities, side='left') + 1
+        result = {'ranking': ranking, 'size': size, 'steps': steps,
+                  'sample_us': sample_time / steps * 1e6,
+                  'update_us': update_time / steps * 1e6,
+                  'rank_error': float(np.mean(np.abs(true_ranks - ranks))) / size,
+                  'reported_rank_error': experience.rank_error() / size}
+        out.write('{ranking:<8} {sample_us:10.1f} us/sample {update_us:10.1f} us/update  '
+                  'rank error {rank_error:.5f} (reported {reported_rank_error:.5f})\n'.format(**result))
+        results.append(result)
+    return results
+
+
+# engine name -> rank_based.Experience keyword arguments, 'heap' drives a BinaryHeap on its own
+ENGINES = {'heap': None,
+           'rank_based': {},
+           'rank_based_compact': {'compact_heap': True},
+           'rank_based_bucket': {'ranking': 'bucket'},
+           'rank_based_compact_bucket': {'compact_heap': True, 'ranking': 'bucket'},
+           'rank_based_deferred': {'update_log_size': 1024}}
+
+
+def peak_rss():
+    """
+    :return: int, peak resident set size of this process in bytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def latency(name, times):
+    """
+    :param times: np.ndarray of call durations in seconds
+    :return: dict, calls per second and p50 / p99 latency in microseconds
+    """
+    return {name + '_per_sec': len(times) / times.sum(),
+            name + '_p50_us': float(np.percentile(times, 50)) * 1e6,
+            name + '_p99_us': float(np.percentile(times, 99)) * 1e6}
+
+
+def run_dqn(engine, size, steps=1000, batch_size=32, seed=0, state_shape=(4,), cache_dir=None):
+    """
+    one DQN loop on a full buffer, see the module docstring
+    :param engine: key of ENGINES
+    :param size: replay size
+    :param steps: number of store / sample / update steps
+    :param state_shape: shape of the stored states
+    :param cache_dir: distribution cache directory, see rank_based.Experience
+    :return: dict, result
+    """
+    rng = np.random.default_rng(seed)
+    state = np.zeros(state_shape, dtype=np.float32)
+    start = time.perf_counter()
+    if ENGINES[engine] is None:
+        heap = binary_heap.BinaryHeap(max_len=size, batch_size=batch_size)
+    else:
+        experience = rank_based.Experience(max_size=size, batch_size=batch_size,
+                                           learn_start=batch_size, total_steps=size + steps + 1,
+                                           partition_num=min(100, size), seed=seed,
+                                           cache_dir=cache_dir, eviction='fifo',
+                                           storage=storage.ArrayStorage(size, state_shape),
+                                           **ENGINES[engine])
+        # the partition sampled once the buffer is full
+        experience.distributions[experience.partition_num]
+    startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if ENGINES[engine] is None:
+        heap.push_batch(rng.random(size).tolist(), list(range(1, size + 1)))
+    else:
+        states = np.zeros((size,) + tuple(state_shape), dtype=np.float32)
+        experience.store_batch((states, np.zeros(size, dtype=np.int64), np.zeros(size),
+                                states, np.zeros(size, dtype=np.bool_)))
+        experience.update_priority_batch(np.arange(1, size + 1), rng.random(size))
+    prefill = time.perf_counter() - start
+
+    times = np.zeros((3, steps))
+    transition = (state, 0, 0.0, state, False)
+    loop_start = time.perf_counter()
+    for step in range(steps):
+        t0 = time.perf_counter()
+        if ENGINES[engine] is None:
+            # fifo replacement of the oldest id with the max priority
+            victim = step % size + 1
+            priority = heap.get_max_priority()
+            heap.remove(victim)
+            heap.push((priority, victim))
+            t1 = time.perf_counter()
+            e_id = heap.priority_to_experience(rng.integers(1, size + 1, batch_size))
+            t2 = time.perf_counter()
+            heap.update_batch(e_id, np.abs(rng.standard_normal(batch_size)).tolist())
+        else:
+            experience.store(transition)
+            t1 = time.perf_counter()
+            _, _, e_id = experience.sample(size + step)
+            t2 = time.perf_counter()
+            experience.update_priority_batch(e_id, rng.standard_normal(batch_size))
+        times[:, step] = (t1 - t0, t2 - t1, time.perf_counter() - t2)
+    loop = time.perf_counter() - loop_start
+
+    result = {'benchmark': 'dqn', 'engine': engine, 'size': size, 'steps': steps,
+              'batch_size': batch_size, 'startup_s': startup, 'prefill_s': prefill,
+              'steps_per_sec': steps / loop}
+    for name, t in zip(('store', 'sample', 'update'), times):
+        result.update(latency(name, t))
+    result['peak_rss_bytes'] = peak_rss()
+    return result
+
+
+def _isolated(conn, kwargs):
+    conn.send(run_dqn(**kwargs))
+    conn.close()
+
+
+def bench_dqn(sizes=(10000, 100000, 1000000), steps=1000, batch_size=32, seed=0,
+              engines=None, state_shape=(4,), cache_dir=None, out=sys.stdout):
+    """
+    :param sizes: replay sizes
+    :param engines: keys of ENGINES, all by default
+    :return: list of result dicts
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for size in sizes:
+        for engine in engines or sorted(ENGINES):
+            kwargs = dict(engine=engine, size=size, steps=steps, batch_size=batch_size, seed=seed,
+                          state_shape=tuple(state_shape), cache_dir=cache_dir)
+            conn, child = ctx.Pipe(duplex=False)
+            worker = ctx.Process(target=_isolated, args=(child, kwargs))
+            worker.start()
+            child.close()
+            result = conn.recv()
+            worker.join()
+            out.write('{engine:<26} {size:>9} {steps_per_sec:9.0f} steps/s  store p50/p99 '
+                      '{store_p50_us:.1f}/{store_p99_us:.1f} us  sample {sample_p50_us:.1f}/'
+                      '{sample_p99_us:.1f} us  update {update_p50_us:.1f}/{update_p99_us:.1f} us  '
+                      'startup {startup_s:.3f} s  rss {rss:.0f} MB\n'.format(
+                          rss=result['peak_rss_bytes'] / 2 ** 20, **result))
+            results.append(result)
+    return results
+
+
+BENCHMARKS = {'dqn': bench_dqn, 'rebalance': bench_rebalance, 'ranking': bench_ranking}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='experience replay benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=None,
+                        help='replay sizes, dqn defaults to 10000 100000 1000000, others to 100000')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=None,
+                        help='dqn engines, all by default')
+    parser.add_argument('--state-shape', type=int, nargs='*', default=[4], help='dqn state shape')
+    parser.add_argument('--cache-dir', default=None, help='dqn distribution cache directory')
+    parser.add_argument('--json', default=None, help='write the results to this file, - for stdout')
+    args = parser.parse_args()
+
+    out = sys.stderr if args.json == '-' else sys.stdout
+    if args.benchmark == 'dqn':
+        results = bench_dqn(args.sizes or (10000, 100000, 1000000), args.steps, args.batch_size,
+                            args.seed, args.engines, args.state_shape, args.cache_dir, out=out)
+    else:
+        results = []
+        for size in args.sizes or (100000,):
+            results.extend(BENCHMARKS[args.benchmark](size=size, steps=args.steps,
+                                                      batch_size=args.batch_size, seed=args.seed,
+                                                      out=out))
+    if args.json is not None:
+        report = {'benchmark': args.benchmark, 'args': vars(args), 'created': time.time(),
+                  'python': platform.python_version(), 'numpy': np.__version__,
+                  'platform': platform.platform(), 'results': results}
+        if args.json == '-':
+            json.dump(report, sys.stdout, indent=1)
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
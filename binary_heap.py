@@ -4,37 +4,50 @@
 #       adapted from custom written binary heap class
 
 import sys
-import math
-import heapq
-from heapq import heappush, heappop, heapify
+from array import array
+from heapq import heapify
+import numpy as np
+
+import rank_index as _rank_index
 
 """
 Binary heap class used in the priority experience implementation.
 Priorities are stored in form [(-priority, experience-id), (-priority, experience-id),..] in tuples.
 Negative priorities are stored since heapq is a min-binary heap implementation
+The heap is indexed: position maps experience-id -> index in queue, so an entry can be
+found and sifted in place in O(log n) rather than searched for and re-heapified in O(n)
+A rank index (see rank_index.py) is kept in sync with the heap to map ranks to experience ids
+ArrayBinaryHeap is the same heap kept in preallocated flat arrays instead of a list of tuples
 """
 
 class BinaryHeap(object):
     """
     param max_len: integer of the max heap length (max priority queue length)
-    param priority_init: list of priority tuples
-    param replace: experiences automatically replaced
+    param batch_size: number of experiences returned by pop_batch
+    param initial_heap: list of (priority, experience-id) tuples
+    param rank_index: index mapping ranks to experience ids, an exact rank_index.RankIndex by default
     """
-    def __init__(self, max_len=100000, batch_size = 32, heap_init=None):
+    def __init__(self, max_len=100000, batch_size = 32, initial_heap=None, rank_index=None):
         self.max_len = max_len
         self.batch_size = batch_size
+        # experience id -> position in queue
+        self.position = {}
+        self.rank_index = _rank_index.RankIndex() if rank_index is None else rank_index
 
-        if not heap_init:
+        if not initial_heap:
             self.queue = []
         else:
-            if len(heap_init) > self.max_len:
+            if len(initial_heap) > self.max_len:
                 sys.stderr.write('Error: Can\'t make heap larger than max len. Creating smaller heap\n')
                 self.queue = []
                 for i in range(self.max_len):
-                    self.queue.append((-heap_init[i][0], heap_init[i][1]))
+                    self.queue.append((-initial_heap[i][0], initial_heap[i][1]))
             else:
-                self.queue = [(-i, j) for i, j in heap_init]
+                self.queue = [(-i, j) for i, j in initial_heap]
             heapify(self.queue)
+            self.position = {v[1]: i for i, v in enumerate(self.queue)}
+            for p, e in self.queue:
+                self.rank_index.insert(e, -p)
 
     def __repr__(self):
         return "{}".format(self.queue)
@@ -59,7 +72,7 @@ class BinaryHeap(object):
         """
         if e_ids is None:
             return list(map(lambda x: -x[0], self.queue))[0:len(self.queue)]
-        return [v for i, v in self.queue if -i in e_ids] #
+        return [-self.queue[self.position[e]][0] for e in e_ids if e in self.position]
 
     def get_experiences(self, priorities= None):
         """
@@ -71,6 +84,45 @@ class BinaryHeap(object):
             return list(map(lambda x: x[1], self.queue))[0:len(self.queue)]
         return [v for i, v in self.queue if -i in priorities]
 
+    def get_e_ids(self):
+        """
+        returns all e_ids in queue order
+        return list: experience ids
+        """
+        return self.get_experiences()
+
+    def restore(self, priorities, experiences):
+        """
+        replace the heap content, entries must already be in heap order (e.g. a saved queue)
+        param priorities: list of priority values
+        param experiences: list of experience ids
+        """
+        self.queue = [(-p, e) for p, e in zip(priorities, experiences)]
+        self.position = {e: i for i, e in enumerate(experiences)}
+        self.rank_index.rebuild(zip(experiences, priorities))
+
+    def priority_to_experience(self, rank_list):
+        """
+        map ranks to experience ids, rank 1 is the highest priority
+        param rank_list: list of ranks
+        return list: experience ids
+        """
+        return self.rank_index.lookup(rank_list)
+
+    def position_to_experience(self, pos_list):
+        """
+        param pos_list: list of positions in the heap array
+        return list: experience ids at those positions
+        """
+        return [self.queue[int(p)][1] for p in pos_list]
+
+    def contains(self, experience):
+        """
+        param experience: experience id
+        return bool: experience id is in the heap
+        """
+        return experience in self.position
+
     def update(self, experience, new_priority):
         """
         update priority value based on experience
@@ -78,24 +130,131 @@ class BinaryHeap(object):
         param new_priority: new priority value
         return bool: worked?
         """
-        pos = [i for i, v in enumerate(self.queue) if v[1] == experience]
-        if pos == []:
+        pos = self.position.get(experience)
+        if pos is None:
             return False
-        del(self.queue[pos[0]])
-        heappush(self.queue, (-new_priority, experience))
-        heapify(self.queue)
+        old = self.queue[pos]
+        new = (-new_priority, experience)
+        self.queue[pos] = new
+        self.rank_index.update(experience, -old[0], new_priority)
+        if new < old:
+            # priority increased, move towards the root
+            self._siftdown(0, pos)
+        else:
+            self._siftup(pos)
         return True
 
+    def update_batch(self, experiences, new_priorities):
+        """
+        update priority values of a batch of experiences, for repeated ids the last one wins
+        uses k sifts, or a single heapify when that is cheaper (k large compared to n)
+        param experiences: list of experience ids
+        param new_priorities: list of new priority values
+        return int: number of experiences updated
+        """
+        if not self._heapify_cheaper(len(experiences)):
+            return sum(self.update(e, p) for e, p in zip(experiences, new_priorities))
+        updated = 0
+        for e, p in zip(experiences, new_priorities):
+            pos = self.position.get(e)
+            if pos is not None:
+                self.queue[pos] = (-p, e)
+                updated += 1
+        self._rebuild()
+        return updated
+
+    def push_batch(self, priorities, experiences):
+        """
+        push a batch of new experiences, ids already present are updated
+        param priorities: list of priority values
+        param experiences: list of experience ids
+        return int: number of experiences pushed or updated
+        """
+        if not self._heapify_cheaper(len(experiences)):
+            return sum(self.push((p, e)) for p, e in zip(priorities, experiences))
+        done = 0
+        for p, e in zip(priorities, experiences):
+            pos = self.position.get(e)
+            if pos is not None:
+                self.queue[pos] = (-p, e)
+            elif self.is_full():
+                sys.stderr.write('Error: no space to add experience {} with priority {}\n'.format(e, p))
+                continue
+            else:
+                self.position[e] = len(self.queue)
+                self.queue.append((-p, e))
+            done += 1
+        self._rebuild()
+        return done
+
+    def balance_tree(self):
+        """
+        sort the queue by priority, a sorted array is still a valid heap and its array
+        positions are exact ranks until the next push/update moves entries around
+        """
+        self.queue.sort()
+        self.position = {v[1]: i for i, v in enumerate(self.queue)}
+
+    def disorder(self, sample_size=256, rng=None):
+        """
+        estimate how far the array order is from the rank order
+        param sample_size: number of adjacent pairs checked
+        param rng: numpy.random.Generator picking the pairs
+        return float: fraction of sampled adjacent pairs out of priority order, 0 after balance_tree
+        """
+        if len(self.queue) < 2:
+            return 0.0
+        rng = np.random.default_rng() if rng is None else rng
+        pos = rng.integers(0, len(self.queue) - 1, min(sample_size, len(self.queue) - 1))
+        queue = self.queue
+        return sum(queue[i] > queue[i + 1] for i in pos.tolist()) / float(len(pos))
+
+    def _heapify_cheaper(self, k):
+        # k sifts cost ~k log n, heapify and rebuilding the index cost ~n
+        n = len(self.queue) + k
+        return k * max(n.bit_length(), 1) > 2 * n
+
+    def _rebuild(self):
+        heapify(self.queue)
+        self.position = {v[1]: i for i, v in enumerate(self.queue)}
+        self.rank_index.rebuild([(e, -p) for p, e in self.queue])
+
     def push(self, experience):
         """
-        push new experience
-        param experience: experience tuple
+        push new experience, an already present experience id has its priority updated
+        param experience: (priority, experience id) tuple
         return bool: worked?
         """
+        if experience[1] in self.position:
+            return self.update(experience[1], experience[0])
         if self.is_full():
-            sys.stderr.write('Error: no space to add experience {} with priority {}\n'.format(experience[1], -experience[0]))
+            sys.stderr.write('Error: no space to add experience {} with priority {}\n'.format(experience[1], experience[0]))
+            return False
+        self.queue.append((-experience[0], experience[1]))
+        self.position[experience[1]] = len(self.queue) - 1
+        self.rank_index.insert(experience[1], experience[0])
+        self._siftdown(0, len(self.queue) - 1)
+        return True
+
+    def remove(self, experience):
+        """
+        remove experience from the heap, O(log n)
+        param experience: experience id
+        return bool: worked?
+        """
+        pos = self.position.pop(experience, None)
+        if pos is None:
             return False
-        heappush(self.queue, (-experience[0], experience[1]))
+        removed = self.queue[pos]
+        self.rank_index.remove(experience, -removed[0])
+        last = self.queue.pop()
+        if pos < len(self.queue):
+            self.queue[pos] = last
+            self.position[last[1]] = pos
+            if last < removed:
+                self._siftdown(0, pos)
+            else:
+                self._siftup(pos)
         return True
 
     def pop(self):
@@ -106,7 +265,7 @@ class BinaryHeap(object):
         if len(self.queue) == 0:
             sys.stderr.write('Error: no value in heap, pop failed\n')
             return False
-        v = heappop(self.queue)
+        v = self._pop()
         return (-v[0], v[1])
 
     def pop_batch(self):
@@ -120,6 +279,434 @@ class BinaryHeap(object):
             return False
         batch = []
         for i in range(self.batch_size):
-            v = heappop(self.queue)
+            v = self._pop()
             batch.append((-v[0], v[1]))
         return batch
+
+    def _pop(self):
+        # same as heappop, keeping position in sync
+        last = self.queue.pop()
+        if not self.queue:
+            del self.position[last[1]]
+            self.rank_index.remove(last[1], -last[0])
+            return last
+        top = self.queue[0]
+        del self.position[top[1]]
+        self.rank_index.remove(top[1], -top[0])
+        self.queue[0] = last
+        self.position[last[1]] = 0
+        self._siftup(0)
+        return top
+
+    def _siftdown(self, startpos, pos):
+        """
+        move entry at pos towards the root (heapq naming), keeping position in sync
+        """
+        queue = self.queue
+        position = self.position
+        newitem = queue[pos]
+        while pos > startpos:
+            parentpos = (pos - 1) >> 1
+            parent = queue[parentpos]
+            if newitem < parent:
+                queue[pos] = parent
+                position[parent[1]] = pos
+                pos = parentpos
+                continue
+            break
+        queue[pos] = newitem
+        position[newitem[1]] = pos
+
+    def _siftup(self, pos):
+        """
+        move entry at pos towards the leaves (heapq naming), keeping position in sync
+        """
+        queue = self.queue
+        position = self.position
+        endpos = len(queue)
+        startpos = pos
+        newitem = queue[pos]
+        # bubble the smaller child up until hitting a leaf
+        childpos = 2 * pos + 1
+        while childpos < endpos:
+            rightpos = childpos + 1
+            if rightpos < endpos and not queue[childpos] < queue[rightpos]:
+                childpos = rightpos
+            queue[pos] = queue[childpos]
+            position[queue[pos][1]] = pos
+            pos = childpos
+            childpos = 2 * pos + 1
+        queue[pos] = newitem
+        position[newitem[1]] = pos
+        self._siftdown(startpos, pos)
+
+
+class ArrayBinaryHeap(object):
+    """
+    BinaryHeap with the same interface, entries are kept in two preallocated parallel arrays
+    (priorities and experience ids) and position is an array indexed by experience id, so no
+    object is created per entry: 12 bytes per entry with float32 priorities instead of ~100, and
+    the default rank_index.ArrayRankIndex adds ~12 more (~25 in total instead of ~250 for
+    BinaryHeap and RankIndex). BucketRankIndex still holds Python objects, ~170 bytes per entry
+    experience ids must be integers in [0, max_len]
+    param max_len: integer of the max heap length (max priority queue length)
+    param batch_size: number of experiences returned by pop_batch
+    param initial_heap: list of (priority, experience-id) tuples
+    param priority_type: array typecode of the priorities, 'f' (float32) or 'd' (float64)
+    param rank_index: index mapping ranks to experience ids, an exact rank_index.ArrayRankIndex by default
+    """
+    def __init__(self, max_len=100000, batch_size = 32, initial_heap=None, priority_type='f',
+                 rank_index=None):
+        if priority_type not in ('f', 'd'):
+            raise ValueError('priority_type must be \'f\' or \'d\'')
+        self.max_len = max_len
+        self.batch_size = batch_size
+        self.size = 0
+        # arrays are never resized, so numpy views of them stay valid
+        self._priorities = array(priority_type, bytes(array(priority_type).itemsize * max_len))
+        self._e_ids = array('i', bytes(4 * max_len))
+        # experience id -> position in the arrays, -1 when absent
+        self._position = array('i', b'\xff' * 4 * (max_len + 1))
+        self.rank_index = _rank_index.ArrayRankIndex() if rank_index is None else rank_index
+
+        if initial_heap:
+            if len(initial_heap) > self.max_len:
+                sys.stderr.write('Error: Can\'t make heap larger than max len. Creating smaller heap\n')
+                initial_heap = initial_heap[:self.max_len]
+            self.push_batch([p for p, _ in initial_heap], [e for _, e in initial_heap])
+
+    def __repr__(self):
+        return "{}".format(list(zip(self.get_priorities().tolist(), self.get_e_ids().tolist())))
+
+    def nbytes(self):
+        """
+        return int: memory used by the heap arrays and the rank index
+        """
+        heap = sum(a.itemsize * len(a) for a in (self._priorities, self._e_ids, self._position))
+        return heap + self.rank_index.nbytes()
+
+    def is_full(self):
+        return self.size >= self.max_len
+
+    def get_size(self):
+        return self.size
+
+    def get_max_priority(self):
+    # get max priority (1 if no experiences)
+        if self.size > 0:
+            return self._priorities[0]
+        return 1
+
+    def get_priorities(self, e_ids= None):
+        """
+        returns all priorities, or priorities based on e_ids
+        param e_ids: list of e_ids to search for
+        return np.ndarray: read-only zero-copy view of the priorities in heap order, or list of priority values
+        """
+        if e_ids is None:
+            view = self._views()[0]
+            view.flags.writeable = False
+            return view
+        return [self._priorities[self._position[e]] for e in e_ids if self.contains(e)]
+
+    def get_experiences(self, priorities= None):
+        """
+        returns all e_ids, or e_ids based on priorities
+        param priorities: list of priorities to search for
+        return np.ndarray: read-only zero-copy view of the e_ids in heap order, or list of e_ids
+        """
+        if priorities is None:
+            view = self._views()[1]
+            view.flags.writeable = False
+            return view
+        return [self._e_ids[i] for i in range(self.size) if self._priorities[i] in priorities]
+
+    def get_e_ids(self):
+        """
+        returns all e_ids in queue order
+        return np.ndarray: read-only zero-copy view of the experience ids
+        """
+        return self.get_experiences()
+
+    def _views(self):
+        # writable views of the used part of the priority and experience id arrays
+        return (np.frombuffer(self._priorities, dtype=self._priorities.typecode)[:self.size],
+                np.frombuffer(self._e_ids, dtype=np.intc)[:self.size])
+
+    def restore(self, priorities, experiences):
+        """
+        replace the heap content, entries must already be in heap order (e.g. a saved queue)
+        param priorities: list of priority values
+        param experiences: list of experience ids
+        """
+        self.clear()
+        self.size = len(experiences)
+        view_p, view_e = self._views()
+        view_p[:] = priorities
+        view_e[:] = experiences
+        self._reindex()
+
+    def clear(self):
+        """
+        remove every experience
+        """
+        np.frombuffer(self._position, dtype=np.intc)[self._views()[1]] = -1
+        self.size = 0
+        self.rank_index.rebuild([])
+
+    def priority_to_experience(self, rank_list):
+        """
+        map ranks to experience ids, rank 1 is the highest priority
+        param rank_list: list of ranks
+        return list: experience ids
+        """
+        return self.rank_index.lookup(rank_list)
+
+    def position_to_experience(self, pos_list):
+        """
+        param pos_list: list of positions in the heap array
+        return list: experience ids at those positions
+        """
+        return [self._e_ids[int(p)] for p in pos_list]
+
+    def contains(self, experience):
+        """
+        param experience: experience id
+        return bool: experience id is in the heap
+        """
+        return 0 <= experience <= self.max_len and self._position[experience] >= 0
+
+    def update(self, experience, new_priority):
+        """
+        update priority value based on experience
+        param experience: experience id
+        param new_priority: new priority value
+        return bool: worked?
+        """
+        if not self.contains(experience):
+            return False
+        pos = self._position[experience]
+        old = self._priorities[pos]
+        self._priorities[pos] = new_priority
+        # compare and index the stored (possibly float32 rounded) value
+        new = self._priorities[pos]
+        self.rank_index.update(experience, old, new)
+        if new > old:
+            # priority increased, move towards the root
+            self._siftdown(0, pos)
+        else:
+            self._siftup(pos)
+        return True
+
+    def update_batch(self, experiences, new_priorities):
+        """
+        update priority values of a batch of experiences, for repeated ids the last one wins
+        uses k sifts, or a single sort when that is cheaper (k large compared to n)
+        param experiences: list of experience ids
+        param new_priorities: list of new priority values
+        return int: number of experiences updated
+        """
+        if not self._heapify_cheaper(len(experiences)):
+            return sum(self.update(e, p) for e, p in zip(experiences, new_priorities))
+        updated = 0
+        for e, p in zip(experiences, new_priorities):
+            if self.contains(e):
+                self._priorities[self._position[e]] = p
+                updated += 1
+        self._rebuild()
+        return updated
+
+    def push_batch(self, priorities, experiences):
+        """
+        push a batch of new experiences, ids already present are updated
+        param priorities: list of priority values
+        param experiences: list of experience ids
+        return int: number of experiences pushed or updated
+        """
+        if not self._heapify_cheaper(len(experiences)):
+            return sum(self.push((p, e)) for p, e in zip(priorities, experiences))
+        done = 0
+        for p, e in zip(priorities, experiences):
+            if self.contains(e):
+                self._priorities[self._position[e]] = p
+            elif self.is_full() or not 0 <= e <= self.max_len:
+                sys.stderr.write('Error: no space to add experience {} with priority {}\n'.format(e, p))
+                continue
+            else:
+                self._priorities[self.size] = p
+                self._e_ids[self.size] = e
+                self._position[e] = self.size
+                self.size += 1
+            done += 1
+        self._rebuild()
+        return done
+
+    def balance_tree(self):
+        """
+        sort the arrays by priority, a sorted array is still a valid heap and its array
+        positions are exact ranks until the next push/update moves entries around
+        """
+        priorities, e_ids = self._views()
+        order = np.lexsort((e_ids, -priorities))
+        priorities[:] = priorities[order]
+        e_ids[:] = e_ids[order]
+        np.frombuffer(self._position, dtype=np.intc)[e_ids] = np.arange(self.size)
+
+    def disorder(self, sample_size=256, rng=None):
+        """
+        estimate how far the array order is from the rank order
+        param sample_size: number of adjacent pairs checked
+        param rng: numpy.random.Generator picking the pairs
+        return float: fraction of sampled adjacent pairs out of priority order, 0 after balance_tree
+        """
+        if self.size < 2:
+            return 0.0
+        rng = np.random.default_rng() if rng is None else rng
+        pos = rng.integers(0, self.size - 1, min(sample_size, self.size - 1))
+        priorities, e_ids = self._views()
+        a, b = priorities[pos], priorities[pos + 1]
+        return float(np.mean((a < b) | ((a == b) & (e_ids[pos] > e_ids[pos + 1]))))
+
+    def _heapify_cheaper(self, k):
+        # k sifts cost ~k log n, sorting and rebuilding the index cost ~n
+        n = self.size + k
+        return k * max(n.bit_length(), 1) > 2 * n
+
+    def _rebuild(self):
+        # an array sorted by (-priority, experience id) is a valid heap, sort it in one go
+        self.balance_tree()
+        priorities, e_ids = self._views()
+        self.rank_index.rebuild_arrays(e_ids, priorities)
+
+    def _reindex(self):
+        priorities, e_ids = self._views()
+        np.frombuffer(self._position, dtype=np.intc)[e_ids] = np.arange(self.size)
+        self.rank_index.rebuild_arrays(e_ids, priorities)
+
+    def push(self, experience):
+        """
+        push new experience, an already present experience id has its priority updated
+        param experience: (priority, experience id) tuple
+        return bool: worked?
+        """
+        priority, e = experience
+        if self.contains(e):
+            return self.update(e, priority)
+        if self.is_full() or not 0 <= e <= self.max_len:
+            sys.stderr.write('Error: no space to add experience {} with priority {}\n'.format(e, priority))
+            return False
+        pos = self.size
+        self.size += 1
+        self._priorities[pos] = priority
+        self._e_ids[pos] = e
+        self._position[e] = pos
+        self.rank_index.insert(e, self._priorities[pos])
+        self._siftdown(0, pos)
+        return True
+
+    def remove(self, experience):
+        """
+        remove experience from the heap, O(log n)
+        param experience: experience id
+        return bool: worked?
+        """
+        if not self.contains(experience):
+            return False
+        pos = self._position[experience]
+        removed = self._priorities[pos]
+        self._position[experience] = -1
+        self.rank_index.remove(experience, removed)
+        self.size -= 1
+        last = self.size
+        if pos < last:
+            last_priority = self._priorities[last]
+            last_e = self._e_ids[last]
+            self._priorities[pos] = last_priority
+            self._e_ids[pos] = last_e
+            self._position[last_e] = pos
+            if last_priority > removed or (last_priority == removed and last_e < experience):
+                self._siftdown(0, pos)
+            else:
+                self._siftup(pos)
+        return True
+
+    def pop(self):
+        """
+        pop max priority and experience id
+        return tuple: (priority & (experience))
+        """
+        if self.size == 0:
+            sys.stderr.write('Error: no value in heap, pop failed\n')
+            return False
+        return self._pop()
+
+    def pop_batch(self):
+        """
+        pop replay experience batch
+        return list of tuples: [(experience),..]
+        """
+        if self.batch_size > self.size:
+            sys.stderr.write('Error: not enough values in batch, batch pop failed\n')
+            return False
+        return [self._pop() for _ in range(self.batch_size)]
+
+    def _pop(self):
+        top = (self._priorities[0], self._e_ids[0])
+        self.remove(top[1])
+        return top
+
+    def _siftdown(self, startpos, pos):
+        """
+        move entry at pos towards the root (heapq naming), keeping position in sync
+        entries are ordered by priority descending, then experience id ascending
+        """
+        priorities = self._priorities
+        e_ids = self._e_ids
+        position = self._position
+        newp = priorities[pos]
+        newe = e_ids[pos]
+        while pos > startpos:
+            parentpos = (pos - 1) >> 1
+            parentp = priorities[parentpos]
+            parente = e_ids[parentpos]
+            if newp > parentp or (newp == parentp and newe < parente):
+                priorities[pos] = parentp
+                e_ids[pos] = parente
+                position[parente] = pos
+                pos = parentpos
+                continue
+            break
+        priorities[pos] = newp
+        e_ids[pos] = newe
+        position[newe] = pos
+
+    def _siftup(self, pos):
+        """
+        move entry at pos towards the leaves (heapq naming), keeping position in sync
+        """
+        priorities = self._priorities
+        e_ids = self._e_ids
+        position = self._position
+        endpos = self.size
+        startpos = pos
+        newp = priorities[pos]
+        newe = e_ids[pos]
+        # bubble the higher priority child up until hitting a leaf
+        childpos = 2 * pos + 1
+        while childpos < endpos:
+            rightpos = childpos + 1
+            if rightpos < endpos:
+                cp = priorities[childpos]
+                rp = priorities[rightpos]
+                if rp > cp or (rp == cp and e_ids[rightpos] < e_ids[childpos]):
+                    childpos = rightpos
+            priorities[pos] = priorities[childpos]
+            e = e_ids[childpos]
+            e_ids[pos] = e
+            position[e] = pos
+            pos = childpos
+            childpos = 2 * pos + 1
+        priorities[pos] = newp
+        e_ids[pos] = newe
+        position[newe] = pos
+        self._siftdown(startpos, pos)
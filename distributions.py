@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Rank-based sampling distributions, built lazily per partition
+
+import os
+import sys
+import math
+import zlib
+import tempfile
+import numpy as np
+
+"""
+P(i) = (rank i) ^ (-alpha) / sum ((rank i) ^ (-alpha)) for every partition of the buffer.
+One shared array of rank ^ (-alpha) and its prefix sums is computed up front with numpy,
+each partition's strata_ends are derived from it the first time they are requested. A
+partition's pdf is weights[rank - 1] / total, computed when indexed (RankPdf) so the weights are
+never copied per partition. Only the most recently built partition is kept, so memory is O(size)
+
+With a cache_dir the shared arrays and the strata ends of every partition are kept in one
+versioned .npy file per (size, alpha, batch_size, partition_num), loaded with mmap_mode='r'
+so processes on the same host share the pages. The header holds a crc32 of the arrays, stale or
+corrupted files are rebuilt
+"""
+
+CACHE_VERSION = 2
+# header: version, size, alpha, batch_size, partition_num, ranks, total weight, crc32 of the arrays
+HEADER_LEN = 8
+
+
+class RankPdf(object):
+    """
+    pdf of one partition, P(rank) = weights[rank - 1] / total, indexed like an array of n values
+    without copying the shared weights
+    param weights: rank ^ (-alpha) of every rank, at least n long
+    param n: number of ranks of the partition
+    param total: sum of the first n weights
+    """
+    def __init__(self, weights, n, total):
+        self.weights = weights
+        self.n = n
+        self.total = total
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return self.weights[:self.n][index] / self.total
+
+    def __array__(self, dtype=None, copy=None):
+        pdf = self.weights[:self.n] / self.total
+        return pdf if dtype is None else pdf.astype(dtype)
+
+
+class RankDistributions(object):
+    """
+    dict like mapping of partition number -> {'pdf', 'strata_ends', 'strata'}
+    param size: experience replay size
+    param alpha: priority exponent
+    param batch_size: number of strata
+    param partition_num: number of partitions the size is split into
+    param learn_start: partitions smaller than this are never sampled
+    param max_rank: partitions larger than this are never sampled (defaults to size)
+    param cache_dir: directory of the on-disk distribution cache, None to disable
+    """
+    def __init__(self, size, alpha, batch_size, partition_num, learn_start, max_rank=None,
+                 cache_dir=None):
+        self.size = size
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.partition_num = partition_num
+        self.learn_start = learn_start
+        self.max_rank = size if max_rank is None else max_rank
+        # each part size
+        self.partition_size = int(math.floor(size / partition_num))
+
+        self.n_max = self.partition_size * partition_num
+        self.cache_dir = cache_dir
+        # strata ends for each partition, row p - 1, only filled from the cache
+        self.strata_table = None
+        self._built = {}
+
+        if cache_dir is None or not self._load_cache():
+            self.weights = np.power(np.arange(1, self.n_max + 1, dtype=np.float64), -alpha)
+            self.cumsum = np.cumsum(self.weights)
+            if cache_dir is not None:
+                self._save_cache()
+
+    def __contains__(self, partition):
+        n = partition * self.partition_size
+        return 1 <= partition <= self.partition_num and self.learn_start <= n <= self.max_rank
+
+    def __getitem__(self, partition):
+        if partition in self._built:
+            return self._built[partition]
+        if partition not in self:
+            raise KeyError(partition)
+        distribution = self._build(partition)
+        # record size only grows, smaller partitions aren't needed anymore
+        self._built = {partition: distribution}
+        return distribution
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return [p for p in range(1, self.partition_num + 1) if p in self]
+
+    def _build(self, partition):
+        n = partition * self.partition_size
+        total = self.cumsum[n - 1]
+        distribution = {}
+        distribution['total'] = total
+        distribution['pdf'] = RankPdf(self.weights, n, total)
+        # split to k segment, and than uniform sample in each k
+        # set k = batch_size, each segment has total probability is 1 / batch_size
+        # strata_ends keep each segment start pos and end pos
+        if self.strata_table is not None:
+            strata = np.array(self.strata_table[partition - 1], dtype=np.int64)
+        else:
+            strata = self._strata(n)
+        distribution['strata'] = strata
+        distribution['strata_ends'] = {s + 1: int(v) for s, v in enumerate(strata)}
+        return distribution
+
+    def _strata(self, n):
+        total = self.cumsum[n - 1]
+        steps = total * np.arange(1, self.batch_size) / float(self.batch_size)
+        ends = np.maximum(np.searchsorted(self.cumsum[:n], steps, side='left'), 1)
+        return np.concatenate(([0], ends, [n])).astype(np.int64)
+
+    def cache_path(self):
+        """
+        :return: path of the cache file for this configuration
+        """
+        name = 'rank_dist_v{}_{}_{!r}_{}_{}.npy'.format(CACHE_VERSION, self.size, float(self.alpha),
+                                                      self.batch_size, self.partition_num)
+        return os.path.join(self.cache_dir, name)
+
+    def _header(self, total, crc=0):
+        return [CACHE_VERSION, self.size, self.alpha, self.batch_size,
+                self.partition_num, self.n_max, total, crc]
+
+    def _load_cache(self):
+        """
+        map the cache file, checking it against the parameters
+        :return: bool, loaded
+        """
+        path = self.cache_path()
+        if not os.path.exists(path):
+            return False
+        n = self.n_max
+        table_len = self.partition_num * (self.batch_size + 1)
+        try:
+            data = np.load(path, mmap_mode='r')
+            if data.dtype != np.float64 or data.shape != (HEADER_LEN + 2 * n + table_len,):
+                raise ValueError('unexpected shape')
+            weights = data[HEADER_LEN:HEADER_LEN + n]
+            cumsum = data[HEADER_LEN + n:HEADER_LEN + 2 * n]
+            if list(data[:HEADER_LEN - 2]) != self._header(0)[:-2] or data[HEADER_LEN - 2] != cumsum[-1]:
+                raise ValueError('header mismatch')
+            if zlib.crc32(data[HEADER_LEN:]) != data[HEADER_LEN - 1]:
+                raise ValueError('checksum mismatch')
+            table = data[HEADER_LEN + 2 * n:].reshape(self.partition_num, self.batch_size + 1)
+            ends = np.arange(1, self.partition_num + 1) * self.partition_size
+            if np.any(table[:, 0] != 0) or np.any(table[:, -1] != ends) or np.any(np.diff(table) < 0):
+                raise ValueError('bad strata')
+        except (ValueError, OSError, EOFError) as e:
+            sys.stderr.write('Distribution cache {} is stale or corrupted ({}), rebuilding\n'.format(path, e))
+            return False
+        self.weights = weights
+        self.cumsum = cumsum
+        self.strata_table = table
+        return True
+
+    def _save_cache(self):
+        """
+        write the cache file atomically, so concurrent readers never see a partial file
+        """
+        table = np.concatenate([self._strata(p * self.partition_size)
+                                for p in range(1, self.partition_num + 1)])
+        payload = np.concatenate((self.weights, self.cumsum, table)).astype(np.float64)
+        header = self._header(self.cumsum[-1], zlib.crc32(payload))
+        data = np.concatenate((header, payload))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp, self.cache_path())
+        except OSError as e:
+            sys.stderr.write('Error: failed to write distribution cache ({})\n'.format(e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
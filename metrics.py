@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Optional counters, timing histograms and gauges for the experience replay hot paths
+
+import math
+import time
+import functools
+import numpy as np
+
+"""
+Metrics is attached by passing it to rank_based.Experience(metrics=...) or by calling
+metrics.instrument(experience) (e.g. after Experience.load). instrument replaces the hot methods
+of that one instance (store, store_batch, sample, update_priority, update_priority_batch, evict,
+flush_updates and the heap rebuilds) with timed wrappers, so an Experience without metrics runs
+the plain methods and pays nothing.
+Timings go into histograms with power of two nanosecond buckets, p50 / p99 are read from the
+bucket edges. flush_updates is only recorded when it applied something, and a heap rebuild is
+recorded once, not also as the balance_tree it runs. Gauges (fill level, priority stats, beta) are only computed by snapshot().
+callback(kind, name, value) is called for every event ('timing', 'counter') if given, to forward
+them somewhere else.
+"""
+
+# timing histogram buckets, bucket i counts durations in [2^(i-1), 2^i) nanoseconds
+NUM_BUCKETS = 48
+
+# method name -> (metric name, number of items handled, from the arguments and the result)
+EXPERIENCE_METHODS = {
+    'store': ('store', lambda args, res: int(bool(res))),
+    'store_batch': ('store_batch', lambda args, res: res),
+    'sample': ('sample', lambda args, res: 0 if res[2] is False else len(res[2])),
+    'update_priority': ('update', lambda args, res: len(args[0])),
+    'update_priority_batch': ('update', lambda args, res: len(args[0])),
+    'evict': ('evict', lambda args, res: len(res)),
+    'flush_updates': ('flush', lambda args, res: res),
+}
+# metrics whose calls handling no item aren't recorded (flush_updates runs on every sample)
+SKIP_EMPTY = ('flush',)
+# only the outermost of nested calls is recorded (_rebuild runs balance_tree)
+HEAP_METHODS = {
+    '_rebuild': ('rebuild', None),
+    'balance_tree': ('balance', None),
+}
+
+
+class Timing(object):
+    """
+    histogram of call durations
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * NUM_BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        ns = int(seconds * 1e9)
+        self.buckets[min(ns.bit_length(), NUM_BUCKETS - 1)] += 1
+
+    def percentile(self, q):
+        """
+        :param q: percentile in [0, 100]
+        :return: float, upper edge in seconds of the bucket holding the q-th percentile
+        """
+        if not self.count:
+            return 0.0
+        target = math.ceil(self.count * q / 100.0)
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= max(target, 1):
+                return min((1 << i) * 1e-9, self.max)
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'total_s': self.total,
+                'mean_us': self.total / self.count * 1e6 if self.count else 0.0,
+                'p50_us': self.percentile(50) * 1e6,
+                'p99_us': self.percentile(99) * 1e6,
+                'max_us': self.max * 1e6}
+
+
+class Metrics(object):
+    """
+    param callback: function(kind, name, value) called on every timing / counter event, or None
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.counters = {}
+        self.timings = {}
+        # name -> function returning the gauge value, evaluated by snapshot
+        self.gauges = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.callback is not None:
+            self.callback('counter', name, n)
+
+    def observe(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = Timing()
+        timing.add(seconds)
+        if self.callback is not None:
+            self.callback('timing', name, seconds)
+
+    def gauge(self, name, func):
+        """
+        register a gauge
+        :param func: function without arguments returning the current value
+        """
+        self.gauges[name] = func
+
+    def wrap(self, name, func, items=None, depth=None):
+        """
+        :param name: metric name
+        :param func: function to time
+        :param items: function(args, result) returning the number of items handled, counted as name
+        :param depth: one item list shared by wrappers of which only the outermost call is
+            recorded, None to record every call
+        :return: timed function
+        """
+        skip_empty = name in SKIP_EMPTY
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            if depth is not None:
+                if depth[0]:
+                    return func(*args, **kwargs)
+                depth[0] += 1
+            try:
+                start = time.perf_counter()
+                res = func(*args, **kwargs)
+                elapsed = time.perf_counter() - start
+            finally:
+                if depth is not None:
+                    depth[0] -= 1
+            n = None if items is None else items(args, res)
+            if skip_empty and not n:
+                return res
+            self.observe(name, elapsed)
+            if n is not None:
+                self.count(name, n)
+            return res
+        return timed
+
+    def instrument(self, experience):
+        """
+        time the hot methods of an experience (rank_based.Experience) and its heap, and
+        register its gauges
+        :param experience: Experience instance
+        :return: None
+        """
+        self._instrument(experience, EXPERIENCE_METHODS)
+        self._instrument(experience.queue, HEAP_METHODS, depth=[0])
+        heap = experience.queue
+        self.gauge('fill', lambda: heap.get_size() / float(experience.max_size))
+        self.gauge('size', heap.get_size)
+        self.gauge('max_priority', lambda: float(heap.get_max_priority()))
+        self.gauge('priority', lambda: priority_stats(heap.get_priorities()))
+        self.gauge('beta', lambda: experience.current_beta)
+        self.gauge('rank_error', experience.rank_error)
+
+    def _instrument(self, obj, methods, depth=None):
+        for attr, (name, items) in methods.items():
+            method = getattr(obj, attr, None)
+            if method is not None and not hasattr(method, '__wrapped__'):
+                setattr(obj, attr, self.wrap(name, method, items, depth))
+
+    def snapshot(self):
+        """
+        :return: dict of counters, timing summaries and gauge values
+        """
+        return {'counters': dict(self.counters),
+                'timings': dict((n, t.summary()) for n, t in self.timings.items()),
+                'gauges': dict((n, f()) for n, f in self.gauges.items())}
+
+    def reset(self):
+        """
+        clear the counters and timings, the gauges stay registered
+        """
+        self.counters = {}
+        self.timings = {}
+
+
+def priority_stats(priorities):
+    """
+    :param priorities: priorities of every experience, O(n)
+    :return: dict, min / mean / max / std and median
+    """
+    priorities = np.asarray(priorities, dtype=np.float64)
+    if not len(priorities):
+        return {'min': 0.0, 'mean': 0.0, 'max': 0.0, 'std': 0.0, 'median': 0.0}
+    return {'min': float(priorities.min()), 'mean': float(priorities.mean()),
+            'max': float(priorities.max()), 'std': float(priorities.std()),
+            'median': float(np.median(priorities))}
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Streaming n-step transition builder in front of Experience.store_batch
+
+import numpy as np
+
+"""
+NStepBuilder keeps a rolling window of the last n steps of every environment of a vectorized
+env and stores (s_t, a_t, r_t + gamma r_t+1 + .. + gamma^(n-1) r_t+n-1, s_t+n, t) transitions as
+soon as they are complete. Each pending transition holds its partial return, a step adds
+gamma^age * r to every pending return of its env, so a step is a fixed number of numpy calls
+over (num_envs, n) arrays whatever the episode length, and no return is recomputed.
+Completed transitions of one step are stored with one store_batch, so they get the heap's
+max priority like any new experience.
+On a terminal every pending transition of the env is stored with t=True and its partial return
+(nothing is bootstrapped from the terminal state). On a truncation (time limit) the complete
+window is stored and the shorter pending ones are dropped, since their s2 would need a gamma^k
+bootstrap that a (s1, a, r, s2, t) transition can't carry.
+"""
+
+
+class NStepBuilder(object):
+    """
+    param experience: Experience with store_batch (rank_based, proportional, ...)
+    param n: number of steps of the returns
+    param gamma: discount
+    param num_envs: number of environments, add takes arrays with a leading num_envs axis
+    """
+    def __init__(self, experience, n=3, gamma=0.99, num_envs=1):
+        if n < 1:
+            raise ValueError('n must be at least 1')
+        self.experience = experience
+        self.n = n
+        self.gamma = gamma
+        self.num_envs = num_envs
+        # gamma ^ age of a pending transition, age = number of rewards it has seen
+        self._powers = gamma ** np.arange(n, dtype=np.float64)
+        # per env ring of pending transitions: oldest slot and number pending
+        self._start = np.zeros(num_envs, dtype=np.int64)
+        self._count = np.zeros(num_envs, dtype=np.int64)
+        self._age = np.zeros((num_envs, n), dtype=np.int64)
+        self._returns = np.zeros((num_envs, n), dtype=np.float64)
+        # allocated on the first add, from the shapes and dtypes of the states and actions
+        self._states = None
+        self._actions = None
+        self.stored = 0
+
+    def pending(self):
+        """
+        :return: np.ndarray, number of incomplete transitions per env
+        """
+        return self._count.copy()
+
+    def reset(self, envs=None):
+        """
+        drop the pending transitions of envs (all by default)
+        """
+        if envs is None:
+            self._count[:] = 0
+        else:
+            self._count[envs] = 0
+
+    def add(self, s1, a, r, s2, t, truncated=None):
+        """
+        add one step of every env, arrays with a leading num_envs axis (plain values for a
+        single env are accepted too)
+        :param s1, a, r, s2, t: states, actions, rewards, next states, terminals
+        :param truncated: bool array, episode cut without a terminal, None for no truncation
+        :return: int, number of transitions stored
+        """
+        if self.num_envs == 1 and np.ndim(r) == 0:
+            s1, a, r, s2, t = (np.asarray(v)[None] for v in (s1, a, r, s2, t))
+            truncated = None if truncated is None else np.asarray(truncated)[None]
+        s1 = np.asarray(s1)
+        a = np.asarray(a)
+        s2 = np.asarray(s2)
+        r = np.asarray(r, dtype=np.float64)
+        t = np.asarray(t, dtype=np.bool_)
+        if self._states is None:
+            self._states = np.zeros((self.num_envs, self.n) + s1.shape[1:], dtype=s1.dtype)
+            self._actions = np.zeros((self.num_envs, self.n) + a.shape[1:], dtype=a.dtype)
+        envs = np.arange(self.num_envs)
+        n = self.n
+
+        # open a new pending transition per env
+        slot = (self._start + self._count) % n
+        self._states[envs, slot] = s1
+        self._actions[envs, slot] = a
+        self._returns[envs, slot] = 0.0
+        self._age[envs, slot] = 0
+        self._count += 1
+
+        # add the reward to every pending return
+        offsets = (np.arange(n) - self._start[:, None]) % n
+        live = offsets < self._count[:, None]
+        self._returns += np.where(live, self._powers[np.minimum(self._age, n - 1)] * r[:, None], 0.0)
+        self._age += live
+
+        rows = []
+        # terminal envs: every pending transition is done, nothing to bootstrap
+        done = np.nonzero(t)[0]
+        if len(done):
+            # oldest first
+            env, off = np.nonzero(np.arange(n) < self._count[done][:, None])
+            env = done[env]
+            rows.append((env, (self._start[env] + off) % n, np.ones(len(env), dtype=np.bool_)))
+            self._count[done] = 0
+        # full windows: the oldest pending transition has n rewards
+        full = np.nonzero((self._count == n) & ~t)[0]
+        if len(full):
+            rows.append((full, self._start[full], np.zeros(len(full), dtype=np.bool_)))
+            self._start[full] = (self._start[full] + 1) % n
+            self._count[full] -= 1
+        if truncated is not None:
+            # shorter windows can't be bootstrapped with gamma^n, drop them
+            self._count[np.asarray(truncated, dtype=np.bool_)] = 0
+
+        if not rows:
+            return 0
+        env = np.concatenate([e for e, _, _ in rows])
+        pos = np.concatenate([p for _, p, _ in rows])
+        terminal = np.concatenate([d for _, _, d in rows])
+        batch = (self._states[env, pos], self._actions[env, pos], self._returns[env, pos],
+                 s2[env], terminal)
+        stored = self.experience.store_batch(batch)
+        self.stored += stored
+        return stored
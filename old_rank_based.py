@@ -10,6 +10,13 @@ import random
 import numpy as np
 
 import binary_heap
+import distributions
+import storage
+
+
+# how sampled ranks are mapped to experience ids: the exact rank index, or the heap array
+# position, which approximates the rank order when the heap is rebalanced regularly
+RANK_MODES = ('exact', 'position')
 
 
 class Experience(object):
@@ -26,58 +33,52 @@ class Experience(object):
         self.total_steps = conf['steps'] if 'steps' in conf else 100000
         # partition number N, split total size to N part
         self.partition_num = conf['partition_num'] if 'partition_num' in conf else 100
+        # directory of the on-disk distribution cache, None to disable
+        self.cache_dir = conf['cache_dir'] if 'cache_dir' in conf else None
 
         self.index = 0
         self.record_size = 0
         self.isFull = False
 
         self._experience = {}
+        # array backed storage, replaces _experience and fix_index when given
+        # either pass a storage object or the state_shape (and dtypes) to build an ArrayStorage
+        self.storage = conf['storage'] if 'storage' in conf else None
+        if self.storage is None and 'state_shape' in conf:
+            self.storage = storage.ArrayStorage(
+                self.size, conf['state_shape'],
+                state_dtype=conf['state_dtype'] if 'state_dtype' in conf else np.float32,
+                action_shape=conf['action_shape'] if 'action_shape' in conf else (),
+                action_dtype=conf['action_dtype'] if 'action_dtype' in conf else np.int64,
+                reward_dtype=conf['reward_dtype'] if 'reward_dtype' in conf else np.float32)
         self.priority_queue = binary_heap.BinaryHeap(self.priority_size)
         self.distributions = self.build_distributions()
 
+        self.rank_mode = conf['rank_mode'] if 'rank_mode' in conf else 'exact'
+        if self.rank_mode not in RANK_MODES:
+            raise ValueError('rank_mode must be one of {}'.format(RANK_MODES))
+        # sort the heap every rebalance_interval steps, and / or whenever the measured
+        # disorder (fraction of adjacent heap entries out of order) goes over rebalance_disorder
+        self.rebalance_interval = conf['rebalance_interval'] if 'rebalance_interval' in conf else None
+        self.rebalance_disorder = conf['rebalance_disorder'] if 'rebalance_disorder' in conf else None
+        self.disorder_samples = conf['disorder_samples'] if 'disorder_samples' in conf else 64
+        self.last_rebalance = 0
+        self.rebalance_count = 0
+        self.rng = np.random.default_rng()
+
         self.beta_grad = (1 - self.beta_zero) / float(self.total_steps - self.learn_start)
 
     def build_distributions(self):
         """
         preprocess pow of rank
         (rank i) ^ (-alpha) / sum ((rank i) ^ (-alpha))
-        :return: distributions, dict
-        """
-        res = {}
-        n_partitions = self.partition_num
-        partition_num = 1
-        # each part size
-        partition_size = int(math.floor(self.size / n_partitions))
-
-        for n in range(partition_size, self.size + 1, partition_size):
-            if self.learn_start <= n <= self.priority_size:
-                distribution = {}
-                # P(i) = (rank i) ^ (-alpha) / sum ((rank i) ^ (-alpha))
-                pdf = list(
-                    map(lambda x: math.pow(x, -self.alpha), range(1, n + 1))
-                )
-                pdf_sum = math.fsum(pdf)
-                distribution['pdf'] = list(map(lambda x: x / pdf_sum, pdf))
-                # split to k segment, and than uniform sample in each k
-                # set k = batch_size, each segment has total probability is 1 / batch_size
-                # strata_ends keep each segment start pos and end pos
-                cdf = np.cumsum(distribution['pdf'])
-                strata_ends = {1: 0, self.batch_size + 1: n}
-                step = 1 / float(self.batch_size)
-                index = 1
-                for s in range(2, self.batch_size + 1):
-                    while cdf[index] < step:
-                        index += 1
-                    strata_ends[s] = index
-                    step += 1 / float(self.batch_size)
-
-                distribution['strata_ends'] = strata_ends
-
-                res[partition_num] = distribution
-
-            partition_num += 1
-
-        return res
+        partitions are built lazily the first time they are sampled
+        :return: distributions, dict like RankDistributions
+        """
+        return distributions.RankDistributions(self.size, self.alpha, self.batch_size,
+                                                 self.partition_num, self.learn_start,
+                                                 max_rank=self.priority_size,
+                                                 cache_dir=self.cache_dir)
 
     def fix_index(self):
         """
@@ -105,6 +106,8 @@ class Experience(object):
         :param experience: maybe a tuple, or list
         :return: bool, indicate insert status
         """
+        if self.storage is not None:
+            return self.store_array(experience)
         insert_index = self.fix_index()
         if insert_index > 0:
             if insert_index in self._experience:
@@ -112,27 +115,63 @@ class Experience(object):
             self._experience[insert_index] = experience
             # add to priority queue
             priority = self.priority_queue.get_max_priority()
-            #self.priority_queue.update(priority, insert_index)
-            self.priority_queue.push(experience)
+            self.priority_queue.push((priority, insert_index))
             return True
         else:
             sys.stderr.write('Insert failed\n')
             return False
 
+    def store_array(self, experience):
+        """
+        store experience in the array storage, the storage cursor wraps instead of fix_index
+        :param experience: tuple of (s1, a, r, s2, t)
+        :return: bool, indicate insert status
+        """
+        if self.storage.is_full() and not self.replace_flag:
+            sys.stderr.write('Experience replay buff is full and replace is set to FALSE!\n')
+            sys.stderr.write('Insert failed\n')
+            return False
+        insert_index = self.storage.append(experience) + 1
+        self.index = insert_index
+        self.record_size = len(self.storage)
+        self.isFull = self.storage.is_full()
+        priority = self.priority_queue.get_max_priority()
+        self.priority_queue.push((priority, insert_index))
+        return True
+
     def retrieve(self, indices):
         """
         get experience from indices
         :param indices: list of experience id
-        :return: experience replay sample
+        :return: experience replay sample, a tuple of arrays (s1, a, r, s2, t) with array storage
         """
+        if self.storage is not None:
+            return self.storage.gather(np.asarray(indices) - 1)
         return [self._experience[v] for v in indices]
 
     def rebalance(self):
         """
-        rebalance priority queue
+        rebalance priority queue, sorting it so array positions match ranks
         :return: None
         """
         self.priority_queue.balance_tree()
+        self.rebalance_count += 1
+
+    def maybe_rebalance(self, global_step):
+        """
+        rebalance when the interval has passed or the heap is too disordered
+        :param global_step: now training step
+        :return: bool, rebalanced
+        """
+        due = self.rebalance_interval is not None and \
+            global_step - self.last_rebalance >= self.rebalance_interval
+        if not due and self.rebalance_disorder is not None:
+            due = self.priority_queue.disorder(self.disorder_samples, self.rng) > self.rebalance_disorder
+        if not due:
+            return False
+        self.rebalance()
+        self.last_rebalance = global_step
+        return True
 
     def update_priority(self, indices, delta):
         """
@@ -142,7 +181,7 @@ class Experience(object):
         :return: None
         """
         for i in range(0, len(indices)):
-            self.priority_queue.update(math.fabs(delta[i]), indices[i])
+            self.priority_queue.update(indices[i], math.fabs(delta[i]))
 
     def sample(self, global_step):
         """
@@ -155,6 +194,7 @@ class Experience(object):
         if self.record_size < self.learn_start:
             sys.stderr.write('Record size less than learn start! Sample failed\n')
             return False, False, False
+        self.maybe_rebalance(global_step)
 
         dist_index = math.floor(self.record_size / self.size * self.partition_num)
         # issue 1 by @camigord
@@ -177,8 +217,11 @@ class Experience(object):
         w_max = max(w)
         w = np.divide(w, w_max)
         # rank list is priority id
-        # convert to experience id
-        rank_e_id = self.priority_queue.priority_to_experience(rank_list)
+        # convert to experience id, by heap array position (O(1)) in position mode
+        if self.rank_mode == 'position':
+            rank_e_id = self.priority_queue.position_to_experience([v - 1 for v in rank_list])
+        else:
+            rank_e_id = self.priority_queue.priority_to_experience(rank_list)
         # get experience id according rank_e_id
         experience = self.retrieve(rank_e_id)
         return experience, w, rank_e_id
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Thread-safe experience replay wrapper with a background prefetching sampler
+
+import queue
+import threading
+import numpy as np
+
+"""
+PrefetchSampler wraps an Experience (rank_based or proportional) behind a lock and keeps a
+bounded queue of ready batches (experience, w, e_id) filled by background threads, so the
+training thread only pops a batch. store/update_priority go through the same lock.
+A prefetched batch is stale when one of its ids had its priority updated, or was reused by a
+store after an eviction, since the batch was drawn. stale='drop' discards such batches,
+stale='keep' hands them out anyway. The importance weights are rescaled to the beta of the
+global step the batch is handed out at, w ^ (beta / beta_drawn), which is exact since
+w = (x / x_min) ^ -beta.
+An exception raised by Experience.sample in a worker stops that worker and is raised again by the
+next sample() call, which also raises once every worker has stopped instead of waiting forever.
+"""
+
+STALE_POLICIES = ('drop', 'keep')
+
+
+class PrefetchSampler(object):
+    """
+    param experience: Experience to sample from
+    param num_batches: max number of prefetched batches
+    param num_workers: number of sampling threads
+    param stale: policy for batches with ids updated after prefetching, 'drop' or 'keep'
+    """
+    def __init__(self, experience, num_batches=4, num_workers=1, stale='drop'):
+        if stale not in STALE_POLICIES:
+            raise ValueError('stale must be one of {}'.format(STALE_POLICIES))
+        self.experience = experience
+        self.stale = stale
+        self.lock = threading.RLock()
+        self.batches = queue.Queue(maxsize=num_batches)
+        # update sequence number, and the last one each experience id was updated at
+        self._seq = 0
+        self._updated = np.zeros(experience.max_size + 1, dtype=np.int64)
+        self._global_step = experience.learn_start + 1
+        self.dropped = 0
+        # first exception raised by a worker, raised again by sample
+        self.error = None
+
+        self._stop = threading.Event()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def store(self, experience):
+        with self.lock:
+            inserted = self.experience.store(experience)
+            if inserted:
+                # the id may be a reused one, prefetched batches holding it are stale
+                self._mark([self.experience.index])
+            return inserted
+
+    def store_batch(self, experiences):
+        with self.lock:
+            inserted = self.experience.store_batch(experiences)
+            if inserted:
+                self._mark(self.experience.stored_e_ids)
+            return inserted
+
+    def update_priority(self, indices, delta):
+        with self.lock:
+            self.experience.update_priority(indices, delta)
+            self._mark(indices)
+
+    def update_priority_batch(self, indices, delta):
+        with self.lock:
+            self.experience.update_priority_batch(indices, delta)
+            self._mark(indices)
+
+    def _mark(self, indices):
+        self._seq += 1
+        self._updated[np.asarray(indices, dtype=np.int64)] = self._seq
+
+    def beta(self, global_step):
+        """
+        :return: float, beta used by Experience.sample at global_step
+        """
+        experience = self.experience
+        beta = experience.beta_zero + (global_step - experience.learn_start - 1) * experience.beta_grad
+        return min(beta, 1)
+
+    def sample(self, global_step):
+        """
+        pop the next prefetched batch, see Experience.sample
+        :param global_step: now training step, the weights use its beta
+        :return: experience, w, e_id
+        """
+        self._global_step = global_step
+        if self.experience.record_size < self.experience.learn_start:
+            with self.lock:
+                return self.experience.sample(global_step)
+        while True:
+            seq, beta, batch = self._get()
+            if self.stale == 'drop':
+                with self.lock:
+                    stale = np.any(self._updated[np.asarray(batch[2], dtype=np.int64)] > seq)
+                if stale:
+                    self.dropped += 1
+                    continue
+            return self._reweight(batch, beta, global_step)
+
+    def _get(self):
+        # next queued batch, raises the error of a worker, or when no worker is left to fill the queue
+        while True:
+            try:
+                item = self.batches.get(timeout=0.1)
+            except queue.Empty:
+                if self.error is not None:
+                    raise self.error
+                if not any(worker.is_alive() for worker in self._workers):
+                    raise RuntimeError('prefetch workers stopped')
+                continue
+            if isinstance(item[2], BaseException):
+                raise item[2]
+            return item
+
+    def _reweight(self, batch, beta, global_step):
+        # rescale the weights drawn with beta to the beta of global_step
+        new_beta = self.beta(global_step)
+        if new_beta == beta:
+            return batch
+        if beta <= 0:
+            # w is all ones, the priorities are lost, draw the batch again
+            with self.lock:
+                return self.experience.sample(global_step)
+        experience, w, e_id = batch
+        return experience, np.power(w, new_beta / beta), e_id
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                with self.lock:
+                    ready = self.experience.record_size >= self.experience.learn_start
+                    if ready:
+                        seq = self._seq
+                        global_step = self._global_step
+                        batch = self.experience.sample(global_step)
+                if not ready:
+                    self._stop.wait(0.01)
+                    continue
+                item = (seq, self.beta(global_step), batch)
+            except Exception as e:
+                # hand the error to the training thread, this worker stops
+                if self.error is None:
+                    self.error = e
+                item = (None, None, e)
+            while not self._stop.is_set():
+                try:
+                    self.batches.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if isinstance(item[2], BaseException):
+                return
+
+    def close(self):
+        """
+        stop the workers
+        """
+        self._stop.set()
+        for worker in self._workers:
+            worker.join()
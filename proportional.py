@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Proportional prioritized experience replay backed by a sum tree
+
+import sys
+import numpy as np
+
+"""
+Proportional variant of prioritized experience replay, P(i) = p_i ^ alpha / sum_k p_k ^ alpha
+with p_i = |delta_i| + eps. Priorities live in a flat numpy sum tree: leaf i is at
+tree[capacity + i] and every node holds the sum of its two children, so the root is the total.
+Sampling and updates walk the tree level by level for the whole batch at once, O(batch log n)
+"""
+
+class SumTree(object):
+    """
+    param capacity: number of leaves, rounded up to a power of two
+    param tree: optional preallocated float64 array of tree_len(capacity) zeros (e.g. shared memory)
+    """
+    def __init__(self, capacity, tree=None):
+        self.size = capacity
+        self.capacity = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.zeros(2 * self.capacity, dtype=np.float64) if tree is None else tree
+
+    @staticmethod
+    def tree_len(capacity):
+        return 2 << max(capacity - 1, 1).bit_length()
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        """
+        :param indices: array of leaf indices
+        :return: array of leaf values
+        """
+        return self.tree[self.capacity + np.asarray(indices, dtype=np.int64)]
+
+    def update(self, indices, values):
+        """
+        set leaf values and recompute the sums above them, for repeated indices the last one wins
+        :param indices: array of leaf indices
+        :param values: array of leaf values
+        """
+        nodes = self.capacity + np.asarray(indices, dtype=np.int64)
+        self.tree[nodes] = values
+        # all leaves are on the same level, so are their parents
+        nodes = np.unique(nodes >> 1)
+        while True:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes >> 1)
+
+    def find(self, values):
+        """
+        find the leaves whose prefix sums cover values
+        :param values: array of values in [0, total)
+        :return: array of leaf indices
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            nodes *= 2
+            left = self.tree[nodes]
+            right = values >= left
+            values -= left * right
+            nodes += right
+        # floating point error can land on an empty leaf past the last one in use
+        return np.minimum(nodes - self.capacity, self.size - 1)
+
+
+class Experience(object):
+
+    def __init__(self, max_size=100000, alpha=0.6, beta_zero=0.4, batch_size=32,
+                learn_start=1000, total_steps = 100000, eps=1e-6, seed=None, storage=None):
+        self.max_size = max_size
+        self.alpha = alpha
+        self.beta_zero = beta_zero
+        self.batch_size = batch_size
+        self.learn_start = learn_start
+        self.total_steps = total_steps
+        # keeps transitions with zero TD-error sampleable
+        self.eps = eps
+
+        self.index = 0
+        self.record_size = 0
+        self.isFull = False
+        # ids written by the last store_batch
+        self.stored_e_ids = np.zeros(0, dtype=np.int64)
+        self._experience = {}
+        # optional storage backend (see storage.py) used instead of _experience
+        self.storage = storage
+
+        self.tree = SumTree(self.max_size)
+        # priority ^ alpha given to new experiences
+        self.max_priority = 1.0
+        self.beta_grad = (1 - self.beta_zero) / float(self.total_steps - self.learn_start)
+        # numpy.random.Generator used for sampling
+        self.rng = np.random.default_rng(seed)
+
+    def store(self, experience):
+        """
+        store experience in the tuple - form (s1, a, r, s2, t), the oldest is replaced once full
+        new experiences get the current max priority
+        :param experience: tuple
+        :return: bool - inserted
+        """
+        if self.storage is not None:
+            self.index = self.storage.append(experience) + 1
+        else:
+            self.index = self.index % self.max_size + 1
+            self._experience[self.index] = experience
+        self.record_size = min(self.record_size + 1, self.max_size)
+        self.isFull = self.record_size >= self.max_size
+        self.tree.update([self.index - 1], [self.max_priority])
+        return True
+
+    def store_batch(self, experiences):
+        """
+        store a batch of experiences with a single tree update
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        :return: int - number inserted
+        """
+        k = len(experiences[1])
+        if k == 0:
+            return 0
+        if self.storage is not None:
+            e_ids = self.storage.append_batch(experiences) + 1
+        else:
+            e_ids = (self.index + np.arange(k)) % self.max_size + 1
+            for e_id, experience in zip(e_ids, zip(*experiences)):
+                self._experience[int(e_id)] = experience
+        self.index = int(e_ids[-1])
+        self.stored_e_ids = np.asarray(e_ids, dtype=np.int64)
+        self.record_size = min(self.record_size + k, self.max_size)
+        self.isFull = self.record_size >= self.max_size
+        self.tree.update(e_ids - 1, self.max_priority)
+        return k
+
+    def retrieve(self, indices):
+        """
+        get experience from indices
+        :param indices: list of experience id
+        :return: experience replay sample, a tuple of arrays (s1, a, r, s2, t) with a storage backend
+        """
+        if self.storage is not None:
+            return self.storage.gather(np.asarray(indices) - 1)
+        return [self._experience[v] for v in indices]
+
+    def update_priority(self, indices, delta):
+        """
+        update priority according indices and deltas
+        :param indices: list of experience id
+        :param delta: list of delta, order correspond to indices
+        :return: None
+        """
+        priorities = np.power(np.abs(np.asarray(delta, dtype=np.float64)) + self.eps, self.alpha)
+        self.tree.update(np.asarray(indices, dtype=np.int64) - 1, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
+
+    update_priority_batch = update_priority
+
+    def sample(self, global_step):
+        """
+        sample a mini batch from experience replay, one sample from each of batch_size
+        equal segments of the total priority
+        :param global_step: now training step
+        :return: experience, list, samples
+        :return: w, np.ndarray, weights
+        :return: e_id, np.ndarray, samples id, used for update priority
+        """
+        if self.record_size < self.learn_start:
+            sys.stderr.write('Record size less than learn start! Sample failed\n')
+            return False, False, False
+
+        total = self.tree.total()
+        segment = total / self.batch_size
+        values = (np.arange(self.batch_size) + self.rng.random(self.batch_size)) * segment
+        # slots past record_size are empty, floating point error could still reach them
+        slots = np.minimum(self.tree.find(values), self.record_size - 1)
+
+        # beta, increase by global_step, max 1
+        beta = min(self.beta_zero + (global_step - self.learn_start - 1) * self.beta_grad, 1)
+        # w = (N * P(i)) ^ (-beta) / max w
+        w = self.tree.get(slots)
+        w *= self.record_size / total
+        np.power(w, -beta, out=w)
+        w /= w.max()
+        e_id = slots + 1
+        experience = self.retrieve(e_id)
+        return experience, w, e_id
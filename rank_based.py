@@ -6,15 +6,26 @@
 
 import sys
 import math
-import random
 import numpy as np
 import binary_heap
+import distributions
+import rank_index
+import snapshot
+import update_log
+
+
+EVICTION_POLICIES = (None, 'fifo', 'lowest', 'random')
+# rank index kept by the heap: 'exact' (rank_index.RankIndex) or 'bucket' (approximate
+# rank_index.BucketRankIndex with O(1) priority updates)
+RANKINGS = ('exact', 'bucket')
 
 
 class Experience(object):
 
     def __init__(self, max_size=100000, alpha=0.7, beta_zero=0.5, batch_size=32,
-                learn_start=1000, total_steps = 100000, partition_num = 100):
+                learn_start=1000, total_steps = 100000, partition_num = 100, cache_dir=None,
+                seed=None, storage=None, eviction=None, compact_heap=False, ranking='exact',
+                update_log_size=None, metrics=None, sampling=True):
         self.max_size = max_size
         self.alpha = alpha
         self.beta_zero = beta_zero
@@ -22,80 +33,187 @@ class Experience(object):
         self.learn_start = learn_start
         self.total_steps = total_steps
         self.partition_num = partition_num
+        # directory of the on-disk distribution cache, None to disable
+        self.cache_dir = cache_dir
 
         self.index = 0
         self.record_size = 0
+        # ids written by the last store_batch
+        self.stored_e_ids = np.zeros(0, dtype=np.int64)
         self.isFull = False
-        self.exp_queue = {}
+        self._experience = {}
+        # optional storage backend (see storage.py) used instead of _experience
+        self.storage = storage
+        # what to replace once full: None (refuse to insert), 'fifo', 'lowest' priority or 'random'
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError('eviction must be one of {}'.format(EVICTION_POLICIES))
+        if eviction not in (None, 'fifo') and storage is not None and not hasattr(storage, 'put'):
+            raise ValueError('{} eviction needs a storage supporting put'.format(eviction))
+        self.eviction = eviction
 
-        self.queue = binary_heap.BinaryHeap(max_len = self.max_size,
-                                            batch_size = self.batch_size)
-        self.distributions = self.build_distributions()
+        # numpy.random.Generator used for sampling
+        self.rng = np.random.default_rng(seed)
+        if ranking not in RANKINGS:
+            raise ValueError('ranking must be one of {}'.format(RANKINGS))
+        self.ranking = ranking
+        index = rank_index.BucketRankIndex(rng=self.rng) if ranking == 'bucket' else None
+        # array backed heap and rank index, ~25 bytes per entry instead of ~250 (bucket ranking keeps ~170)
+        self.compact_heap = compact_heap
+        heap = binary_heap.ArrayBinaryHeap if compact_heap else binary_heap.BinaryHeap
+        self.queue = heap(max_len = self.max_size, batch_size = self.batch_size, rank_index = index)
+        # False skips the rank distributions (weights and prefix sums, 16 bytes per entry) of a
+        # replay that is only stored to, updated and ranked, such as a sharded.py shard
+        self.sampling = sampling
+        self.distributions = self.build_distributions() if sampling else None
         self.beta_grad = (1 - self.beta_zero) / float(self.total_steps - self.learn_start)
+        # directory of the last snapshot saved or loaded
+        self.snapshot_path = None
+        # beta used by the last sample
+        self.current_beta = None
+        # write-behind priority updates, flushed by sample or once update_log_size are pending, the
+        # latter inside the update_priority call reaching it (see update_log.py)
+        self.update_log_size = update_log_size
+        self.update_log = update_log.UpdateLog(update_log_size) if update_log_size else None
+        # optional metrics.Metrics timing the hot methods, None costs nothing
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.instrument(self)
 
 
     def build_distributions(self):
         """
         preprocess pow of rank
         (rank i) ^ (-alpha) / sum ((rank i) ^ (-alpha))
-        :return: distributions, dict
-        """
-        res = {}
-        n_partitions = self.partition_num
-        partition_num = 1
-        # each part size
-        partition_size = int(math.floor(self.max_size / n_partitions))
-
-        for n in range(partition_size, self.max_size + 1, partition_size):
-            if self.learn_start <= n <= self.max_size:
-                distribution = {}
-                # P(i) = (rank i) ^ (-alpha) / sum ((rank i) ^ (-alpha))
-                pdf = list(
-                    map(lambda x: math.pow(x, -self.alpha), range(1, n + 1))
-                )
-                pdf_sum = math.fsum(pdf)
-                distribution['pdf'] = list(map(lambda x: x / pdf_sum, pdf))
-                # split to k segment, and than uniform sample in each k
-                # set k = batch_size, each segment has total probability is 1 / batch_size
-                # strata_ends keep each segment start pos and end pos
-                cdf = np.cumsum(distribution['pdf'])
-                strata_ends = {1: 0, self.batch_size + 1: n}
-                step = 1 / float(self.batch_size)
-                index = 1
-                for s in range(2, self.batch_size + 1):
-                    while cdf[index] < step:
-                        index += 1
-                    strata_ends[s] = index
-                    step += 1 / float(self.batch_size)
-
-                distribution['strata_ends'] = strata_ends
-
-                res[partition_num] = distribution
-
-            partition_num += 1
-
-        return res
+        partitions are built lazily the first time they are sampled
+        :return: distributions, dict like RankDistributions
+        """
+        return distributions.RankDistributions(self.max_size, self.alpha, self.batch_size,
+                                                 self.partition_num, self.learn_start,
+                                                 cache_dir=self.cache_dir)
 
     def store(self, experience):
         """
         store experience in the tuple - form (s1, a, r, s2, t)
+        new experiences get the current max priority
         :param experience: tuple
         :return: bool - inserted
         """
         if self.queue.is_full():
-            sys.stderr.write('Insert failed\n')
-            return False
-        self.queue.push(experience)
+            if self.eviction is None:
+                sys.stderr.write('Insert failed\n')
+                return False
+            priority = self.get_max_priority()
+            victim = self.evict(1)[0]
+            if self.storage is None:
+                self._experience[victim] = experience
+            elif self.eviction == 'fifo':
+                self.storage.append(experience)
+            else:
+                self.storage.put(victim - 1, experience)
+            self.index = victim
+            self.queue.push((priority, victim))
+            return True
+        if self.storage is not None:
+            self.index = self.storage.append(experience) + 1
+        else:
+            self.index += 1
+            self._experience[self.index] = experience
+        self.record_size += 1
+        self.isFull = self.record_size >= self.max_size
+        self.queue.push((self.get_max_priority(), self.index))
         return True
 
+    def evict(self, k, offset=0):
+        """
+        remove k experiences from the priority queue according to the eviction policy
+        their ids are free to be reused by the caller
+        :param k: number of experiences to evict
+        :param offset: number of ids about to be written ahead of the victims (fifo only)
+        :return: list of evicted experience ids
+        """
+        if self.eviction == 'lowest':
+            # the lowest priorities have to be up to date
+            self.flush_updates()
+        size = self.queue.get_size()
+        if self.eviction == 'fifo':
+            # the oldest ids are the next ones the write cursor reaches
+            cursor = self.storage.cursor if self.storage is not None else self.index % self.max_size
+            victims = [(cursor + offset + j) % self.max_size + 1 for j in range(k)]
+        elif self.eviction == 'lowest':
+            victims = self.queue.priority_to_experience(range(size - k + 1, size + 1))
+        else:
+            positions = self.rng.choice(size, k, replace=False)
+            victims = self.queue.position_to_experience(positions)
+        for victim in victims:
+            self.queue.remove(victim)
+        if self.update_log is not None and len(self.update_log):
+            # pending updates of a victim would apply to the experience reusing its id
+            self.update_log.discard(victims)
+        return victims
+
+    def store_batch(self, experiences):
+        """
+        store a batch of experiences with a single heap operation
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        :return: int - number inserted
+        """
+        k = len(experiences[1])
+        space = self.max_size - self.queue.get_size()
+        limit = space if self.eviction is None else self.max_size
+        if k > limit and self.eviction is None:
+            sys.stderr.write('Insert failed for the last {} of {} experiences\n'.format(k - limit, k))
+            experiences = tuple(column[:limit] for column in experiences)
+            k = limit
+        elif k > limit:
+            # a replay buffer keeps the newest transitions
+            sys.stderr.write('Insert dropped the first {} of {} experiences, more than max_size\n'
+                             .format(k - limit, k))
+            experiences = tuple(column[k - limit:] for column in experiences)
+            k = limit
+        if k <= 0:
+            return 0
+        priority = self.get_max_priority()
+        new = min(k, space)
+        e_ids = np.arange(self.index + 1, self.index + new + 1)
+        if k > new:
+            e_ids = np.concatenate((e_ids, self.evict(k - new, offset=new))).astype(np.int64)
+        if self.storage is not None and self.eviction in (None, 'fifo'):
+            e_ids = self.storage.append_batch(experiences) + 1
+        elif self.storage is not None:
+            # new rows go through the storage cursor like store does, victims are overwritten
+            if new:
+                e_ids[:new] = self.storage.append_batch(tuple(column[:new] for column in experiences)) + 1
+            if k > new:
+                self.storage.put_batch(e_ids[new:] - 1, tuple(column[new:] for column in experiences))
+        else:
+            for e_id, experience in zip(e_ids, zip(*experiences)):
+                self._experience[int(e_id)] = experience
+        self.index = int(e_ids[-1])
+        self.stored_e_ids = np.asarray(e_ids, dtype=np.int64)
+        self.record_size += new
+        self.isFull = self.record_size >= self.max_size
+        self.queue.push_batch([priority] * k, [int(e) for e in e_ids])
+        return k
+
     def retrieve(self, indices):
         """
         get experience from indices
         :param indices: list of experience id
-        :return: experience replay sample
+        :return: experience replay sample, a tuple of arrays (s1, a, r, s2, t) with a storage backend
         """
+        if self.storage is not None:
+            return self.storage.gather(np.asarray(indices) - 1)
         return [self._experience[v] for v in indices]
 
+    def get_max_priority(self):
+        """
+        :return: priority given to new experiences, including pending logged updates
+        """
+        priority = self.queue.get_max_priority()
+        if self.update_log is not None and len(self.update_log):
+            return max(priority, self.update_log.max_priority)
+        return priority
+
     def update_priority(self, indices, delta):
         """
         update priority according indices and deltas
@@ -103,44 +221,102 @@ class Experience(object):
         :param delta: list of delta, order correspond to indices
         :return: None
         """
+        if self.update_log is not None:
+            return self._log_updates(indices, np.abs(delta))
         for i in range(0, len(indices)):
-            self.queue.update(math.fabs(delta[i]), indices[i])
+            self.queue.update(indices[i], math.fabs(delta[i]))
+
+    def update_priority_batch(self, indices, delta):
+        """
+        update priority of a batch with a single heap operation
+        :param indices: array of experience id
+        :param delta: array of delta, order correspond to indices
+        :return: None
+        """
+        if self.update_log is not None:
+            return self._log_updates(indices, np.abs(delta))
+        self.queue.update_batch([int(e) for e in indices], np.abs(delta).tolist())
+
+    def _log_updates(self, indices, priorities):
+        self.update_log.append(indices, priorities)
+        if len(self.update_log) >= self.update_log_size:
+            # bounds the log, this call pays for the flush
+            self.flush_updates()
+
+    def flush_updates(self):
+        """
+        apply the logged priority updates, the last one of every id, with one heap operation
+        :return: int, number of experiences updated
+        """
+        if self.update_log is None or not len(self.update_log):
+            return 0
+        indices, priorities = self.update_log.coalesce()
+        self.update_log.clear()
+        return self.queue.update_batch(indices.tolist(), priorities.tolist())
+
+    def rank_error(self):
+        """
+        expected error of the ranks used by sample, 0 with exact ranking
+        :return: float, mean absolute rank error, in ranks
+        """
+        return self.queue.rank_index.rank_error()
+
+    def save(self, path, incremental=False):
+        """
+        save the full replay state, see snapshot.py
+        :param path: snapshot directory
+        :param incremental: only write transitions changed since the last save/load of path
+        :return: None
+        """
+        self.flush_updates()
+        snapshot.save(self, path, incremental)
+
+    @classmethod
+    def load(cls, path, mmap_mode='c'):
+        """
+        restore a replay saved with save, transition columns are memory mapped
+        :param path: snapshot directory
+        :param mmap_mode: numpy mmap_mode of the columns, 'c' (copy-on-write) by default
+        :return: Experience
+        """
+        return snapshot.load(cls, path, mmap_mode)
 
     def sample(self, global_step):
         """
         sample a mini batch from experience replay
         :param global_step: now training step
         :return: experience, list, samples
-        :return: w, list, weights
-        :return: rank_e_id, list, samples id, used for update priority
+        :return: w, np.ndarray, weights
+        :return: rank_e_id, np.ndarray, samples id, used for update priority
         """
+        if not self.sampling:
+            raise ValueError('Experience built with sampling=False can not sample')
         if self.record_size < self.learn_start:
             sys.stderr.write('Record size less than learn start! Sample failed\n')
             return False, False, False
+        self.flush_updates()
 
         dist_index = math.floor(self.record_size / self.max_size * self.partition_num)
         # issue 1 by @camigord
         partition_size = math.floor(self.max_size / self.partition_num)
         partition_max = dist_index * partition_size
         distribution = self.distributions[dist_index]
-        rank_list = []
-        # sample from k segments
-        for n in range(1, self.batch_size + 1):
-            index = random.randint(distribution['strata_ends'][n] + 1,
-                                   distribution['strata_ends'][n + 1])
-            rank_list.append(index)
+        strata = distribution['strata']
+        # sample from k segments, one uniform draw in (strata_ends[n], strata_ends[n + 1]] each
+        rank_list = self.rng.integers(strata[:-1] + 1, strata[1:] + 1)
 
         # beta, increase by global_step, max 1
         beta = min(self.beta_zero + (global_step - self.learn_start - 1) * self.beta_grad, 1)
-        # find all alpha pow, notice that pdf is a list, start from 0
-        alpha_pow = [distribution['pdf'][v - 1] for v in rank_list]
+        self.current_beta = beta
+        # P(rank) = weights[rank - 1] / total, indexed without copying the shared weights
         # w = (N * P(i)) ^ (-beta) / max w
-        w = np.power(np.array(alpha_pow) * partition_max, -beta)
-        w_max = max(w)
-        w = np.divide(w, w_max)
+        w = self.distributions.weights[rank_list - 1] / distribution['total']
+        w *= partition_max
+        np.power(w, -beta, out=w)
+        w /= w.max()
         # rank list is priority id
         # convert to experience id
-        rank_e_id = self.queue.priority_to_experience(rank_list)
+        rank_e_id = np.array(self.queue.priority_to_experience(rank_list), dtype=np.int64)
         # get experience id according rank_e_id
         experience = self.retrieve(rank_e_id)
         return experience, w, rank_e_id
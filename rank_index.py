@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Order-statistics rank index kept alongside the binary heap
+
+import sys
+import math
+from array import array
+from bisect import bisect_left, bisect_right, insort
+import numpy as np
+
+"""
+Rank index used to map ranks to experience ids.
+A binary heap's array order isn't a rank order, so the heap keeps this index next to it.
+Entries are stored as (-priority, experience-id) keys (same ordering as the heap) in a list of
+sorted buckets, with a Fenwick tree over the bucket sizes. Rank 1 is the highest priority.
+insert/remove cost O(log n + load), looking up a rank costs O(log n)
+ArrayRankIndex is the same index with every bucket in two flat arrays, 12 bytes per entry
+instead of a ~115 byte tuple, used by binary_heap.ArrayBinaryHeap
+BucketRankIndex is an approximate drop-in with O(1) insert/remove/update, see below
+"""
+
+class RankIndex(object):
+    """
+    param load: bucket size, buckets are split when they grow past twice this
+    """
+    def __init__(self, load=512):
+        self.load = load
+        self._lists = []
+        self._maxes = []
+        self._tree = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __repr__(self):
+        return "{}".format([k for l in self._lists for k in l])
+
+    def insert(self, experience, priority):
+        """
+        add experience to the index
+        param experience: experience id
+        param priority: priority value
+        """
+        key = (-priority, experience)
+        self._len += 1
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._build_tree()
+            return
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._lists[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            insort(self._lists[pos], key)
+        if len(self._lists[pos]) > 2 * self.load:
+            self._split(pos)
+        else:
+            self._tree_add(pos, 1)
+
+    def remove(self, experience, priority):
+        """
+        remove experience from the index
+        param experience: experience id
+        param priority: priority the experience was inserted with
+        return bool: worked?
+        """
+        key = (-priority, experience)
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return False
+        bucket = self._lists[pos]
+        idx = bisect_left(bucket, key)
+        if idx == len(bucket) or bucket[idx] != key:
+            return False
+        del bucket[idx]
+        self._len -= 1
+        if not bucket:
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._build_tree()
+        else:
+            self._maxes[pos] = bucket[-1]
+            self._tree_add(pos, -1)
+        return True
+
+    def update(self, experience, old_priority, new_priority):
+        """
+        move experience to its new rank
+        return bool: worked?
+        """
+        if not self.remove(experience, old_priority):
+            return False
+        self.insert(experience, new_priority)
+        return True
+
+    def rebuild(self, entries):
+        """
+        rebuild the index from scratch, O(n log n)
+        param entries: list of (experience id, priority)
+        """
+        keys = sorted((-p, e) for e, p in entries)
+        self._lists = [keys[i:i + self.load] for i in range(0, len(keys), self.load)]
+        self._maxes = [l[-1] for l in self._lists]
+        self._len = len(keys)
+        self._build_tree()
+
+    def nbytes(self):
+        """
+        return int: approximate memory used by the index, O(n)
+        one (-priority, experience) tuple per entry, ~115 bytes
+        """
+        size = sum(sys.getsizeof(c) for c in (self._lists, self._maxes, self._tree))
+        for bucket in self._lists:
+            size += sys.getsizeof(bucket)
+            size += sum(sys.getsizeof(k) + sys.getsizeof(k[0]) + sys.getsizeof(k[1]) for k in bucket)
+        return size
+
+    def rebuild_arrays(self, experiences, priorities):
+        """
+        rebuild the index from parallel arrays
+        param experiences: array of experience ids
+        param priorities: array of priority values
+        """
+        self.rebuild(zip(np.asarray(experiences).tolist(), np.asarray(priorities).tolist()))
+
+    def lookup(self, rank_list):
+        """
+        param rank_list: list of ranks, rank 1 is the highest priority
+        return list: experience ids at those ranks
+        """
+        res = []
+        for rank in rank_list:
+            pos, offset = self._locate(int(rank) - 1)
+            res.append(self._lists[pos][offset][1])
+        return res
+
+    def rank_error(self):
+        """
+        return float: expected rank error of a lookup, always 0 for the exact index
+        """
+        return 0.0
+
+    def count_above(self, priority):
+        """
+        param priority: priority value
+        return int: number of experiences with priority >= priority, O(log n)
+        """
+        key = (-priority, float('inf'))
+        pos = bisect_right(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        count = 0
+        i = pos
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+        return count + bisect_right(self._lists[pos], key)
+
+    def _locate(self, k):
+        # Fenwick descent: find bucket holding the k-th (0 based) key
+        if k < 0 or k >= self._len:
+            raise IndexError('rank {} out of range for {} entries'.format(k + 1, self._len))
+        tree = self._tree
+        pos = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(tree) and tree[nxt] <= k:
+                k -= tree[nxt]
+                pos = nxt
+            step >>= 1
+        return pos, k
+
+    def _split(self, pos):
+        bucket = self._lists[pos]
+        half = len(bucket) >> 1
+        self._lists[pos:pos + 1] = [bucket[:half], bucket[half:]]
+        self._maxes[pos:pos + 1] = [bucket[half - 1], bucket[-1]]
+        self._build_tree()
+
+    def _build_tree(self):
+        # O(number of buckets), only needed when buckets are added or removed
+        tree = [0] + [len(l) for l in self._lists]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, pos, delta):
+        i = pos + 1
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+
+class ArrayRankIndex(RankIndex):
+    """
+    exact RankIndex whose buckets are pairs of flat arrays, -priority ('d') and experience id
+    ('i'), so no object is created per entry. A key is found by bisecting the priorities, then
+    the ids of the entries tied on that priority, which keeps the heap's (-priority, id) order
+    experience ids must fit a C int
+    param load: bucket size, buckets are split when they grow past twice this
+    """
+    def __init__(self, load=512):
+        super(ArrayRankIndex, self).__init__(load)
+        # -priority of every bucket, ascending, parallel to the experience ids in _lists
+        self._keys = []
+
+    def __repr__(self):
+        return "{}".format([(k, e) for keys, ids in zip(self._keys, self._lists)
+                            for k, e in zip(keys, ids)])
+
+    def _find(self, pos, key, experience):
+        # position of (key, experience) in bucket pos
+        keys = self._keys[pos]
+        lo = bisect_left(keys, key)
+        hi = bisect_right(keys, key, lo)
+        return bisect_left(self._lists[pos], experience, lo, hi)
+
+    def insert(self, experience, priority):
+        """
+        add experience to the index
+        param experience: experience id
+        param priority: priority value
+        """
+        key = -priority
+        self._len += 1
+        if not self._lists:
+            self._keys.append(array('d', [key]))
+            self._lists.append(array('i', [experience]))
+            self._maxes.append((key, experience))
+            self._build_tree()
+            return
+        pos = bisect_left(self._maxes, (key, experience))
+        if pos == len(self._maxes):
+            pos -= 1
+            self._keys[pos].append(key)
+            self._lists[pos].append(experience)
+            self._maxes[pos] = (key, experience)
+        else:
+            i = self._find(pos, key, experience)
+            self._keys[pos].insert(i, key)
+            self._lists[pos].insert(i, experience)
+        if len(self._lists[pos]) > 2 * self.load:
+            self._split(pos)
+        else:
+            self._tree_add(pos, 1)
+
+    def remove(self, experience, priority):
+        """
+        remove experience from the index
+        param experience: experience id
+        param priority: priority the experience was inserted with
+        return bool: worked?
+        """
+        key = -priority
+        pos = bisect_left(self._maxes, (key, experience))
+        if pos == len(self._maxes):
+            return False
+        keys, ids = self._keys[pos], self._lists[pos]
+        i = self._find(pos, key, experience)
+        if i == len(ids) or ids[i] != experience or keys[i] != key:
+            return False
+        del keys[i]
+        del ids[i]
+        self._len -= 1
+        if not ids:
+            del self._keys[pos]
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._build_tree()
+        else:
+            self._maxes[pos] = (keys[-1], ids[-1])
+            self._tree_add(pos, -1)
+        return True
+
+    def rebuild(self, entries):
+        """
+        rebuild the index from scratch, O(n log n)
+        param entries: list of (experience id, priority)
+        """
+        entries = list(entries)
+        self.rebuild_arrays([e for e, _ in entries], [p for _, p in entries])
+
+    def rebuild_arrays(self, experiences, priorities):
+        """
+        rebuild the index from parallel arrays, sorted with numpy
+        param experiences: array of experience ids
+        param priorities: array of priority values
+        """
+        keys = -np.asarray(priorities, dtype=np.float64)
+        ids = np.asarray(experiences, dtype=np.intc)
+        order = np.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        starts = range(0, len(keys), self.load)
+        self._keys = [array('d', keys[i:i + self.load].tobytes()) for i in starts]
+        self._lists = [array('i', ids[i:i + self.load].tobytes()) for i in starts]
+        self._maxes = [(k[-1], e[-1]) for k, e in zip(self._keys, self._lists)]
+        self._len = len(keys)
+        self._build_tree()
+
+    def nbytes(self):
+        """
+        return int: approximate memory used by the index, 12 bytes per entry plus the arrays'
+        spare capacity and a few objects per bucket
+        """
+        size = sum(sys.getsizeof(c) for c in (self._keys, self._lists, self._maxes, self._tree))
+        size += sum(sys.getsizeof(a) for a in self._keys)
+        size += sum(sys.getsizeof(a) for a in self._lists)
+        return size + sum(sys.getsizeof(m) for m in self._maxes)
+
+    def lookup(self, rank_list):
+        """
+        param rank_list: list of ranks, rank 1 is the highest priority
+        return list: experience ids at those ranks
+        """
+        res = []
+        for rank in rank_list:
+            pos, offset = self._locate(int(rank) - 1)
+            res.append(self._lists[pos][offset])
+        return res
+
+    def count_above(self, priority):
+        """
+        param priority: priority value
+        return int: number of experiences with priority >= priority, O(log n)
+        """
+        pos = bisect_right(self._maxes, (-priority, float('inf')))
+        if pos == len(self._maxes):
+            return self._len
+        count = 0
+        i = pos
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+        return count + bisect_right(self._keys[pos], -priority)
+
+    def _split(self, pos):
+        keys, ids = self._keys[pos], self._lists[pos]
+        half = len(ids) >> 1
+        self._keys[pos:pos + 1] = [keys[:half], keys[half:]]
+        self._lists[pos:pos + 1] = [ids[:half], ids[half:]]
+        self._maxes[pos:pos + 1] = [(keys[half - 1], ids[half - 1]), (keys[-1], ids[-1])]
+        self._build_tree()
+
+
+class BucketRankIndex(object):
+    """
+    approximate rank index: priorities are quantized into log-spaced buckets, each bucket keeps
+    an unordered member list. A rank is mapped to its bucket with prefix sums over the bucket
+    counts, then to a uniformly chosen member of the bucket, so ranks are exact between buckets
+    and random within one. insert/remove/update are O(1) (swap with the last member and pop),
+    a lookup of k ranks costs O(num_buckets + k)
+    param num_buckets: number of buckets
+    param low, high: priority range covered by the buckets, priorities outside it share the
+        first / last bucket
+    param rng: numpy.random.Generator choosing the members
+    """
+    def __init__(self, num_buckets=512, low=1e-10, high=1e10, rng=None):
+        if not 0 < low < high:
+            raise ValueError('bucket range must satisfy 0 < low < high')
+        self.num_buckets = num_buckets
+        self.low = low
+        self.high = high
+        # priority ratio between the edges of a bucket
+        self.ratio = (high / low) ** (1.0 / num_buckets)
+        self._log_low = math.log(low)
+        self._scale = num_buckets / (math.log(high) - self._log_low)
+        self.rng = np.random.default_rng() if rng is None else rng
+        self._members = [[] for _ in range(num_buckets)]
+        # experience id -> (bucket, index in the bucket)
+        self._slot = {}
+
+    def __len__(self):
+        return len(self._slot)
+
+    def __repr__(self):
+        return "{}".format(dict((b, m) for b, m in enumerate(self._members) if m))
+
+    def bucket(self, priority):
+        """
+        param priority: priority value
+        return int: bucket of priority, higher buckets hold higher priorities
+        """
+        if priority <= self.low:
+            return 0
+        return min(int((math.log(priority) - self._log_low) * self._scale), self.num_buckets - 1)
+
+    def insert(self, experience, priority):
+        """
+        add experience to the index
+        param experience: experience id
+        param priority: priority value
+        """
+        b = self.bucket(priority)
+        members = self._members[b]
+        self._slot[experience] = (b, len(members))
+        members.append(experience)
+
+    def remove(self, experience, priority=None):
+        """
+        remove experience from the index, the priority isn't needed
+        param experience: experience id
+        return bool: worked?
+        """
+        slot = self._slot.pop(experience, None)
+        if slot is None:
+            return False
+        b, i = slot
+        members = self._members[b]
+        last = members.pop()
+        if last != experience:
+            members[i] = last
+            self._slot[last] = (b, i)
+        return True
+
+    def update(self, experience, old_priority, new_priority):
+        """
+        move experience to the bucket of its new priority
+        return bool: worked?
+        """
+        slot = self._slot.get(experience)
+        if slot is None:
+            return False
+        if slot[0] != self.bucket(new_priority):
+            self.remove(experience)
+            self.insert(experience, new_priority)
+        return True
+
+    def rebuild(self, entries):
+        """
+        rebuild the index from scratch, O(n)
+        param entries: list of (experience id, priority)
+        """
+        self._members = [[] for _ in range(self.num_buckets)]
+        self._slot = {}
+        for e, p in entries:
+            self.insert(e, p)
+
+    def nbytes(self):
+        """
+        return int: approximate memory used by the index, O(n)
+        a member list slot and a (bucket, index) dict entry per entry, ~170 bytes
+        """
+        size = sys.getsizeof(self._members) + sys.getsizeof(self._slot)
+        size += sum(sys.getsizeof(m) for m in self._members)
+        size += sum(sys.getsizeof(e) + sys.getsizeof(s) + sys.getsizeof(s[1]) for e, s in self._slot.items())
+        return size
+
+    def rebuild_arrays(self, experiences, priorities):
+        """
+        rebuild the index from parallel arrays
+        param experiences: array of experience ids
+        param priorities: array of priority values
+        """
+        self.rebuild(zip(np.asarray(experiences).tolist(), np.asarray(priorities).tolist()))
+
+    def counts(self):
+        """
+        return np.ndarray: number of members per bucket, highest priority bucket first
+        """
+        return np.array([len(m) for m in reversed(self._members)], dtype=np.int64)
+
+    def lookup(self, rank_list):
+        """
+        param rank_list: list of ranks, rank 1 is the highest priority
+        return list: experience ids, drawn uniformly from the buckets holding those ranks,
+            without replacement inside a bucket so distinct ranks give distinct ids
+        """
+        ranks = np.asarray(rank_list, dtype=np.int64)
+        if len(ranks) and (ranks.min() < 1 or ranks.max() > len(self._slot)):
+            raise IndexError('rank out of range for {} entries'.format(len(self._slot)))
+        ranks, inverse = np.unique(ranks, return_inverse=True)
+        counts = self.counts()
+        buckets = np.searchsorted(np.cumsum(counts), ranks, side='left')
+        # the distinct ranks of a bucket are at most its size, draw that many members
+        starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+        ends = np.append(starts[1:], len(ranks))
+        picks = self.rng.random(len(ranks))
+        res = []
+        for b, start, end in zip(buckets[starts].tolist(), starts.tolist(), ends.tolist()):
+            members = self._members[self.num_buckets - 1 - b]
+            if end - start == 1:
+                res.append(members[int(picks[start] * len(members))])
+            else:
+                chosen = self.rng.choice(len(members), end - start, replace=False)
+                res.extend(members[i] for i in chosen.tolist())
+        return [res[i] for i in inverse.tolist()]
+
+    def rank_error(self):
+        """
+        expected absolute distance between a uniformly drawn rank and the true rank of the
+        member returned for it, E|X - Y| = (c^2 - 1) / 3c for X, Y uniform over a bucket of c
+        return float: mean rank error, in ranks
+        """
+        n = len(self._slot)
+        if not n:
+            return 0.0
+        counts = self.counts().astype(np.float64)
+        return float(((counts ** 2 - 1) / 3.0)[counts > 0].sum() / n)
+
+    def count_above(self, priority):
+        """
+        param priority: priority value
+        return int: number of experiences in the bucket of priority or above, O(num_buckets)
+        """
+        b = self.bucket(priority)
+        return sum(len(m) for m in self._members[b:])
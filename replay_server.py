@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Experience replay served over a Unix domain socket (or localhost TCP)
+
+import os
+import sys
+import math
+import socket
+import struct
+import selectors
+import numpy as np
+
+"""
+ReplayServer owns an Experience and serves store_batch, sample and update_priority to many
+ReplayClient connections. Every message is a fixed header followed by raw numpy buffers:
+    header: op (uint8), number of arrays (uint8), reserved (uint16), request id (uint32), body length (uint64)
+    array:  dtype str (4 bytes), ndim (uint8), shape (ndim x uint64), then the raw data
+Arrays are sent with sendmsg straight from their buffers and received into one body buffer that
+np.frombuffer views, so no payload is pickled. The body buffer grows with the bytes that actually
+arrive (starting at BODY_CHUNK, doubling), so a header alone can't make the server allocate its
+whole claimed length.
+Clients may pipeline requests. Each server loop iteration reads everything available, applies
+all stores as one store_batch, then all priority updates as one update_priority_batch, then
+answers the samples. Every request gets a reply with its request id.
+A malformed message (unknown or object dtype, arrays not matching the body length, wrong number
+or lengths of columns) gets an ERROR reply and is left out of the batch, a connection whose
+framing can't be trusted (unreadable header, body over max_body) or whose body can't be
+allocated (MemoryError) is closed. Neither affects the other clients.
+"""
+
+STORE, SAMPLE, UPDATE, REPLY, ERROR = 1, 2, 3, 4, 255
+
+HEADER = struct.Struct('<BBHIQ')
+ARRAY = struct.Struct('<4sB')
+DIM = struct.Struct('<Q')
+# default largest message body accepted by the server, in bytes
+MAX_BODY = 64 << 20
+# first allocation of a body buffer, in bytes
+BODY_CHUNK = 64 << 10
+
+
+def pack(op, request_id, arrays):
+    """
+    :return: list of buffers making up the message, ready for sendmsg
+    """
+    buffers = []
+    body_len = 0
+    for array in arrays:
+        array = np.asarray(array)
+        if not array.flags['C_CONTIGUOUS']:
+            array = np.ascontiguousarray(array)
+        meta = ARRAY.pack(array.dtype.str.encode('ascii').ljust(4), array.ndim) + \
+            b''.join(DIM.pack(d) for d in array.shape)
+        data = memoryview(array.reshape(-1).view(np.uint8)) if array.nbytes else b''
+        buffers.extend([meta, data])
+        body_len += len(meta) + array.nbytes
+    return [HEADER.pack(op, len(arrays), 0, request_id, body_len)] + buffers
+
+
+def unpack(n_arrays, body):
+    """
+    :param body: message body buffer
+    :return: list of arrays viewing body
+    :raise ValueError: malformed body, unknown or object dtype, or arrays not filling the body exactly
+    """
+    view = memoryview(body)
+    arrays = []
+    offset = 0
+    for _ in range(n_arrays):
+        try:
+            code, ndim = ARRAY.unpack_from(view, offset)
+            offset += ARRAY.size
+            shape = tuple(DIM.unpack_from(view, offset + i * DIM.size)[0] for i in range(ndim))
+        except struct.error:
+            raise ValueError('truncated array header')
+        offset += ndim * DIM.size
+        try:
+            dtype = np.dtype(code.rstrip(b' ').decode('ascii'))
+        except (TypeError, ValueError):
+            raise ValueError('unknown dtype {!r}'.format(code))
+        if dtype.hasobject or dtype.itemsize == 0:
+            raise ValueError('unsupported dtype {}'.format(dtype))
+        count = math.prod(shape)
+        if offset + count * dtype.itemsize > len(view):
+            raise ValueError('array of shape {} {} overruns the body'.format(shape, dtype))
+        arrays.append(np.frombuffer(view, dtype=dtype, count=count, offset=offset).reshape(shape))
+        offset += count * dtype.itemsize
+    if offset != len(view):
+        raise ValueError('body length {} does not match its arrays ({} bytes)'.format(len(view), offset))
+    return arrays
+
+
+def send_all(sock, buffers):
+    # sendmsg can send part of the buffers, carry on from where it stopped
+    buffers = [memoryview(b).cast('B') for b in buffers if len(b)]
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if buffers:
+            buffers[0] = buffers[0][sent:]
+
+
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while n:
+        got = sock.recv_into(view[len(buf) - n:], n)
+        if not got:
+            raise ConnectionError('connection closed')
+        n -= got
+    return buf
+
+
+def make_socket(address):
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+def columns(experience):
+    # retrieve returns column arrays with a storage backend, a list of tuples otherwise
+    if isinstance(experience, tuple):
+        return list(experience)
+    return [np.asarray(c) for c in zip(*experience)]
+
+
+class _Connection(object):
+
+    def __init__(self, sock, max_body=MAX_BODY):
+        self.sock = sock
+        self.max_body = max_body
+        self.header = bytearray(HEADER.size)
+        self.body = None
+        self.received = 0
+        self.meta = None
+        self.out = []
+        self.closed = False
+
+    def read(self):
+        """
+        read what is available
+        :return: list of complete (op, request id, arrays), None once the peer closed
+            arrays is the ValueError raised by unpack for a malformed body
+        :raise ValueError: body length over max_body, the stream can't be resynchronized
+        """
+        messages = []
+        while True:
+            if self.meta is None:
+                target = memoryview(self.header)[self.received:]
+            else:
+                target = memoryview(self.body)[self.received:]
+            try:
+                got = self.sock.recv_into(target) if len(target) else 0
+            except BlockingIOError:
+                return messages
+            if len(target) and not got:
+                return None
+            self.received += got
+            if self.meta is None and self.received == HEADER.size:
+                self.meta = HEADER.unpack(self.header)
+                if self.meta[4] > self.max_body:
+                    raise ValueError('message body of {} bytes'.format(self.meta[4]))
+                self.body = bytearray(min(self.meta[4], BODY_CHUNK))
+                self.received = 0
+            target.release()
+            if self.meta is not None and self.received == len(self.body) < self.meta[4]:
+                # the buffer is full but the body isn't, grow it by what has arrived so far
+                self.body.extend(bytes(min(len(self.body), self.meta[4] - len(self.body))))
+            if self.meta is not None and self.received == self.meta[4]:
+                op, n_arrays, _, request_id, _ = self.meta
+                try:
+                    arrays = unpack(n_arrays, self.body)
+                except ValueError as e:
+                    arrays = e
+                messages.append((op, request_id, arrays))
+                self.meta = None
+                self.received = 0
+
+    def write(self):
+        """
+        send as much of the queued output as the socket takes
+        :return: bool, everything was sent
+        """
+        while self.out:
+            try:
+                sent = self.sock.sendmsg(self.out)
+            except BlockingIOError:
+                return False
+            while self.out and sent >= len(self.out[0]):
+                sent -= len(self.out[0])
+                self.out.pop(0)
+            if self.out:
+                self.out[0] = self.out[0][sent:]
+        return True
+
+
+class ReplayServer(object):
+    """
+    param experience: Experience to serve (rank_based, proportional, ...)
+    param address: Unix socket path, or a (host, port) tuple for TCP
+    param max_body: largest message body accepted, in bytes, a client sending a larger one is dropped
+    """
+    def __init__(self, experience, address, max_body=MAX_BODY):
+        self.experience = experience
+        self.address = address
+        self.max_body = max_body
+        self.sock = make_socket(address)
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+        self.sock.bind(address)
+        self.sock.listen()
+        self.sock.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self._running = False
+
+    def serve_forever(self, poll_interval=0.1):
+        self._running = True
+        while self._running:
+            self.serve_once(poll_interval)
+
+    def shutdown(self):
+        self._running = False
+
+    def serve_once(self, timeout=None):
+        """
+        one loop iteration: accept, read every client, apply the coalesced batch, reply
+        """
+        requests = []
+        for key, events in self.selector.select(timeout):
+            if key.fileobj is self.sock:
+                self._accept()
+                continue
+            conn = key.data
+            try:
+                if events & selectors.EVENT_READ:
+                    messages = conn.read()
+                    if messages is None:
+                        self._drop(conn)
+                        continue
+                    requests.extend((conn, m) for m in messages)
+                if events & selectors.EVENT_WRITE and conn.write():
+                    self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+            except (OSError, ValueError, MemoryError) as e:
+                # only this client is affected, its requests of this iteration are dropped too
+                sys.stderr.write('Dropping client: {}\n'.format(e))
+                requests = [r for r in requests if r[0] is not conn]
+                self._drop(conn)
+        if requests:
+            self._handle(requests)
+
+    def _accept(self):
+        sock, _ = self.sock.accept()
+        sock.setblocking(False)
+        conn = _Connection(sock, self.max_body)
+        self.selector.register(sock, selectors.EVENT_READ, conn)
+
+    def _drop(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+
+    def _handle(self, requests):
+        malformed = [(c, i, a) for c, (op, i, a) in requests if isinstance(a, Exception)]
+        requests = [r for r in requests if not isinstance(r[1][2], Exception)]
+        for conn, request_id, error in malformed:
+            self._fail([(conn, request_id, None)], 'malformed message: {}'.format(error))
+        stores = self._valid([(c, i, a) for c, (op, i, a) in requests if op == STORE],
+                             self._check_store)
+        updates = self._valid([(c, i, a) for c, (op, i, a) in requests if op == UPDATE],
+                              self._check_update)
+        samples = [(c, i, a) for c, (op, i, a) in requests if op == SAMPLE]
+        others = [(c, i, a) for c, (op, i, a) in requests if op not in (STORE, UPDATE, SAMPLE)]
+        if stores:
+            try:
+                batch = tuple(np.concatenate([a[f] for _, _, a in stores]) for f in range(5))
+                inserted = self.experience.store_batch(batch)
+            except Exception:
+                # store every request on its own, so only the faulty one fails
+                for request in stores:
+                    self._store(request)
+            else:
+                self._store_replies(stores, inserted)
+        if updates:
+            try:
+                indices = np.concatenate([a[0] for _, _, a in updates])
+                delta = np.concatenate([a[1] for _, _, a in updates])
+                self.experience.update_priority_batch(indices, delta)
+            except Exception:
+                for request in updates:
+                    self._update(request)
+            else:
+                for conn, request_id, _ in updates:
+                    self._reply(conn, REPLY, request_id, [])
+        for conn, request_id, arrays in samples:
+            try:
+                experience, w, e_id = self.experience.sample(int(arrays[0]))
+            except Exception as e:
+                self._fail([(conn, request_id, arrays)], 'sample failed: {}'.format(e))
+                continue
+            if w is False:
+                self._fail([(conn, request_id, arrays)], 'not ready')
+            else:
+                self._reply(conn, REPLY, request_id, [w, e_id] + columns(experience))
+        self._fail(others, 'unknown op')
+
+    def _valid(self, requests, check):
+        """
+        answer the requests check rejects with an ERROR
+        :param check: function(arrays) returning an error message or None
+        :return: list of the valid requests
+        """
+        valid = []
+        for conn, request_id, arrays in requests:
+            error = check(arrays)
+            if error is None:
+                valid.append((conn, request_id, arrays))
+            else:
+                self._fail([(conn, request_id, arrays)], error)
+        return valid
+
+    @staticmethod
+    def _check_store(arrays):
+        if len(arrays) != 5:
+            return 'store needs 5 columns (s1, a, r, s2, t), got {}'.format(len(arrays))
+        if any(a.ndim == 0 for a in arrays) or len(set(len(a) for a in arrays)) != 1:
+            return 'store columns must have the same number of rows'
+        return None
+
+    @staticmethod
+    def _check_update(arrays):
+        if len(arrays) != 2 or arrays[0].ndim != 1 or arrays[0].shape != arrays[1].shape:
+            return 'update needs 2 arrays (indices, delta) of the same length'
+        if arrays[0].dtype.kind not in 'iu' or arrays[1].dtype.kind not in 'iuf':
+            return 'update needs integer indices and numeric deltas'
+        return None
+
+    def _store(self, request):
+        try:
+            inserted = self.experience.store_batch(tuple(request[2]))
+        except Exception as e:
+            self._fail([request], 'store failed: {}'.format(e))
+        else:
+            self._store_replies([request], inserted)
+
+    def _store_replies(self, stores, inserted):
+        """
+        reply to every store with its share of the rows inserted by one store_batch
+        store_batch keeps the leading rows when it refuses some (no eviction), the last
+        ones when it evicts
+        """
+        lengths = np.array([len(a[1]) for _, _, a in stores], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        if getattr(self.experience, 'eviction', None) is None:
+            shares = np.clip(inserted - (ends - lengths), 0, lengths)
+        else:
+            shares = np.clip(inserted - (ends[-1] - ends), 0, lengths)
+        for (conn, request_id, _), share in zip(stores, shares):
+            self._reply(conn, REPLY, request_id, [np.array(share, dtype=np.int64)])
+
+    def _update(self, request):
+        conn, request_id, arrays = request
+        try:
+            self.experience.update_priority_batch(arrays[0], arrays[1])
+        except Exception as e:
+            self._fail([request], 'update failed: {}'.format(e))
+        else:
+            self._reply(conn, REPLY, request_id, [])
+
+    def _fail(self, requests, message):
+        error = np.frombuffer(message.encode(), dtype=np.uint8)
+        for conn, request_id, _ in requests:
+            self._reply(conn, ERROR, request_id, [error])
+
+    def _reply(self, conn, op, request_id, arrays):
+        if conn.closed:
+            return
+        idle = not conn.out
+        conn.out.extend(memoryview(b).cast('B') for b in pack(op, request_id, arrays) if len(b))
+        try:
+            if idle and not conn.write():
+                self.selector.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+        except OSError as e:
+            sys.stderr.write('Dropping client: {}\n'.format(e))
+            self._drop(conn)
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            if key.fileobj is not self.sock:
+                self._drop(key.data)
+        self.selector.close()
+        self.sock.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class ReplayClient(object):
+    """
+    param address: Unix socket path, or a (host, port) tuple for TCP
+    submit() sends a request without waiting, result() collects its reply, so requests
+    can be pipelined; the other methods do both
+    """
+    def __init__(self, address):
+        self.sock = make_socket(address)
+        self.sock.connect(address)
+        self._next_id = 0
+        self._replies = {}
+
+    def submit(self, op, arrays):
+        """
+        :return: int, request id
+        """
+        self._next_id = (self._next_id + 1) & 0xffffffff
+        send_all(self.sock, pack(op, self._next_id, arrays))
+        return self._next_id
+
+    def result(self, request_id):
+        """
+        :return: (op, arrays) of the reply to request_id
+        """
+        while request_id not in self._replies:
+            op, n_arrays, _, reply_id, body_len = HEADER.unpack(recv_exact(self.sock, HEADER.size))
+            self._replies[reply_id] = (op, unpack(n_arrays, recv_exact(self.sock, body_len)))
+        return self._replies.pop(request_id)
+
+    def store_batch(self, experiences):
+        """
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        :return: int - number sent
+        """
+        op, arrays = self.result(self.submit(STORE, experiences))
+        if op == ERROR:
+            sys.stderr.write('Insert failed! {}\n'.format(arrays[0].tobytes().decode()))
+            return 0
+        return int(arrays[0])
+
+    def store(self, experience):
+        return self.store_batch(tuple(np.asarray([v]) for v in experience)) == 1
+
+    def update_priority(self, indices, delta):
+        self.result(self.submit(UPDATE, [np.asarray(indices, dtype=np.int64),
+                                         np.asarray(delta, dtype=np.float64)]))
+
+    update_priority_batch = update_priority
+
+    def sample(self, global_step):
+        """
+        :return: experience, tuple of arrays (s1, a, r, s2, t)
+        :return: w, np.ndarray, weights
+        :return: e_id, np.ndarray, samples id
+        """
+        op, arrays = self.result(self.submit(SAMPLE, [np.array(global_step, dtype=np.int64)]))
+        if op == ERROR:
+            sys.stderr.write('Sample failed! {}\n'.format(arrays[0].tobytes().decode()))
+            return False, False, False
+        return tuple(arrays[2:]), arrays[0], arrays[1]
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Rank-based experience replay sharded across worker processes
+
+import sys
+import math
+import multiprocessing
+import numpy as np
+
+import distributions
+import rank_based
+import storage
+
+"""
+ShardedExperience splits transitions round robin across K worker processes, each owning a
+rank_based.Experience (heap, rank index and storage) of max_size / K.
+Sampling stays stratified over the global rank distribution from build_distributions: every
+shard reports how many of its priorities lie above a shared set of log-spaced bucket edges, the
+summed histogram maps a global rank to a bucket, and the bucket's members are split between the
+shards by their counts to get a shard and a local rank. Ranks are exact between buckets and
+approximate within one. Global experience ids are local_id * K + shard, so priority updates are
+routed back to the owning shard. Shards are built with sampling=False, so only the parent holds
+the distributions. An exception in a shard is sent back in place of its next reply and raised by
+histograms or sample, store_batch and update_priority don't wait for the shards.
+"""
+
+
+def _shard_worker(conn, shard_size, alpha, eviction, storage_kwargs):
+    if storage_kwargs is not None:
+        backend = storage.ArrayStorage(shard_size, **storage_kwargs)
+    else:
+        backend = None
+    # shards are never sampled directly, no distributions are built
+    experience = rank_based.Experience(max_size=shard_size, alpha=alpha, learn_start=0,
+                                       total_steps=1, partition_num=1, batch_size=1,
+                                       storage=backend, eviction=eviction, sampling=False)
+    rank_index = experience.queue.rank_index
+    # first exception since the last reply, sent instead of the next one
+    error = None
+    while True:
+        cmd, args = conn.recv()
+        if cmd == 'close':
+            break
+        reply = None
+        try:
+            if cmd == 'store_batch':
+                experience.store_batch(args)
+            elif cmd == 'update':
+                experience.update_priority_batch(*args)
+            elif cmd == 'counts':
+                reply = np.array([rank_index.count_above(e) for e in args], dtype=np.int64)
+            elif cmd == 'sample':
+                e_ids = experience.queue.priority_to_experience(args)
+                reply = (np.array(e_ids, dtype=np.int64), experience.retrieve(e_ids))
+        except Exception as e:
+            error = e if error is None else error
+        if cmd in ('counts', 'sample'):
+            conn.send(reply if error is None else error)
+            error = None
+    conn.close()
+
+
+class ShardedExperience(object):
+    """
+    param num_shards: number of worker processes
+    param max_size: total experience replay size, split evenly between the shards
+    param alpha, beta_zero, batch_size, learn_start, total_steps, partition_num, eviction, seed:
+        see rank_based.Experience
+    param num_buckets: number of log-spaced priority buckets in the shard histograms
+    param bucket_range: ratio between the highest and the lowest bucket edge
+    param storage_kwargs: ArrayStorage arguments (state_shape, dtypes) for the shards, None for dicts
+    """
+    def __init__(self, num_shards=4, max_size=100000, alpha=0.7, beta_zero=0.5, batch_size=32,
+                 learn_start=1000, total_steps=100000, partition_num=100, eviction='fifo',
+                 seed=None, num_buckets=256, bucket_range=1e12, storage_kwargs=None):
+        self.num_shards = num_shards
+        self.max_size = max_size
+        self.alpha = alpha
+        self.beta_zero = beta_zero
+        self.batch_size = batch_size
+        self.learn_start = learn_start
+        self.total_steps = total_steps
+        self.partition_num = partition_num
+        self.num_buckets = num_buckets
+        self.bucket_range = bucket_range
+        self.storage_kwargs = storage_kwargs
+        self.shard_size = max_size // num_shards
+
+        # next shard to store to, and the highest priority seen, used for the bucket edges
+        self._next_shard = 0
+        self.max_priority = 1.0
+        self.record_size = 0
+        self.distributions = distributions.RankDistributions(max_size, alpha, batch_size,
+                                                             partition_num, learn_start)
+        self.beta_grad = (1 - self.beta_zero) / float(self.total_steps - self.learn_start)
+        # numpy.random.Generator used for sampling
+        self.rng = np.random.default_rng(seed)
+
+        ctx = multiprocessing.get_context()
+        self._conns = []
+        self._workers = []
+        for _ in range(num_shards):
+            conn, child = ctx.Pipe()
+            worker = ctx.Process(target=_shard_worker, daemon=True,
+                                 args=(child, self.shard_size, alpha, eviction, storage_kwargs))
+            worker.start()
+            child.close()
+            self._conns.append(conn)
+            self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def store(self, experience):
+        """
+        store experience in the tuple - form (s1, a, r, s2, t) on the next shard
+        :param experience: tuple
+        :return: bool - inserted
+        """
+        return self.store_batch(tuple(np.asarray([v]) for v in experience)) == 1
+
+    def store_batch(self, experiences):
+        """
+        split a batch of experiences round robin between the shards
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        :return: int - number sent
+        """
+        k = len(experiences[1])
+        shards = (self._next_shard + np.arange(k)) % self.num_shards
+        for shard in range(self.num_shards):
+            rows = np.nonzero(shards == shard)[0]
+            if len(rows):
+                self._conns[shard].send(('store_batch', tuple(np.asarray(c)[rows] for c in experiences)))
+        self._next_shard = (self._next_shard + k) % self.num_shards
+        self.record_size = min(self.record_size + k, self.shard_size * self.num_shards)
+        return k
+
+    def update_priority(self, indices, delta):
+        """
+        route priority updates to the shards owning the experience ids
+        :param indices: array of global experience id
+        :param delta: array of delta, order correspond to indices
+        :return: None
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        delta = np.abs(np.asarray(delta, dtype=np.float64))
+        shards = indices % self.num_shards
+        for shard in range(self.num_shards):
+            rows = np.nonzero(shards == shard)[0]
+            if len(rows):
+                self._conns[shard].send(('update', (indices[rows] // self.num_shards, delta[rows])))
+        if len(delta):
+            self.max_priority = max(self.max_priority, float(delta.max()))
+
+    update_priority_batch = update_priority
+
+    def bucket_edges(self):
+        """
+        :return: descending log-spaced priority edges, the last one (0) counts everything
+        """
+        top = self.max_priority
+        edges = np.geomspace(top, top / self.bucket_range, self.num_buckets - 1)
+        return np.append(edges, 0.0)
+
+    def histograms(self, edges):
+        """
+        :return: array (num_shards, len(edges)), count of priorities >= each edge per shard
+        """
+        for conn in self._conns:
+            conn.send(('counts', edges))
+        return np.array(self._recv(range(self.num_shards)))
+
+    def sample(self, global_step):
+        """
+        sample a mini batch from experience replay across the shards
+        :param global_step: now training step
+        :return: experience, samples
+        :return: w, np.ndarray, weights
+        :return: e_id, np.ndarray, global samples id, used for update priority
+        """
+        counts = self.histograms(self.bucket_edges())
+        total = int(counts[:, -1].sum())
+        if total < self.learn_start:
+            sys.stderr.write('Record size less than learn start! Sample failed\n')
+            return False, False, False
+
+        dist_index = math.floor(total / self.max_size * self.partition_num)
+        partition_size = math.floor(self.max_size / self.partition_num)
+        partition_max = dist_index * partition_size
+        distribution = self.distributions[dist_index]
+        strata = distribution['strata']
+        rank_list = self.rng.integers(strata[:-1] + 1, strata[1:] + 1)
+
+        # global rank -> bucket -> (shard, local rank)
+        cumulative = counts.sum(axis=0)
+        buckets = np.searchsorted(cumulative, rank_list, side='left')
+        above = np.zeros((self.num_shards, len(rank_list)), dtype=np.int64)
+        nonzero = buckets > 0
+        above[:, nonzero] = counts[:, buckets[nonzero] - 1]
+        offsets = rank_list - above.sum(axis=0)
+        in_bucket = np.cumsum(counts[:, buckets] - above, axis=0)
+        shards = (in_bucket < offsets).sum(axis=0)
+        before = np.where(shards > 0, in_bucket[np.maximum(shards - 1, 0), np.arange(len(rank_list))], 0)
+        local_ranks = above[shards, np.arange(len(rank_list))] + offsets - before
+
+        for shard in range(self.num_shards):
+            rows = np.nonzero(shards == shard)[0]
+            if len(rows):
+                self._conns[shard].send(('sample', local_ranks[rows]))
+        sampled = [shard for shard in range(self.num_shards) if np.any(shards == shard)]
+        e_id = np.zeros(len(rank_list), dtype=np.int64)
+        parts = []
+        for shard, (local_ids, experience) in zip(sampled, self._recv(sampled)):
+            rows = np.nonzero(shards == shard)[0]
+            e_id[rows] = local_ids * self.num_shards + shard
+            parts.append((rows, experience))
+        experience = self._merge(parts, len(rank_list))
+
+        # beta, increase by global_step, max 1
+        beta = min(self.beta_zero + (global_step - self.learn_start - 1) * self.beta_grad, 1)
+        # w = (N * P(i)) ^ (-beta) / max w
+        w = self.distributions.weights[rank_list - 1] / distribution['total']
+        w *= partition_max
+        np.power(w, -beta, out=w)
+        w /= w.max()
+        return experience, w, e_id
+
+    def _recv(self, shards):
+        # every reply is read before raising, so the pipes stay in step for the next request
+        replies = [self._conns[shard].recv() for shard in shards]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+
+    def _merge(self, parts, k):
+        # put the shard results back in batch order
+        if self.storage_kwargs is None:
+            experience = [None] * k
+            for rows, values in parts:
+                for row, value in zip(rows, values):
+                    experience[row] = value
+            return experience
+        columns = []
+        for c in range(len(parts[0][1])):
+            first = parts[0][1][c]
+            column = np.zeros((k,) + first.shape[1:], dtype=first.dtype)
+            for rows, values in parts:
+                column[rows] = values[c]
+            columns.append(column)
+        return tuple(columns)
+
+    def close(self):
+        """
+        stop the shard processes
+        """
+        for conn, worker in zip(self._conns, self._workers):
+            if worker.is_alive():
+                conn.send(('close', None))
+            worker.join()
+            conn.close()
+        self._workers = []
+        self._conns = []
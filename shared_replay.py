@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Shared-memory proportional replay buffer for multi-process actor/learner setups
+
+import os
+import sys
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+import proportional
+import storage
+
+"""
+SharedExperience is the proportional Experience with every piece of state (transition columns,
+sum tree, cursor, record size and max priority) in one multiprocessing.shared_memory block.
+The learner creates it and hands it to actor processes as a Process argument, each actor then
+calls store directly (no pickling of transitions through a queue) while the learner samples and
+updates priorities in place. A multiprocessing.Lock serializes writers and the sampler.
+Before Python 3.13 attaching to a block registers it with the resource tracker, which unlinks it
+when the attaching process exits if that process has its own tracker, so attached blocks are
+unregistered and only the creator's registration remains.
+"""
+
+# header slots
+INDEX, RECORD_SIZE, CURSOR, SIZE = range(4)
+
+
+def layout(max_size, state_shape=(), state_dtype=np.float32, action_shape=(), action_dtype=np.int64,
+           reward_dtype=np.float32):
+    """
+    offsets of every array in the shared block, 64 byte aligned
+    :return: list of (name, shape, dtype, offset), total size in bytes
+    """
+    fields = [('header', (4,), np.int64),
+              ('max_priority', (1,), np.float64),
+              ('tree', (proportional.SumTree.tree_len(max_size),), np.float64),
+              ('states', (max_size,) + tuple(state_shape), state_dtype),
+              ('actions', (max_size,) + tuple(action_shape), action_dtype),
+              ('rewards', (max_size,), reward_dtype),
+              ('next_states', (max_size,) + tuple(state_shape), state_dtype),
+              ('terminals', (max_size,), np.bool_)]
+    res = []
+    offset = 0
+    for name, shape, dtype in fields:
+        dtype = np.dtype(dtype)
+        offset = (offset + 63) // 64 * 64
+        res.append((name, shape, dtype, offset))
+        offset += int(np.prod(shape)) * dtype.itemsize
+    return res, offset
+
+
+class SharedArrayStorage(storage.ArrayStorage):
+    """
+    ArrayStorage whose columns, cursor and size live in shared memory
+    param capacity: number of transitions
+    param columns: tuple of preallocated arrays (s1, a, r, s2, t)
+    param header: shared int64 array holding the cursor and size
+    """
+    def __init__(self, capacity, columns, header):
+        self.capacity = capacity
+        self.states, self.actions, self.rewards, self.next_states, self.terminals = columns
+        self._header = header
+        self.dirty = None
+
+    @property
+    def cursor(self):
+        return int(self._header[CURSOR])
+
+    @cursor.setter
+    def cursor(self, value):
+        self._header[CURSOR] = value
+
+    @property
+    def size(self):
+        return int(self._header[SIZE])
+
+    @size.setter
+    def size(self, value):
+        self._header[SIZE] = value
+
+
+class SharedExperience(proportional.Experience):
+    """
+    param max_size, state_shape, state_dtype, action_shape, action_dtype, reward_dtype:
+        transition storage, see storage.ArrayStorage
+    param alpha, beta_zero, batch_size, learn_start, total_steps, eps, seed: see proportional.Experience
+    param name: shared memory block name, generated when creating
+    param lock: multiprocessing lock shared by every process using the block, from the context
+        the processes are started with (e.g. get_context('spawn').Lock())
+    param create: create the block (learner) or attach to an existing one
+    """
+    def __init__(self, max_size=100000, state_shape=(), state_dtype=np.float32, action_shape=(),
+                 action_dtype=np.int64, reward_dtype=np.float32, alpha=0.6, beta_zero=0.4,
+                 batch_size=32, learn_start=1000, total_steps=100000, eps=1e-6, seed=None,
+                 name=None, lock=None, create=True):
+        self._config = dict(max_size=max_size, state_shape=tuple(state_shape),
+                            state_dtype=np.dtype(state_dtype).str, action_shape=tuple(action_shape),
+                            action_dtype=np.dtype(action_dtype).str,
+                            reward_dtype=np.dtype(reward_dtype).str, alpha=alpha,
+                            beta_zero=beta_zero, batch_size=batch_size, learn_start=learn_start,
+                            total_steps=total_steps, eps=eps)
+        self.max_size = max_size
+        self.alpha = alpha
+        self.beta_zero = beta_zero
+        self.batch_size = batch_size
+        self.learn_start = learn_start
+        self.total_steps = total_steps
+        self.eps = eps
+
+        fields, nbytes = layout(max_size, state_shape, state_dtype, action_shape, action_dtype,
+                                reward_dtype)
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+        elif sys.version_info >= (3, 13):
+            # only the creator should unlink the block
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if os.name == 'posix':
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self._owner = create
+        arrays = dict((n, np.ndarray(shape, dtype, buffer=self.shm.buf, offset=offset))
+                      for n, shape, dtype, offset in fields)
+        self._header = arrays['header']
+        self._max_priority = arrays['max_priority']
+        if create:
+            self._header[:] = 0
+            self._max_priority[0] = 1.0
+        self.lock = multiprocessing.Lock() if lock is None else lock
+
+        self._experience = {}
+        self.stored_e_ids = np.zeros(0, dtype=np.int64)
+        columns = tuple(arrays[n] for n in ('states', 'actions', 'rewards', 'next_states', 'terminals'))
+        self.storage = SharedArrayStorage(max_size, columns, self._header)
+        self.tree = proportional.SumTree(max_size, tree=arrays['tree'])
+        self.beta_grad = (1 - self.beta_zero) / float(self.total_steps - self.learn_start)
+        # numpy.random.Generator used for sampling
+        self.rng = np.random.default_rng(seed)
+
+    def __getstate__(self):
+        return {'config': self._config, 'name': self.shm.name, 'lock': self.lock}
+
+    def __setstate__(self, state):
+        self.__init__(name=state['name'], lock=state['lock'], create=False, **state['config'])
+
+    @property
+    def index(self):
+        return int(self._header[INDEX])
+
+    @index.setter
+    def index(self, value):
+        self._header[INDEX] = value
+
+    @property
+    def record_size(self):
+        return int(self._header[RECORD_SIZE])
+
+    @record_size.setter
+    def record_size(self, value):
+        self._header[RECORD_SIZE] = value
+
+    @property
+    def max_priority(self):
+        return float(self._max_priority[0])
+
+    @max_priority.setter
+    def max_priority(self, value):
+        self._max_priority[0] = value
+
+    @property
+    def isFull(self):
+        return self.record_size >= self.max_size
+
+    @isFull.setter
+    def isFull(self, value):
+        # derived from the shared record size
+        pass
+
+    def store(self, experience):
+        with self.lock:
+            return super(SharedExperience, self).store(experience)
+
+    def store_batch(self, experiences):
+        with self.lock:
+            return super(SharedExperience, self).store_batch(experiences)
+
+    def update_priority(self, indices, delta):
+        with self.lock:
+            return super(SharedExperience, self).update_priority(indices, delta)
+
+    update_priority_batch = update_priority
+
+    def sample(self, global_step):
+        with self.lock:
+            return super(SharedExperience, self).sample(global_step)
+
+    def close(self):
+        """
+        release this process's views of the block
+        """
+        self.storage = None
+        self.tree = None
+        self._header = None
+        self._max_priority = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        destroy the block, called once by the creator after every process closed it
+        """
+        if self._owner:
+            if sys.version_info < (3, 13) and os.name == 'posix':
+                # a process sharing our tracker may have unregistered the block when attaching
+                resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
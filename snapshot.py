@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Save and restore the full rank-based experience replay state
+
+import os
+import re
+import json
+import pickle
+import tempfile
+import numpy as np
+
+import storage
+
+"""
+A snapshot is a directory holding
+    meta.json: config, index / record_size, beta schedule, rng state, storage cursor, and the
+        generation of every file below
+    heap_priorities.<g>.npy, heap_ids.<g>.npy: the heap queue in array order
+    states.<g>.npy, actions.<g>.npy, rewards.<g>.npy, next_states.<g>.npy, terminals.<g>.npy:
+        ArrayStorage columns
+    experience.<g>.pkl: the _experience dict when there is no storage backend
+    rows.<g>.npz: rows of an incremental save not yet written into the columns
+load maps the column files (copy-on-write by default) so the buffer is ready once the heap is
+rebuilt and transitions are paged in when sampled. After a save or load the ArrayStorage records
+written slots, and an incremental save to the same path only rewrites those rows.
+A save writes the files of a new generation next to the current ones and then replaces meta.json,
+which is the only commit point: an interrupted save leaves the previous meta.json pointing at
+complete files of the previous generation. An incremental save writes its rows to rows.<g>.npz
+before the commit and into the columns in place only after it, load finishes that step if the
+save was interrupted. Files of other generations are removed once the save is committed.
+"""
+
+VERSION = 2
+COLUMNS = ('states', 'actions', 'rewards', 'next_states', 'terminals')
+CONFIG = ('max_size', 'alpha', 'beta_zero', 'batch_size', 'learn_start', 'total_steps',
+          'partition_num', 'cache_dir', 'eviction', 'compact_heap', 'ranking', 'update_log_size',
+          'sampling')
+# files of a generation, name.<generation>.ext
+GENERATION_FILE = re.compile(r'^(?:{}|heap_priorities|heap_ids|experience|rows)\.(\d+)\.(?:npy|npz|pkl)$'
+                             .format('|'.join(COLUMNS)))
+
+
+def _replace(path, write):
+    # write to a temporary file next to path, then move it over path
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _file(path, name, generation, ext='.npy'):
+    return os.path.join(path, '{}.{}{}'.format(name, generation, ext))
+
+
+def _read_meta(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+def _write_meta(path, meta):
+    _replace(os.path.join(path, 'meta.json'), lambda f: f.write(json.dumps(meta).encode()))
+
+
+def _apply_rows(path, meta):
+    # write the rows of an incremental save into the column files, idempotent
+    with np.load(_file(path, 'rows', meta['rows'], '.npz')) as rows:
+        slots = rows['slots']
+        for name in COLUMNS:
+            mapped = np.load(_file(path, name, meta['columns']), mmap_mode='r+')
+            mapped[slots] = rows[name]
+            mapped.flush()
+            del mapped
+
+
+def _cleanup(path, meta):
+    # remove the files of other generations, e.g. left by an interrupted save
+    keep = set(os.path.basename(_file(path, name, meta['columns'])) for name in COLUMNS)
+    keep.update(os.path.basename(_file(path, name, meta['generation']))
+                for name in ('heap_priorities', 'heap_ids'))
+    keep.add(os.path.basename(_file(path, 'experience', meta['generation'], '.pkl')))
+    for name in os.listdir(path):
+        if (GENERATION_FILE.match(name) and name not in keep) or name.endswith('.tmp'):
+            os.remove(os.path.join(path, name))
+
+
+def save(experience, path, incremental=False):
+    """
+    :param experience: rank_based.Experience
+    :param path: snapshot directory
+    :param incremental: only write the rows changed since the last save/load of this path
+    :return: None
+    """
+    backend = experience.storage
+    if backend is not None and not isinstance(backend, storage.ArrayStorage):
+        raise ValueError('snapshots need an ArrayStorage or no storage backend')
+    os.makedirs(path, exist_ok=True)
+    path = os.path.abspath(path)
+    previous = None
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        previous = _read_meta(path)
+        if previous.get('version') != VERSION:
+            previous = None
+    generation = 0 if previous is None else previous['generation'] + 1
+    incremental = (incremental and backend is not None and backend.dirty is not None and
+                   experience.snapshot_path == path and previous is not None and
+                   previous['columns'] is not None)
+
+    columns, rows = generation, None
+    if backend is None:
+        columns = None
+        _replace(_file(path, 'experience', generation, '.pkl'),
+                 lambda f: pickle.dump(experience._experience, f, pickle.HIGHEST_PROTOCOL))
+    elif incremental:
+        # the dirty slots are only cleared once the save is committed
+        slots = np.flatnonzero(backend.dirty)
+        changed = dict((name, column[slots]) for name, column in zip(COLUMNS, backend.columns()))
+        columns, rows = previous['columns'], generation
+        _replace(_file(path, 'rows', generation, '.npz'),
+                 lambda f: np.savez(f, slots=slots, **changed))
+    else:
+        for name, column in zip(COLUMNS, backend.columns()):
+            _replace(_file(path, name, generation), lambda f: np.save(f, column))
+
+    priorities = np.array(experience.queue.get_priorities(), dtype=np.float64)
+    e_ids = np.array(experience.queue.get_e_ids(), dtype=np.int64)
+    _replace(_file(path, 'heap_priorities', generation), lambda f: np.save(f, priorities))
+    _replace(_file(path, 'heap_ids', generation), lambda f: np.save(f, e_ids))
+
+    meta = {'version': VERSION,
+            'generation': generation,
+            'columns': columns,
+            'rows': rows,
+            'config': dict((k, getattr(experience, k)) for k in CONFIG),
+            'index': int(experience.index),
+            'record_size': int(experience.record_size),
+            'isFull': bool(experience.isFull),
+            'beta_grad': experience.beta_grad,
+            'rng': experience.rng.bit_generator.state,
+            'storage': None if backend is None else {'cursor': int(backend.cursor),
+                                                     'size': int(backend.size)}}
+    _write_meta(path, meta)
+    if rows is not None:
+        _apply_rows(path, meta)
+        meta['rows'] = None
+        _write_meta(path, meta)
+    _cleanup(path, meta)
+    if backend is not None:
+        if backend.dirty is None:
+            backend.track_dirty()
+        else:
+            backend.clear_dirty()
+    experience.snapshot_path = path
+
+
+def load(cls, path, mmap_mode='c'):
+    """
+    :param cls: Experience class to build
+    :param path: snapshot directory
+    :param mmap_mode: how to map the column files, 'c' (copy-on-write), 'r', 'r+' or None to read
+    :return: Experience
+    """
+    path = os.path.abspath(path)
+    meta = _read_meta(path)
+    if meta['version'] != VERSION:
+        raise ValueError('snapshot version {} not supported'.format(meta['version']))
+    if meta['rows'] is not None:
+        # an incremental save was interrupted after its commit, finish it
+        _apply_rows(path, meta)
+        meta['rows'] = None
+        _write_meta(path, meta)
+
+    backend = None
+    if meta['storage'] is not None:
+        columns = tuple(np.load(_file(path, name, meta['columns']), mmap_mode=mmap_mode)
+                        for name in COLUMNS)
+        backend = storage.ArrayStorage.from_columns(columns, meta['storage']['cursor'],
+                                                    meta['storage']['size'])
+        backend.track_dirty()
+    experience = cls(storage=backend, **meta['config'])
+    if backend is None:
+        with open(_file(path, 'experience', meta['generation'], '.pkl'), 'rb') as f:
+            experience._experience = pickle.load(f)
+
+    experience.index = meta['index']
+    experience.record_size = meta['record_size']
+    experience.isFull = meta['isFull']
+    experience.beta_grad = meta['beta_grad']
+    experience.rng.bit_generator.state = meta['rng']
+    priorities = np.load(_file(path, 'heap_priorities', meta['generation'])).tolist()
+    e_ids = np.load(_file(path, 'heap_ids', meta['generation'])).tolist()
+    experience.queue.restore(priorities, e_ids)
+    experience.snapshot_path = path
+    return experience
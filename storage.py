@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Array backed transition storage for the experience replay
+
+import lzma
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+"""
+Transition storage backends used by Experience in place of a dict of tuples.
+Transitions are (s1, a, r, s2, t) tuples, slots are 0 based (experience id - 1).
+ArrayStorage preallocates one numpy column per field and writes through a wrapping cursor,
+a batch is gathered with one fancy-indexing call per column.
+FrameStorage keeps each raw frame of stacked-frame observations once and rebuilds s1/s2 on gather.
+CompressedStorage compresses every state on store and decompresses only the gathered batch.
+"""
+
+class ArrayStorage(object):
+    """
+    param capacity: number of transitions
+    param state_shape: shape of a single state
+    param state_dtype: dtype of the states
+    param action_shape: shape of a single action, () for discrete actions
+    param action_dtype: dtype of the actions
+    param reward_dtype: dtype of the rewards
+    """
+    def __init__(self, capacity, state_shape=(), state_dtype=np.float32, action_shape=(),
+                 action_dtype=np.int64, reward_dtype=np.float32):
+        self.capacity = capacity
+        self.states = np.zeros((capacity,) + tuple(state_shape), dtype=state_dtype)
+        self.actions = np.zeros((capacity,) + tuple(action_shape), dtype=action_dtype)
+        self.rewards = np.zeros(capacity, dtype=reward_dtype)
+        self.next_states = np.zeros((capacity,) + tuple(state_shape), dtype=state_dtype)
+        self.terminals = np.zeros(capacity, dtype=np.bool_)
+        # next slot to write, wraps around once capacity is reached
+        self.cursor = 0
+        self.size = 0
+        # slots written since the last clear_dirty, None when not tracked (see snapshot.py)
+        self.dirty = None
+
+    @classmethod
+    def from_columns(cls, columns, cursor=0, size=None):
+        """
+        wrap existing column arrays (e.g. memory mapped) without allocating new ones
+        :param columns: tuple of arrays (s1, a, r, s2, t)
+        """
+        self = cls.__new__(cls)
+        self.states, self.actions, self.rewards, self.next_states, self.terminals = columns
+        self.capacity = len(self.rewards)
+        self.cursor = cursor
+        self.size = self.capacity if size is None else size
+        self.dirty = None
+        return self
+
+    def __len__(self):
+        return self.size
+
+    def track_dirty(self):
+        """
+        start recording written slots
+        """
+        self.dirty = np.zeros(self.capacity, dtype=np.bool_)
+
+    def clear_dirty(self):
+        """
+        :return: array of slots written since the last call
+        """
+        slots = np.nonzero(self.dirty)[0]
+        self.dirty[:] = False
+        return slots
+
+    def columns(self):
+        """
+        :return: tuple of the storage columns, in transition order
+        """
+        return (self.states, self.actions, self.rewards, self.next_states, self.terminals)
+
+    def is_full(self):
+        return self.size >= self.capacity
+
+    def append(self, experience):
+        """
+        write experience at the cursor, overwriting the oldest once full
+        :param experience: tuple (s1, a, r, s2, t)
+        :return: slot written
+        """
+        slot = self.cursor
+        self.put(slot, experience)
+        self.cursor = (self.cursor + 1) % self.capacity
+        return slot
+
+    def append_batch(self, experiences):
+        """
+        write a batch at the cursor
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        :return: array of slots written
+        """
+        k = len(experiences[1])
+        slots = (self.cursor + np.arange(k)) % self.capacity
+        for column, values in zip(self.columns(), experiences):
+            column[slots] = values
+        if self.dirty is not None:
+            self.dirty[slots] = True
+        self.cursor = (self.cursor + k) % self.capacity
+        self.size = min(self.size + k, self.capacity)
+        return slots
+
+    def put(self, slot, experience):
+        """
+        write experience at slot
+        :param slot: int, 0 based
+        :param experience: tuple (s1, a, r, s2, t)
+        """
+        for column, value in zip(self.columns(), experience):
+            column[slot] = value
+        if self.dirty is not None:
+            self.dirty[slot] = True
+        if slot >= self.size:
+            self.size = slot + 1
+
+    def put_batch(self, slots, experiences):
+        """
+        write a batch at the given slots
+        :param slots: array of 0 based slots
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        for column, values in zip(self.columns(), experiences):
+            column[slots] = values
+        if self.dirty is not None:
+            self.dirty[slots] = True
+        self.size = max(self.size, int(slots.max()) + 1)
+
+    def gather(self, slots):
+        """
+        :param slots: array of 0 based slots
+        :return: tuple of arrays (s1, a, r, s2, t), one row per slot
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        return tuple(column[slots] for column in self.columns())
+
+
+class FrameStorage(object):
+    """
+    storage for frame-stacked observations, s1 and s2 are (stack_size,) + frame_shape arrays
+    only the newest frame of s2 is kept per transition (s2 of step t is s1 of step t+1), plus
+    the full s1 of the first transition of each episode. A new episode starts after a terminal,
+    after start_episode() or when s1 isn't the whole s2 stack of the previous transition (a reset
+    frame equal to the last frame alone doesn't continue the episode)
+    param capacity: number of transitions
+    param stack_size: number of frames in a state
+    param frame_shape: shape of a single frame
+    param frame_dtype: dtype of the frames
+    param action_shape: shape of a single action, () for discrete actions
+    param action_dtype: dtype of the actions
+    param reward_dtype: dtype of the rewards
+    """
+    def __init__(self, capacity, stack_size, frame_shape, frame_dtype=np.uint8, action_shape=(),
+                 action_dtype=np.int64, reward_dtype=np.float32):
+        self.capacity = capacity
+        self.stack_size = stack_size
+        # frame of transition number n is kept at n % frame_capacity, the extra stack_size
+        # frames keep the history of the oldest transition alive
+        self.frame_capacity = capacity + stack_size
+        self.frames = np.zeros((self.frame_capacity,) + tuple(frame_shape), dtype=frame_dtype)
+        self.actions = np.zeros((capacity,) + tuple(action_shape), dtype=action_dtype)
+        self.rewards = np.zeros(capacity, dtype=reward_dtype)
+        self.terminals = np.zeros(capacity, dtype=np.bool_)
+        # transition number and step within its episode, per slot
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.episode_step = np.zeros(capacity, dtype=np.int64)
+        # transition number of an episode start -> its s1 stack, in insertion order
+        self._starts = {}
+        self._new_episode = True
+        # s2 stack of the last transition, s1 continues the episode only if it's equal
+        self._last_s2 = None
+        self.count = 0
+        self.cursor = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def is_full(self):
+        return self.size >= self.capacity
+
+    def nbytes(self):
+        """
+        :return: int, bytes held by the frames and columns
+        """
+        columns = (self.frames, self.actions, self.rewards, self.terminals, self.seq, self.episode_step)
+        return sum(c.nbytes for c in columns) + sum(s.nbytes for s in self._starts.values())
+
+    def start_episode(self):
+        """
+        mark the next transition as the first of an episode (e.g. after a truncation)
+        """
+        self._new_episode = True
+
+    def append(self, experience):
+        """
+        write experience at the cursor, overwriting the oldest once full
+        :param experience: tuple (s1, a, r, s2, t)
+        :return: slot written
+        """
+        s1, a, r, s2, t = experience
+        n = self.count
+        slot = self.cursor
+        if not self._new_episode and not np.array_equal(s1, self._last_s2):
+            self._new_episode = True
+        if self._new_episode:
+            self._starts[n] = np.array(s1, dtype=self.frames.dtype)
+            step = 0
+        else:
+            step = self.episode_step[(slot - 1) % self.capacity] + 1
+        self.frames[n % self.frame_capacity] = s2[-1]
+        self.actions[slot] = a
+        self.rewards[slot] = r
+        self.terminals[slot] = t
+        self.seq[slot] = n
+        self.episode_step[slot] = step
+        self._new_episode = bool(t)
+        self._last_s2 = np.array(s2, dtype=self.frames.dtype)
+
+        self.count += 1
+        self.cursor = (self.cursor + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        # episode starts older than the history of the oldest transition aren't needed
+        oldest = self.count - self.size
+        while self._starts:
+            start = next(iter(self._starts))
+            if start > oldest - self.stack_size:
+                break
+            del self._starts[start]
+        return slot
+
+    def append_batch(self, experiences):
+        """
+        write a batch of consecutive transitions of one episode stream at the cursor
+        transitions from different environments only dedupe frames within each stream
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        :return: array of slots written
+        """
+        return np.array([self.append(e) for e in zip(*experiences)], dtype=np.int64)
+
+    def gather(self, slots):
+        """
+        :param slots: array of 0 based slots
+        :return: tuple of arrays (s1, a, r, s2, t), one row per slot
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        seq = self.seq[slots]
+        start = seq - self.episode_step[slots]
+        # s1 is frames n - stack_size .. n - 1, s2 is frames n - stack_size + 1 .. n
+        pos = seq[:, None] + np.arange(-self.stack_size, 1)
+        stacked = self.frames[pos % self.frame_capacity]
+        # frames from before the episode start come from the stored first s1
+        for row in np.nonzero(pos[:, 0] < start)[0]:
+            first = self._starts[start[row]]
+            before = pos[row] < start[row]
+            stacked[row, before] = first[pos[row, before] - start[row] + self.stack_size]
+        s1 = np.ascontiguousarray(stacked[:, :-1])
+        s2 = np.ascontiguousarray(stacked[:, 1:])
+        return (s1, self.actions[slots], self.rewards[slots], s2, self.terminals[slots])
+
+
+CODECS = (None, 'zlib', 'lzma')
+
+
+class CompressedStorage(object):
+    """
+    storage keeping s1 and s2 compressed, one bytes object per state, actions, rewards and
+    terminals stay plain numpy columns. gather decompresses only the requested slots, split
+    between a thread pool (zlib and lzma release the GIL)
+    param capacity: number of transitions
+    param state_shape: shape of a single state
+    param state_dtype: dtype of the states
+    param action_shape, action_dtype, reward_dtype: see ArrayStorage
+    param codec: 'zlib', 'lzma' or None (quantization only)
+    param level: compression level (zlib level / lzma preset)
+    param quantize: scale of float states that are integers / quantize in [0, 255] (e.g. 255 for
+        pixels normalized to [0, 1]), such states are stored as uint8 before compression, states
+        that don't round trip exactly are stored as they are. None to disable
+    param workers: decompression threads, 0 to decompress in the calling thread
+    """
+    def __init__(self, capacity, state_shape=(), state_dtype=np.float32, action_shape=(),
+                 action_dtype=np.int64, reward_dtype=np.float32, codec='zlib', level=1,
+                 quantize=None, workers=4):
+        if codec not in CODECS:
+            raise ValueError('codec must be one of {}'.format(CODECS))
+        if quantize is not None and not np.issubdtype(state_dtype, np.floating):
+            raise ValueError('quantize needs a floating point state dtype')
+        self.capacity = capacity
+        self.state_shape = tuple(state_shape)
+        self.state_dtype = np.dtype(state_dtype)
+        self.codec = codec
+        self.level = level
+        self.quantize = quantize
+        # encoded states, and whether each one was quantized to uint8
+        self.states = np.empty(capacity, dtype=object)
+        self.next_states = np.empty(capacity, dtype=object)
+        self.quantized = np.zeros((2, capacity), dtype=np.bool_)
+        self.actions = np.zeros((capacity,) + tuple(action_shape), dtype=action_dtype)
+        self.rewards = np.zeros(capacity, dtype=reward_dtype)
+        self.terminals = np.zeros(capacity, dtype=np.bool_)
+        self.cursor = 0
+        self.size = 0
+        # bytes of the stored states, raw and encoded
+        self.raw_bytes = 0
+        self.encoded_bytes = 0
+        # decoding totals, for the throughput
+        self.decoded_bytes = 0
+        self.decode_seconds = 0.0
+        self._pool = ThreadPoolExecutor(workers) if workers else None
+        self._workers = workers
+
+    def __len__(self):
+        return self.size
+
+    def is_full(self):
+        return self.size >= self.capacity
+
+    def close(self):
+        """
+        stop the decompression threads
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def encode(self, state):
+        """
+        :param state: array of state_shape
+        :return: (bytes, quantized)
+        """
+        state = np.asarray(state, dtype=self.state_dtype)
+        quantized = False
+        if self.quantize is not None:
+            q = np.rint(state * self.quantize)
+            if q.min() >= 0 and q.max() <= 255 and np.array_equal(
+                    (q / self.quantize).astype(self.state_dtype), state):
+                state = q.astype(np.uint8)
+                quantized = True
+        data = np.ascontiguousarray(state).tobytes()
+        if self.codec == 'zlib':
+            data = zlib.compress(data, self.level)
+        elif self.codec == 'lzma':
+            data = lzma.compress(data, preset=self.level)
+        return data, quantized
+
+    def decode(self, data, quantized):
+        """
+        :return: state array
+        """
+        if self.codec == 'zlib':
+            data = zlib.decompress(data)
+        elif self.codec == 'lzma':
+            data = lzma.decompress(data)
+        if quantized:
+            state = np.frombuffer(data, dtype=np.uint8).astype(self.state_dtype)
+            state /= self.state_dtype.type(self.quantize)
+            return state.reshape(self.state_shape)
+        return np.frombuffer(data, dtype=self.state_dtype).reshape(self.state_shape)
+
+    def append(self, experience):
+        """
+        write experience at the cursor, overwriting the oldest once full
+        :param experience: tuple (s1, a, r, s2, t)
+        :return: slot written
+        """
+        slot = self.cursor
+        self.put(slot, experience)
+        self.cursor = (self.cursor + 1) % self.capacity
+        return slot
+
+    def append_batch(self, experiences):
+        """
+        write a batch at the cursor
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        :return: array of slots written
+        """
+        k = len(experiences[1])
+        slots = (self.cursor + np.arange(k)) % self.capacity
+        self.put_batch(slots, experiences)
+        self.cursor = (self.cursor + k) % self.capacity
+        return slots
+
+    def put(self, slot, experience):
+        """
+        write experience at slot
+        :param slot: int, 0 based
+        :param experience: tuple (s1, a, r, s2, t)
+        """
+        s1, a, r, s2, t = experience
+        self._put_states(slot, self.encode(s1), self.encode(s2))
+        self.actions[slot] = a
+        self.rewards[slot] = r
+        self.terminals[slot] = t
+        if slot >= self.size:
+            self.size = slot + 1
+
+    def put_batch(self, slots, experiences):
+        """
+        write a batch at the given slots, states are encoded on the thread pool
+        :param slots: array of 0 based slots
+        :param experiences: tuple of arrays (s1, a, r, s2, t), one row per transition
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        s1, a, r, s2, t = experiences
+        encode = self._pool.map if self._pool is not None else map
+        first = list(encode(self.encode, s1))
+        second = list(encode(self.encode, s2))
+        for slot, e1, e2 in zip(slots.tolist(), first, second):
+            self._put_states(slot, e1, e2)
+        self.actions[slots] = a
+        self.rewards[slots] = r
+        self.terminals[slots] = t
+        self.size = max(self.size, int(slots.max()) + 1)
+
+    def _put_states(self, slot, first, second):
+        raw = self.state_dtype.itemsize * int(np.prod(self.state_shape))
+        for column, quantized, (data, q) in ((self.states, self.quantized[0], first),
+                                             (self.next_states, self.quantized[1], second)):
+            old = column[slot]
+            if old is not None:
+                self.raw_bytes -= raw
+                self.encoded_bytes -= len(old)
+            column[slot] = data
+            quantized[slot] = q
+            self.raw_bytes += raw
+            self.encoded_bytes += len(data)
+
+    def gather(self, slots):
+        """
+        :param slots: array of 0 based slots
+        :return: tuple of arrays (s1, a, r, s2, t), one row per slot
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        start = time.perf_counter()
+        s1 = np.empty((len(slots),) + self.state_shape, dtype=self.state_dtype)
+        s2 = np.empty_like(s1)
+        if self._pool is None or len(slots) < 2:
+            self._decode_rows(slots, s1, s2, 0, len(slots))
+        else:
+            bounds = np.linspace(0, len(slots), min(self._workers, len(slots)) + 1).astype(int)
+            futures = [self._pool.submit(self._decode_rows, slots, s1, s2, lo, hi)
+                       for lo, hi in zip(bounds[:-1], bounds[1:])]
+            for future in futures:
+                future.result()
+        self.decode_seconds += time.perf_counter() - start
+        self.decoded_bytes += s1.nbytes + s2.nbytes
+        return (s1, self.actions[slots], self.rewards[slots], s2, self.terminals[slots])
+
+    def _decode_rows(self, slots, s1, s2, lo, hi):
+        for row in range(lo, hi):
+            slot = slots[row]
+            s1[row] = self.decode(self.states[slot], self.quantized[0, slot])
+            s2[row] = self.decode(self.next_states[slot], self.quantized[1, slot])
+
+    def nbytes(self):
+        """
+        :return: int, bytes held by the encoded states and the columns
+        """
+        columns = (self.actions, self.rewards, self.terminals, self.quantized, self.states,
+                   self.next_states)
+        return self.encoded_bytes + sum(c.nbytes for c in columns)
+
+    def stats(self):
+        """
+        :return: dict, compression ratio of the stored states and decode throughput
+        """
+        return {'raw_bytes': self.raw_bytes,
+                'encoded_bytes': self.encoded_bytes,
+                'ratio': self.raw_bytes / float(self.encoded_bytes) if self.encoded_bytes else 0.0,
+                'decoded_bytes': self.decoded_bytes,
+                'decode_seconds': self.decode_seconds,
+                'decode_mb_per_s': self.decoded_bytes / self.decode_seconds / 2 ** 20
+                if self.decode_seconds else 0.0}
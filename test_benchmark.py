@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Smoke tests for the benchmark harness
+
+import io
+import json
+import unittest
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_dqn(self):
+        for engine in sorted(benchmark.ENGINES):
+            result = benchmark.run_dqn(engine, size=300, steps=20, batch_size=8)
+            self.assertEqual((result['engine'], result['size'], result['steps']), (engine, 300, 20))
+            for name in ('store', 'sample', 'update'):
+                self.assertLessEqual(result[name + '_p50_us'], result[name + '_p99_us'])
+                self.assertGreater(result[name + '_per_sec'], 0)
+            self.assertGreater(result['peak_rss_bytes'], 0)
+            json.dumps(result)
+
+    def test_small_benchmarks(self):
+        out = io.StringIO()
+        results = benchmark.bench_rebalance(size=300, steps=20, batch_size=8, out=out)
+        results += benchmark.bench_ranking(size=300, steps=20, batch_size=8, out=out)
+        self.assertEqual(len(out.getvalue().splitlines()), len(results))
+        json.dumps(results)
@@ -6,6 +6,7 @@
 # description: Unit tests for the binary heap class
 
 import unittest
+import random
 import binary_heap
 import heapq
 
@@ -62,3 +63,129 @@ class TestBinaryHeap(unittest.TestCase):
         BH = binary_heap.BinaryHeap(initial_heap=new_test_data)
         self.assertEqual(BH.get_e_ids(), [4, 3, 2, 1, 0])
         self.assertEqual(BH.get_priorities(), [5, 4, 3, 2, 1])
+
+    def test_indexed_update(self):
+        random.seed(0)
+        BH = binary_heap.BinaryHeap(max_len=100)
+        for i in range(100):
+            BH.push((random.random(), i))
+        for _ in range(500):
+            e_id = random.randrange(100)
+            self.assertTrue(BH.update(e_id, random.random()))
+            self.assertEqual(BH.position[e_id], [v for _, v in BH.queue].index(e_id))
+        for i in range(len(BH.queue)):
+            self.assertEqual(BH.position[BH.queue[i][1]], i)
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < len(BH.queue):
+                    self.assertLessEqual(BH.queue[i], BH.queue[c])
+        popped = [BH.pop()[0] for _ in range(100)]
+        self.assertEqual(popped, sorted(popped, reverse=True))
+        self.assertEqual(BH.position, {})
+
+    def check_heap(self, BH, expected):
+        for i in range(len(BH.queue)):
+            self.assertEqual(BH.position[BH.queue[i][1]], i)
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < len(BH.queue):
+                    self.assertLessEqual(BH.queue[i], BH.queue[c])
+        order = sorted(expected, key=lambda e: (-expected[e], e))
+        self.assertEqual(BH.priority_to_experience(range(1, len(order) + 1)), order)
+
+    def test_batch(self):
+        random.seed(2)
+        for k in (2, 60):
+            BH = binary_heap.BinaryHeap(max_len=100)
+            expected = {i: random.random() for i in range(80)}
+            self.assertEqual(BH.push_batch(list(expected.values()), list(expected)), 80)
+            self.check_heap(BH, expected)
+            e_ids = [random.randrange(90) for _ in range(k)]
+            priorities = [random.random() for _ in range(k)]
+            updated = BH.update_batch(e_ids, priorities)
+            for e, p in zip(e_ids, priorities):
+                if e in expected:
+                    expected[e] = p
+            self.assertEqual(updated, sum(e < 80 for e in e_ids))
+            self.check_heap(BH, expected)
+
+    def test_remove(self):
+        random.seed(3)
+        BH = binary_heap.BinaryHeap(max_len=50)
+        expected = {i: random.random() for i in range(50)}
+        BH.push_batch(list(expected.values()), list(expected))
+        self.assertFalse(BH.remove(50))
+        for e_id in random.sample(range(50), 20):
+            self.assertTrue(BH.remove(e_id))
+            del expected[e_id]
+            self.check_heap(BH, expected)
+        self.assertFalse(BH.is_full())
+
+
+class TestArrayBinaryHeap(unittest.TestCase):
+
+    def test_matches_binary_heap(self):
+        random.seed(4)
+        BH = binary_heap.BinaryHeap(max_len=200)
+        AH = binary_heap.ArrayBinaryHeap(max_len=200, priority_type='d')
+        for _ in range(2000):
+            op = random.random()
+            e_id = random.randrange(1, 201)
+            p = random.random()
+            if op < 0.5:
+                self.assertEqual(AH.push((p, e_id)), BH.push((p, e_id)))
+            elif op < 0.8:
+                self.assertEqual(AH.update(e_id, p), BH.update(e_id, p))
+            else:
+                self.assertEqual(AH.remove(e_id), BH.remove(e_id))
+        self.assertEqual(AH.get_e_ids().tolist(), BH.get_e_ids())
+        self.assertEqual(AH.get_priorities().tolist(), BH.get_priorities())
+        ranks = range(1, BH.get_size() + 1)
+        self.assertEqual(AH.priority_to_experience(ranks), BH.priority_to_experience(ranks))
+        self.assertEqual([AH.pop() for _ in ranks], [BH.pop() for _ in ranks])
+
+    def test_batch(self):
+        random.seed(5)
+        AH = binary_heap.ArrayBinaryHeap(max_len=100)
+        priorities = [random.random() for _ in range(80)]
+        self.assertEqual(AH.push_batch(priorities, list(range(80))), 80)
+        self.assertEqual(AH.update_batch(list(range(0, 100, 2)), [2.0] * 50), 40)
+        popped = [AH.pop() for _ in range(80)]
+        self.assertEqual([e for _, e in popped[:40]], list(range(0, 80, 2)))
+        self.assertEqual([p for p, _ in popped], sorted([p for p, _ in popped], reverse=True))
+        self.assertFalse(AH.pop())
+
+    def test_views(self):
+        AH = binary_heap.ArrayBinaryHeap(max_len=10, initial_heap=test_data)
+        priorities = AH.get_priorities()
+        self.assertEqual(priorities.tolist(), [10, 9, 8, 7, 6, 5, 4, 3, 2, 1])
+        self.assertFalse(priorities.flags.writeable)
+        AH.update(10, 0.5)
+        self.assertEqual(priorities[0], 9)
+        self.assertFalse(AH.push((1, 11)))
+        self.assertEqual(AH.position_to_experience([0]), [9])
+
+    def test_nbytes(self):
+        AH = binary_heap.ArrayBinaryHeap(max_len=100000)
+        empty = AH.nbytes()
+        self.assertLess(empty, 12 * 100000 + 1000)
+        AH.push_batch([random.random() for _ in range(10000)], list(range(1, 10001)))
+        # the arrays are preallocated, the array rank index grows by ~12 bytes per entry
+        per_entry = (AH.nbytes() - empty) / 10000.0
+        self.assertLess(per_entry, 20)
+        AH.update_batch(list(range(1, 10001)), [random.random() for _ in range(10000)])
+        self.assertLess(AH.nbytes(), 12 * 100000 + 20 * 10000)
+
+    def test_balance_tree(self):
+        random.seed(6)
+        priorities = [random.random() for _ in range(100)]
+        for heap in (binary_heap.BinaryHeap, binary_heap.ArrayBinaryHeap):
+            BH = heap(max_len=100)
+            for e_id, p in enumerate(priorities):
+                BH.push((p, e_id))
+            self.assertGreater(BH.disorder(), 0)
+            BH.balance_tree()
+            self.assertEqual(BH.disorder(), 0)
+            order = BH.priority_to_experience(range(1, 101))
+            self.assertEqual(list(BH.get_e_ids()), order)
+            self.assertEqual(BH.position_to_experience(range(100)), order)
+            BH.update(order[-1], 2.0)
+            self.assertEqual(BH.pop()[1], order[-1])
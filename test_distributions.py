@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the rank-based sampling distributions
+
+import io
+import os
+import sys
+import math
+import tempfile
+import unittest
+import numpy as np
+import distributions
+
+
+def reference(n, alpha, batch_size):
+    # original per-partition python implementation
+    pdf = [math.pow(x, -alpha) for x in range(1, n + 1)]
+    pdf_sum = math.fsum(pdf)
+    pdf = [x / pdf_sum for x in pdf]
+    cdf = np.cumsum(pdf)
+    strata_ends = {1: 0, batch_size + 1: n}
+    step = 1 / float(batch_size)
+    index = 1
+    for s in range(2, batch_size + 1):
+        while cdf[index] < step:
+            index += 1
+        strata_ends[s] = index
+        step += 1 / float(batch_size)
+    return pdf, strata_ends
+
+
+class TestRankDistributions(unittest.TestCase):
+
+    def test_matches_reference(self):
+        dist = distributions.RankDistributions(1000, 0.7, 32, 10, 100)
+        self.assertEqual(dist.keys(), list(range(1, 11)))
+        for p in dist.keys():
+            pdf, strata_ends = reference(p * 100, 0.7, 32)
+            self.assertEqual(dist[p]['strata_ends'], strata_ends)
+            np.testing.assert_allclose(dist[p]['pdf'], pdf)
+
+    def test_partitions(self):
+        dist = distributions.RankDistributions(50, 0.7, 4, 5, 20, max_rank=40)
+        self.assertNotIn(1, dist)
+        self.assertIn(2, dist)
+        self.assertNotIn(5, dist)
+        self.assertRaises(KeyError, dist.__getitem__, 5)
+        self.assertEqual(len(dist), 3)
+        dist[2]
+        dist[3]
+        self.assertEqual(list(dist._built), [3])
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            built = distributions.RankDistributions(1000, 0.7, 32, 10, 100, cache_dir=cache_dir)
+            self.assertTrue(os.path.exists(built.cache_path()))
+            self.assertIsNone(built.strata_table)
+            loaded = distributions.RankDistributions(1000, 0.7, 32, 10, 100, cache_dir=cache_dir)
+            self.assertIsInstance(loaded.weights, np.memmap)
+            for p in built.keys():
+                self.assertEqual(loaded[p]['strata_ends'], built[p]['strata_ends'])
+                np.testing.assert_array_equal(loaded[p]['pdf'], built[p]['pdf'])
+            # a different config gets its own file
+            other = distributions.RankDistributions(1000, 0.5, 32, 10, 100, cache_dir=cache_dir)
+            self.assertNotEqual(other.cache_path(), built.cache_path())
+
+    def test_corrupted_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            built = distributions.RankDistributions(1000, 0.7, 32, 10, 100, cache_dir=cache_dir)
+            with open(built.cache_path(), 'r+b') as f:
+                f.seek(-100, os.SEEK_END)
+                f.truncate()
+            stderr = sys.stderr
+            sys.stderr = io.StringIO()
+            try:
+                rebuilt = distributions.RankDistributions(1000, 0.7, 32, 10, 100, cache_dir=cache_dir)
+            finally:
+                sys.stderr = stderr
+            self.assertEqual(rebuilt[10]['strata_ends'], built[10]['strata_ends'])
+            loaded = distributions.RankDistributions(1000, 0.7, 32, 10, 100, cache_dir=cache_dir)
+            self.assertIsNotNone(loaded.strata_table)
+
+    def test_checksum(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            built = distributions.RankDistributions(1000, 0.7, 32, 10, 100, cache_dir=cache_dir)
+            # overwrite one weight and one strata end in place
+            for index in (distributions.HEADER_LEN + 5, -20):
+                data = np.load(built.cache_path(), mmap_mode='r+')
+                original = data[index]
+                data[index] = 5.0
+                data.flush()
+                del data
+                stderr = sys.stderr
+                sys.stderr = io.StringIO()
+                try:
+                    rebuilt = distributions.RankDistributions(1000, 0.7, 32, 10, 100, cache_dir=cache_dir)
+                    self.assertIn('checksum', sys.stderr.getvalue())
+                finally:
+                    sys.stderr = stderr
+                self.assertIsNone(rebuilt.strata_table)
+                self.assertAlmostEqual(rebuilt.weights[5], 6 ** -0.7)
+                self.assertNotEqual(original, 5.0)
+
+    def test_pdf_shared(self):
+        dist = distributions.RankDistributions(1000, 0.7, 32, 10, 100)
+        pdf = dist[5]['pdf']
+        self.assertIs(pdf.weights, dist.weights)
+        self.assertEqual(len(pdf), 500)
+        self.assertAlmostEqual(pdf[4], dist.weights[4] / dist.cumsum[499])
+        self.assertAlmostEqual(float(np.sum(pdf[np.arange(500)])), 1.0)
+        self.assertAlmostEqual(dist[5]['total'], dist.cumsum[499])
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the experience replay metrics
+
+import unittest
+import numpy as np
+import metrics
+import rank_based
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_timing(self):
+        timing = metrics.Timing()
+        for seconds in [1e-6] * 98 + [1e-3, 2e-3]:
+            timing.add(seconds)
+        summary = timing.summary()
+        self.assertEqual(summary['count'], 100)
+        # bucket upper edges: 1us falls in [512, 1024) ns
+        self.assertAlmostEqual(summary['p50_us'], 1.024)
+        self.assertAlmostEqual(summary['max_us'], 2000.0)
+        self.assertGreater(summary['p99_us'], 100)
+
+    def test_experience(self):
+        events = []
+        M = metrics.Metrics(callback=lambda kind, name, value: events.append((kind, name)))
+        experience = rank_based.Experience(max_size=50, learn_start=10, partition_num=5,
+                                           total_steps=100, batch_size=4, eviction='fifo',
+                                           metrics=M)
+        for i in range(55):
+            experience.store((i, 0, 0, i, 0))
+        experience.store_batch((np.arange(30), np.zeros(30), np.zeros(30), np.arange(30), np.zeros(30)))
+        sample, w, e_id = experience.sample(20)
+        experience.update_priority_batch(e_id, np.ones(4))
+        snapshot = M.snapshot()
+        self.assertEqual(snapshot['counters'], {'store': 55, 'store_batch': 30, 'evict': 35,
+                                                'sample': 4, 'update': 4})
+        self.assertNotIn('flush', snapshot['timings'])
+        self.assertEqual(snapshot['timings']['store']['count'], 55)
+        self.assertEqual(snapshot['timings']['evict']['count'], 6)
+        self.assertIn('rebuild', snapshot['timings'])
+        # the balance_tree run by a rebuild isn't recorded as a balance
+        self.assertNotIn('balance', snapshot['timings'])
+        experience.queue.balance_tree()
+        self.assertEqual(M.snapshot()['timings']['balance']['count'], 1)
+        gauges = snapshot['gauges']
+        self.assertEqual(gauges['fill'], 1.0)
+        self.assertAlmostEqual(gauges['beta'], experience.current_beta)
+        self.assertEqual(gauges['priority']['max'], gauges['max_priority'])
+        self.assertIn(('timing', 'sample'), events)
+        M.reset()
+        self.assertEqual(M.snapshot()['counters'], {})
+
+    def test_flush(self):
+        M = metrics.Metrics()
+        experience = rank_based.Experience(max_size=50, learn_start=10, partition_num=5,
+                                           total_steps=100, batch_size=4, update_log_size=64,
+                                           metrics=M)
+        for i in range(20):
+            experience.store((i, 0, 0, i, 0))
+        sample, w, e_id = experience.sample(20)
+        self.assertNotIn('flush', M.snapshot()['counters'])
+        experience.update_priority_batch(e_id, np.ones(4))
+        experience.sample(21)
+        self.assertEqual(M.snapshot()['timings']['flush']['count'], 1)
+        self.assertEqual(M.snapshot()['counters']['flush'], len(set(e_id.tolist())))
+
+    def test_disabled(self):
+        experience = rank_based.Experience(max_size=10)
+        self.assertIsNone(experience.metrics)
+        self.assertNotIn('store', vars(experience))
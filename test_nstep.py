@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the n-step transition builder
+
+import unittest
+import numpy as np
+import nstep
+import rank_based
+import storage
+
+
+class Recorder(object):
+    # stands in for an Experience, keeps every stored transition
+    def __init__(self):
+        self.transitions = []
+
+    def store_batch(self, experiences):
+        self.transitions.extend(zip(*experiences))
+        return len(experiences[1])
+
+
+def reference(episode, n, gamma, truncated):
+    # n-step transitions of one episode [(s1, a, r, s2, t)], computed from scratch
+    res = []
+    for i in range(len(episode)):
+        window = episode[i:i + n]
+        if len(window) < n and not window[-1][4]:
+            if truncated or i + n > len(episode):
+                continue
+        ret = sum(gamma ** k * step[2] for k, step in enumerate(window))
+        res.append((episode[i][0], episode[i][1], ret, window[-1][3], window[-1][4]))
+    return res
+
+
+class TestNStepBuilder(unittest.TestCase):
+
+    def test_vectorized(self):
+        rng = np.random.default_rng(0)
+        num_envs, n, gamma = 3, 4, 0.9
+        recorder = Recorder()
+        builder = nstep.NStepBuilder(recorder, n=n, gamma=gamma, num_envs=num_envs)
+        episodes = [[] for _ in range(num_envs)]
+        expected = []
+        state = rng.random((num_envs, 2))
+        for step in range(300):
+            a = rng.integers(0, 5, num_envs)
+            r = rng.standard_normal(num_envs)
+            s2 = rng.random((num_envs, 2))
+            t = rng.random(num_envs) < 0.05
+            cut = (rng.random(num_envs) < 0.03) & ~t
+            builder.add(state, a, r, s2, t, truncated=cut)
+            for e in range(num_envs):
+                episodes[e].append((state[e], a[e], r[e], s2[e], bool(t[e])))
+                if t[e] or cut[e]:
+                    expected.extend(reference(episodes[e], n, gamma, cut[e]))
+                    episodes[e] = []
+            state = s2
+        for e in range(num_envs):
+            # still running, only the complete windows were stored
+            expected.extend(reference(episodes[e], n, gamma, True))
+        key = lambda tr: (tuple(tr[0]), int(tr[1]))
+        got = sorted(recorder.transitions, key=key)
+        expected = sorted(expected, key=key)
+        self.assertEqual(len(got), len(expected))
+        self.assertEqual(builder.stored, len(expected))
+        for g, x in zip(got, expected):
+            np.testing.assert_array_equal(g[0], x[0])
+            self.assertEqual(g[1], x[1])
+            self.assertAlmostEqual(g[2], x[2])
+            np.testing.assert_array_equal(g[3], x[3])
+            self.assertEqual(bool(g[4]), x[4])
+
+    def test_single_env(self):
+        experience = rank_based.Experience(max_size=10, learn_start=2, partition_num=2,
+                                           total_steps=100, batch_size=2,
+                                           storage=storage.ArrayStorage(10, (2,)))
+        builder = nstep.NStepBuilder(experience, n=2, gamma=0.5)
+        self.assertEqual(builder.add(np.zeros(2), 1, 1.0, np.ones(2), False), 0)
+        self.assertEqual(builder.add(np.ones(2), 2, 2.0, np.full(2, 2.0), False), 1)
+        self.assertEqual(builder.pending().tolist(), [1])
+        self.assertEqual(builder.add(np.full(2, 2.0), 3, 4.0, np.full(2, 3.0), True), 2)
+        s1, a, r, s2, t = experience.storage.gather([0, 1, 2])
+        np.testing.assert_array_equal(a, [1, 2, 3])
+        np.testing.assert_array_equal(r, [2.0, 4.0, 4.0])
+        np.testing.assert_array_equal(s2[:, 0], [2.0, 3.0, 3.0])
+        np.testing.assert_array_equal(t, [False, True, True])
+        self.assertEqual(experience.queue.get_priorities([1, 2, 3]), [1, 1, 1])
+        self.assertRaises(ValueError, nstep.NStepBuilder, experience, n=0)
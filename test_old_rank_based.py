@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the conf based rank experience replay
+
+import unittest
+import random
+import numpy as np
+import old_rank_based
+
+
+def build(**conf):
+    conf.update({'size': 100, 'learn_start': 10, 'partition_num': 5, 'steps': 1000,
+                 'batch_size': 8})
+    experience = old_rank_based.Experience(conf)
+    for i in range(100):
+        experience.store((i, 0, 0, i + 1, False))
+    random.seed(0)
+    experience.update_priority(list(range(1, 101)), [random.random() for _ in range(100)])
+    return experience
+
+
+class TestRebalance(unittest.TestCase):
+
+    def test_rebalance(self):
+        experience = build()
+        heap = experience.priority_queue
+        self.assertGreater(heap.disorder(), 0)
+        experience.rebalance()
+        self.assertEqual(heap.disorder(), 0)
+        ranks = range(1, 101)
+        self.assertEqual(heap.position_to_experience([r - 1 for r in ranks]),
+                         heap.priority_to_experience(ranks))
+
+    def test_position_mode(self):
+        experience = build(rank_mode='position', rebalance_interval=5)
+        heap = experience.priority_queue
+        sample, w, e_id = experience.sample(20)
+        self.assertEqual(experience.rebalance_count, 1)
+        self.assertEqual(experience.last_rebalance, 20)
+        self.assertEqual(len(e_id), 8)
+        # positions are exact ranks right after a rebalance
+        order = heap.priority_to_experience(range(1, 101))
+        self.assertEqual(heap.get_e_ids(), order)
+        experience.update_priority(e_id, np.zeros(8))
+        experience.sample(24)
+        self.assertEqual(experience.rebalance_count, 1)
+        experience.sample(25)
+        self.assertEqual(experience.rebalance_count, 2)
+
+    def test_adaptive(self):
+        experience = build(rank_mode='position', rebalance_disorder=0.1)
+        self.assertTrue(experience.maybe_rebalance(11))
+        self.assertFalse(experience.maybe_rebalance(12))
+        self.assertRaises(ValueError, old_rank_based.Experience, {'size': 10, 'rank_mode': 'approx'})
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the prefetching sampler
+
+import time
+import unittest
+import threading
+import numpy as np
+import prefetch
+import rank_based
+import proportional
+
+
+class TestPrefetchSampler(unittest.TestCase):
+
+    def test_sample(self):
+        experience = rank_based.Experience(max_size=100, learn_start=20, partition_num=10,
+                                           total_steps=1000, batch_size=4, seed=0, eviction='fifo')
+        with prefetch.PrefetchSampler(experience, num_batches=3, num_workers=2) as sampler:
+            self.assertEqual(sampler.sample(1), (False, False, False))
+            for i in range(150):
+                sampler.store((i, 0, 0, i, 0))
+            for step in range(50):
+                sample, w, e_id = sampler.sample(step + 21)
+                self.assertEqual(len(e_id), 4)
+                self.assertEqual([experience.retrieve([e])[0] for e in e_id], sample)
+                sampler.update_priority(e_id, np.arange(1.0, 5.0) * step)
+            self.assertFalse(sampler.batches.qsize() > 3)
+
+    def test_stale(self):
+        experience = proportional.Experience(max_size=50, learn_start=10, total_steps=1000,
+                                             batch_size=50, seed=0)
+        for i in range(50):
+            experience.store((i, 0, 0, i, 0))
+        sampler = prefetch.PrefetchSampler(experience, num_batches=2)
+        try:
+            while not sampler.batches.full():
+                time.sleep(0.01)
+            # every id is in every batch of 50, so both prefetched batches are stale
+            sampler.update_priority([1], [3.0])
+            sample, w, e_id = sampler.sample(11)
+            self.assertGreaterEqual(sampler.dropped, 2)
+        finally:
+            sampler.close()
+        self.assertRaises(ValueError, prefetch.PrefetchSampler, experience, stale='reweight')
+
+    def test_concurrent_store(self):
+        experience = rank_based.Experience(max_size=200, learn_start=20, partition_num=10,
+                                           total_steps=1000, batch_size=8, seed=1, eviction='lowest')
+        with prefetch.PrefetchSampler(experience, num_workers=2) as sampler:
+            def actor():
+                for i in range(500):
+                    sampler.store((i, 0, 0, i, 0))
+            for i in range(20):
+                sampler.store((i, 0, 0, i, 0))
+            thread = threading.Thread(target=actor)
+            thread.start()
+            for step in range(100):
+                sample, w, e_id = sampler.sample(step + 21)
+                sampler.update_priority(e_id, np.ones(8) * step)
+            thread.join()
+            self.assertEqual(experience.queue.get_size(), 200)
+
+    def test_reused_ids(self):
+        experience = proportional.Experience(max_size=10, learn_start=10, total_steps=1000,
+                                             batch_size=10, seed=0)
+        for i in range(10):
+            experience.store((i, 0, 0, i, 0))
+        with prefetch.PrefetchSampler(experience, num_batches=2) as sampler:
+            while not sampler.batches.full():
+                time.sleep(0.01)
+            # the oldest id is reused, batches drawn before hold the old transition
+            sampler.store((10, 0, 0, 10, 0))
+            sample, w, e_id = sampler.sample(11)
+            self.assertGreaterEqual(sampler.dropped, 1)
+            self.assertEqual([experience.retrieve([e])[0] for e in e_id], sample)
+            dropped = sampler.dropped
+            while sampler.batches.qsize() < 2:
+                time.sleep(0.01)
+            sampler.store_batch((np.arange(11, 13), np.zeros(2), np.zeros(2), np.arange(11, 13),
+                                 np.zeros(2)))
+            np.testing.assert_array_equal(experience.stored_e_ids, [2, 3])
+            sampler.sample(11)
+            self.assertGreater(sampler.dropped, dropped)
+
+    def test_beta(self):
+        experience = rank_based.Experience(max_size=100, learn_start=20, partition_num=10,
+                                           total_steps=120, batch_size=8, seed=0)
+        for i in range(100):
+            experience.store((i, 0, 0, i, 0))
+        experience.update_priority_batch(np.arange(1, 101), np.arange(1.0, 101.0))
+        with prefetch.PrefetchSampler(experience, num_batches=1, stale='keep') as sampler:
+            while not sampler.batches.full():
+                time.sleep(0.01)
+            # drawn with the beta of step 21, handed out at step 130
+            sample, w, e_id = sampler.sample(130)
+            self.assertEqual(sampler.beta(130), 1)
+            # id e has rank 101 - e, w = (N * P) ^ -beta / max w
+            x = experience.distributions[10]['pdf'][100 - e_id] * 100
+            np.testing.assert_allclose(w, np.power(x, -1.0) / np.power(x, -1.0).max())
+
+    def test_worker_error(self):
+        # learn_start below the partition size, the first distribution doesn't exist
+        experience = rank_based.Experience(max_size=100, learn_start=5, partition_num=10,
+                                           total_steps=1000, batch_size=4, seed=0)
+        for i in range(5):
+            experience.store((i, 0, 0, i, 0))
+        with prefetch.PrefetchSampler(experience, num_workers=2) as sampler:
+            self.assertRaises(KeyError, sampler.sample, 6)
+            for worker in sampler._workers:
+                worker.join(1)
+            self.assertFalse(any(worker.is_alive() for worker in sampler._workers))
+            # the queue is drained, the stored error is raised instead of blocking
+            while not sampler.batches.empty():
+                sampler.batches.get()
+            self.assertRaises(KeyError, sampler.sample, 6)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the proportional prioritized experience replay
+
+import unittest
+import numpy as np
+import proportional
+import storage
+
+
+class TestSumTree(unittest.TestCase):
+
+    def test_sums(self):
+        ST = proportional.SumTree(5)
+        self.assertEqual(ST.capacity, 8)
+        ST.update([0, 1, 2, 3, 4], [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(ST.total(), 15.0)
+        ST.update([1, 1], [0.0, 7.0])
+        self.assertEqual(ST.total(), 20.0)
+        np.testing.assert_array_equal(ST.get([1, 4]), [7.0, 5.0])
+        np.testing.assert_array_equal(ST.find([0.0, 0.99, 1.0, 7.99, 8.0, 19.99]), [0, 0, 1, 1, 2, 4])
+
+    def test_distribution(self):
+        ST = proportional.SumTree(4)
+        ST.update([0, 1, 2, 3], [1.0, 2.0, 3.0, 4.0])
+        leaves = ST.find(np.random.default_rng(0).random(20000) * ST.total())
+        np.testing.assert_allclose(np.bincount(leaves) / 20000.0, [0.1, 0.2, 0.3, 0.4], atol=0.01)
+
+
+class TestProportional(unittest.TestCase):
+
+    def test_sample(self):
+        experience = proportional.Experience(max_size=50, learn_start=10, total_steps=100,
+                                             batch_size=4, seed=0)
+        self.assertEqual(experience.sample(1), (False, False, False))
+        for i in range(1, 56):
+            self.assertTrue(experience.store((i, 1, 1, i, 1)))
+        self.assertEqual(experience.record_size, 50)
+        self.assertEqual(experience.retrieve([1])[0][0], 51)
+        sample, w, e_id = experience.sample(51)
+        self.assertEqual(len(sample), 4)
+        np.testing.assert_array_equal(w, np.ones(4))
+        high = e_id[-1]
+        experience.update_priority(e_id, [0.0, 0.0, 0.0, 100.0])
+        self.assertAlmostEqual(experience.max_priority, (100.0 + 1e-6) ** 0.6)
+        sample, w, e_id = experience.sample(51)
+        self.assertIn(high, e_id)
+        self.assertTrue(np.all(w <= 1.0))
+
+    def test_store_batch(self):
+        experience = proportional.Experience(max_size=8, learn_start=2, total_steps=100,
+                                             batch_size=2, storage=storage.ArrayStorage(8))
+        self.assertEqual(experience.store_batch((np.arange(10), np.zeros(10), np.zeros(10),
+                                                 np.arange(10), np.zeros(10))), 10)
+        self.assertEqual((experience.index, experience.record_size), (2, 8))
+        self.assertEqual(experience.tree.total(), 8.0)
+        (s1, a, r, s2, t), w, e_id = experience.sample(10)
+        np.testing.assert_array_equal(s1, [(e - 1) + (8 if e <= 2 else 0) for e in e_id])
@@ -6,7 +6,10 @@
 # description: Unit tests for the rank-based prioritized experience replay
 
 import unittest
+import numpy as np
 import rank_based
+import rank_index
+import storage
 
 
 def test():
@@ -56,6 +59,177 @@ def test():
     print(experience.priority_queue)
 
 
+class TestRankBased(unittest.TestCase):
+
+    def test_sample(self):
+        experience = rank_based.Experience(max_size=50, learn_start=10, partition_num=5,
+                                           total_steps=100, batch_size=4)
+        for i in range(1, 51):
+            self.assertTrue(experience.store((i, 1, 1, i, 1)))
+        self.assertFalse(experience.store((51, 1, 1, 51, 1)))
+        sample, w, e_id = experience.sample(51)
+        self.assertEqual(len(sample), 4)
+        self.assertEqual([s[0] for s in sample], list(e_id))
+        self.assertAlmostEqual(max(w), 1.0)
+        experience.update_priority(e_id, [10, 20, 30, 40])
+        self.assertEqual(experience.queue.priority_to_experience([1, 2, 3, 4]), list(e_id)[::-1])
+
+    def test_sample_seeded(self):
+        results = []
+        for _ in range(2):
+            experience = rank_based.Experience(max_size=100, learn_start=10, partition_num=10,
+                                               total_steps=200, batch_size=8, seed=3)
+            for i in range(1, 101):
+                experience.store((i, 1, 1, i, 1))
+            sample, w, e_id = experience.sample(101)
+            self.assertEqual(e_id.dtype, np.int64)
+            self.assertTrue(w.flags['C_CONTIGUOUS'] and e_id.flags['C_CONTIGUOUS'])
+            self.assertEqual(len(set(e_id)), 8)
+            results.append((list(e_id), list(w)))
+        self.assertEqual(results[0], results[1])
+
+    def test_store_batch(self):
+        experience = rank_based.Experience(max_size=50, learn_start=10, partition_num=5,
+                                           total_steps=100, batch_size=4)
+        self.assertTrue(experience.store((0, 1, 1, 0, 1)))
+        columns = (np.arange(1, 61), np.ones(60), np.ones(60), np.arange(1, 61), np.zeros(60))
+        self.assertEqual(experience.store_batch(columns), 49)
+        self.assertEqual(experience.record_size, 50)
+        self.assertEqual(experience.retrieve([2])[0][0], 1)
+        sample, w, e_id = experience.sample(51)
+        experience.update_priority_batch(e_id, -np.arange(10.0, 14.0))
+        self.assertEqual(experience.queue.priority_to_experience([1, 2, 3, 4]), list(e_id)[::-1])
+
+    def test_bucket_ranking(self):
+        experience = rank_based.Experience(max_size=100, learn_start=10, partition_num=10,
+                                           total_steps=200, batch_size=8, seed=0,
+                                           ranking='bucket')
+        self.assertIsInstance(experience.queue.rank_index, rank_index.BucketRankIndex)
+        for i in range(1, 101):
+            experience.store((i, 1, 1, i, 1))
+        # every priority in one bucket, the ranks are uniform over the buffer
+        self.assertAlmostEqual(experience.rank_error(), (100 ** 2 - 1) / 300.0)
+        experience.update_priority_batch(np.arange(1, 101), np.geomspace(1e-8, 1e8, 100))
+        self.assertLess(experience.rank_error(), 1.0)
+        sample, w, e_id = experience.sample(101)
+        self.assertEqual(len(e_id), 8)
+        self.assertEqual([s[0] for s in sample], list(e_id))
+        self.assertRaises(ValueError, rank_based.Experience, ranking='approximate')
+        # the lowest ranks share a bucket, evict must still return distinct victims
+        experience = rank_based.Experience(max_size=20, learn_start=5, partition_num=4,
+                                           total_steps=100, batch_size=4, seed=0,
+                                           eviction='lowest', ranking='bucket',
+                                           storage=storage.ArrayStorage(20))
+        for i in range(20):
+            experience.store((i, 0, 0, i, 0))
+        self.assertEqual(experience.store_batch((np.arange(20, 30), np.zeros(10), np.zeros(10),
+                                                 np.arange(20, 30), np.zeros(10))), 10)
+        ids = experience.queue.get_e_ids()
+        self.assertEqual(sorted(ids), list(range(1, 21)))
+        # no transition was written over another one of the batch
+        values = set(experience.retrieve(sorted(ids))[0].tolist())
+        self.assertEqual(len(values), 20)
+        self.assertTrue(set(range(20, 30)) <= values)
+
+    def test_update_log(self):
+        rng = np.random.default_rng(1)
+        experiences = [rank_based.Experience(max_size=50, learn_start=10, partition_num=5,
+                                             total_steps=100, batch_size=4, seed=2,
+                                             eviction='lowest', update_log_size=size)
+                       for size in (None, 64)]
+        for experience in experiences:
+            for i in range(50):
+                experience.store((i, 0, 0, i, 0))
+        for i in range(30):
+            delta = rng.standard_normal(4)
+            results = []
+            for experience in experiences:
+                sample, w, e_id = experience.sample(50 + i)
+                experience.update_priority_batch(e_id, delta)
+                experience.update_priority(e_id[:2], delta[:2] * 2)
+                results.append(list(e_id))
+            self.assertEqual(results[0], results[1])
+        immediate, deferred = experiences
+        self.assertGreater(len(deferred.update_log), 0)
+        # new experiences get at least the max priority
+        self.assertGreaterEqual(deferred.get_max_priority(), immediate.get_max_priority())
+        self.assertGreater(deferred.flush_updates(), 0)
+        self.assertEqual(len(deferred.update_log), 0)
+        ranks = range(1, 51)
+        self.assertEqual(deferred.queue.priority_to_experience(ranks),
+                         immediate.queue.priority_to_experience(ranks))
+        # evicting the lowest flushes first
+        deferred.update_priority_batch([1], [100.0])
+        deferred.store((50, 0, 0, 50, 0))
+        self.assertEqual(len(deferred.update_log), 0)
+        self.assertEqual(deferred.queue.get_priorities([deferred.index]), [100.0])
+        # a fifo victim's pending update is dropped, not applied to the new experience
+        fifo = rank_based.Experience(max_size=4, learn_start=2, partition_num=2, total_steps=100,
+                                     batch_size=2, eviction='fifo', update_log_size=16)
+        for i in range(4):
+            fifo.store((i, 0, 0, i, 0))
+        fifo.update_priority_batch([1, 2], [0.25, 0.5])
+        fifo.store((4, 0, 0, 4, 0))
+        self.assertEqual(fifo.update_log.ids[:len(fifo.update_log)].tolist(), [2])
+        fifo.flush_updates()
+        self.assertEqual(fifo.queue.get_priorities([1, 2]), [1, 0.5])
+
+    def test_eviction(self):
+        for eviction in ('fifo', 'lowest', 'random'):
+            for backend, compact_heap in ((None, False), (storage.ArrayStorage(20), False),
+                                          (storage.ArrayStorage(20), True)):
+                experience = rank_based.Experience(max_size=20, learn_start=5, partition_num=4,
+                                                   total_steps=100, batch_size=4, seed=0,
+                                                   eviction=eviction, storage=backend,
+                                                   compact_heap=compact_heap)
+                for i in range(20):
+                    experience.store((i, 0, 0, i, 0))
+                # give experience 8 the lowest priority
+                delta = np.arange(20.0, 0.0, -1)
+                delta[7] = 0.5
+                experience.update_priority_batch(np.arange(1, 21), delta)
+                self.assertTrue(experience.store((20, 0, 0, 20, 0)))
+                self.assertEqual(experience.queue.get_size(), 20)
+                self.assertEqual(experience.record_size, 20)
+                if eviction == 'fifo':
+                    self.assertEqual(experience.index, 1)
+                if eviction == 'lowest':
+                    self.assertEqual(experience.index, 8)
+                self.assertEqual(experience.retrieve([experience.index])[0][0], 20)
+                self.assertEqual(experience.store_batch((np.arange(21, 31), np.zeros(10), np.zeros(10),
+                                                         np.arange(21, 31), np.zeros(10))), 10)
+                self.assertEqual(experience.queue.get_size(), 20)
+                ids = experience.queue.get_e_ids()
+                self.assertEqual(sorted(ids), list(range(1, 21)))
+                stored = experience.retrieve(sorted(ids))
+                values = stored[0] if backend is not None else [s[0] for s in stored]
+                self.assertTrue(set(range(21, 31)) <= set(values))
+                if eviction == 'fifo':
+                    self.assertEqual(sorted(values), list(range(11, 31)))
+                sample, w, e_id = experience.sample(50)
+                self.assertEqual(len(e_id), 4)
+                # a batch larger than the buffer keeps its last max_size rows
+                self.assertEqual(experience.store_batch((np.arange(100, 125), np.zeros(25), np.zeros(25),
+                                                         np.arange(100, 125), np.zeros(25))), 20)
+                stored = experience.retrieve(range(1, 21))
+                values = stored[0] if backend is not None else [s[0] for s in stored]
+                self.assertEqual(sorted(values), list(range(105, 125)))
+
+        self.assertRaises(ValueError, rank_based.Experience, eviction='oldest')
+
+    def test_store_batch_then_store(self):
+        for eviction in (None, 'fifo', 'lowest', 'random'):
+            experience = rank_based.Experience(max_size=10, learn_start=2, partition_num=2,
+                                               total_steps=100, batch_size=2, seed=0,
+                                               eviction=eviction, storage=storage.ArrayStorage(10))
+            self.assertEqual(experience.store_batch((np.arange(3), np.zeros(3), np.zeros(3),
+                                                     np.arange(3), np.zeros(3))), 3)
+            self.assertTrue(experience.store((3, 0, 0, 3, 0)))
+            self.assertEqual(sorted(experience.queue.get_e_ids()), [1, 2, 3, 4])
+            self.assertEqual(experience.record_size, 4)
+            self.assertEqual(experience.retrieve([1, 2, 3, 4])[0].tolist(), [0, 1, 2, 3])
+
+
 def main():
     test()
 
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the rank index
+
+import unittest
+import random
+import numpy as np
+import rank_index
+import binary_heap
+
+
+class TestRankIndex(unittest.TestCase):
+
+    def test_lookup(self):
+        for index in (rank_index.RankIndex, rank_index.ArrayRankIndex):
+            RI = index()
+            for e_id, p in [(1, 0.5), (2, 3.0), (3, 1.0), (4, 2.0)]:
+                RI.insert(e_id, p)
+            self.assertEqual(len(RI), 4)
+            self.assertEqual(RI.lookup([1, 2, 3, 4]), [2, 4, 3, 1])
+            self.assertTrue(RI.update(1, 0.5, 5.0))
+            self.assertEqual(RI.lookup([1, 4]), [1, 3])
+            self.assertFalse(RI.remove(1, 0.5))
+            self.assertRaises(IndexError, RI.lookup, [5])
+
+    def test_random_ops(self):
+        # few distinct priorities, so ties are ordered by experience id
+        for index, values in ((rank_index.RankIndex, None), (rank_index.ArrayRankIndex, None),
+                              (rank_index.ArrayRankIndex, [0.0, 0.25, 0.5, 1.0])):
+            random.seed(1)
+            draw = random.random if values is None else lambda: random.choice(values)
+            RI = index(load=4)
+            priorities = {}
+            for i in range(300):
+                priorities[i] = draw()
+                RI.insert(i, priorities[i])
+            for _ in range(1000):
+                e_id = random.randrange(300)
+                if e_id in priorities and random.random() < 0.3:
+                    self.assertTrue(RI.remove(e_id, priorities.pop(e_id)))
+                elif e_id in priorities:
+                    new = draw()
+                    self.assertTrue(RI.update(e_id, priorities[e_id], new))
+                    priorities[e_id] = new
+                else:
+                    priorities[e_id] = draw()
+                    RI.insert(e_id, priorities[e_id])
+            expected = [e for e, _ in sorted(priorities.items(), key=lambda x: (-x[1], x[0]))]
+            self.assertEqual(RI.lookup(range(1, len(expected) + 1)), expected)
+            for p in (0.0, 0.25, 0.5, priorities[expected[10]], 1.0):
+                self.assertEqual(RI.count_above(p), sum(v >= p for v in priorities.values()))
+            RI.rebuild_arrays(np.array(list(priorities)), np.array(list(priorities.values())))
+            self.assertEqual(RI.lookup(range(1, len(expected) + 1)), expected)
+
+    def test_heap_priority_to_experience(self):
+        BH = binary_heap.BinaryHeap(max_len=5, initial_heap=[(1, 1), (4, 2), (3, 3)])
+        BH.push((2, 4))
+        BH.update(1, 5)
+        self.assertEqual(BH.priority_to_experience([1, 2, 3, 4]), [1, 2, 3, 4])
+        BH.pop()
+        self.assertEqual(BH.priority_to_experience([1, 3]), [2, 4])
+
+
+class TestBucketRankIndex(unittest.TestCase):
+
+    def test_lookup(self):
+        BI = rank_index.BucketRankIndex(num_buckets=10, low=1e-5, high=1e5, rng=np.random.default_rng(0))
+        self.assertAlmostEqual(BI.ratio, 10.0)
+        for e_id, p in [(1, 0.5), (2, 300.0), (3, 0.7), (4, 20.0), (5, 0.0)]:
+            BI.insert(e_id, p)
+        self.assertEqual(len(BI), 5)
+        self.assertEqual(BI.lookup([1, 2, 5]), [2, 4, 5])
+        self.assertIn(BI.lookup([3])[0], (1, 3))
+        self.assertEqual(BI.count_above(0.6), 4)
+        # a move inside the bucket is free, out of it changes the ranks
+        self.assertTrue(BI.update(1, 0.5, 0.6))
+        self.assertTrue(BI.update(3, 0.7, 1e6))
+        self.assertEqual(BI.lookup([1, 2, 3, 4]), [3, 2, 4, 1])
+        self.assertTrue(BI.remove(3))
+        self.assertFalse(BI.remove(3))
+        self.assertFalse(BI.update(3, 1.0, 2.0))
+        self.assertRaises(IndexError, BI.lookup, [5])
+
+    def test_lookup_unique(self):
+        BI = rank_index.BucketRankIndex(num_buckets=4, low=1.0, high=1e4, rng=np.random.default_rng(0))
+        BI.rebuild([(e, 1.5) for e in range(10)] + [(10, 50.0)])
+        for _ in range(20):
+            # distinct ranks of one bucket are distinct members, equal ranks the same one
+            found = BI.lookup([11, 2, 3, 4, 5, 1, 11])
+            self.assertEqual(len(set(found[:6])), 6)
+            self.assertEqual(found[5], 10)
+            self.assertEqual(found[0], found[6])
+        self.assertEqual(sorted(BI.lookup(range(1, 12))), list(range(11)))
+
+    def test_rank_error(self):
+        BI = rank_index.BucketRankIndex(num_buckets=4, low=1.0, high=1e4)
+        self.assertEqual(BI.rank_error(), 0.0)
+        BI.rebuild([(e, 1.5) for e in range(4)] + [(4, 50.0)])
+        # bucket of 4: (16 - 1) / 3, bucket of 1: 0
+        self.assertAlmostEqual(BI.rank_error(), 5.0 / 5)
+        self.assertEqual(rank_index.RankIndex().rank_error(), 0.0)
+
+    def test_random_ops(self):
+        random.seed(2)
+        BI = rank_index.BucketRankIndex(num_buckets=64, low=1e-3, high=1.0)
+        priorities = {}
+        for _ in range(2000):
+            e_id = random.randrange(300)
+            if e_id in priorities and random.random() < 0.3:
+                self.assertTrue(BI.remove(e_id, priorities.pop(e_id)))
+            elif e_id in priorities:
+                new = random.random()
+                self.assertTrue(BI.update(e_id, priorities[e_id], new))
+                priorities[e_id] = new
+            else:
+                priorities[e_id] = random.random()
+                BI.insert(e_id, priorities[e_id])
+        expected = sorted(priorities, key=lambda e: -priorities[e])
+        found = BI.lookup(range(1, len(expected) + 1))
+        for rank, e_id in enumerate(found):
+            # members are drawn from the bucket holding the true rank
+            self.assertEqual(BI.bucket(priorities[e_id]), BI.bucket(priorities[expected[rank]]))
+
+    def test_heap(self):
+        BH = binary_heap.ArrayBinaryHeap(max_len=5, rank_index=rank_index.BucketRankIndex())
+        for e_id, p in [(1, 1.0), (2, 4.0), (3, 30.0)]:
+            BH.push((p, e_id))
+        BH.update(1, 500.0)
+        self.assertEqual(BH.priority_to_experience([1, 2, 3]), [1, 3, 2])
+        BH.pop()
+        self.assertEqual(BH.priority_to_experience([1, 2]), [3, 2])
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the replay server
+
+import os
+import select
+import socket
+import tempfile
+import threading
+import unittest
+import numpy as np
+import rank_based
+import replay_server
+import storage
+
+
+class TestReplayServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmp.name, 'replay.sock')
+        self.experience = rank_based.Experience(max_size=100, learn_start=10, partition_num=10,
+                                                total_steps=1000, batch_size=4, seed=0,
+                                                eviction='fifo', storage=storage.ArrayStorage(100, (3,)))
+        self.server = replay_server.ReplayServer(self.experience, self.address)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.close()
+        self.tmp.cleanup()
+
+    def test_pack(self):
+        arrays = [np.arange(6, dtype=np.float32).reshape(2, 3), np.array(True), np.zeros(0)]
+        message = b''.join(bytes(b) for b in replay_server.pack(replay_server.STORE, 7, arrays))
+        op, n, _, request_id, body_len = replay_server.HEADER.unpack_from(message)
+        self.assertEqual((op, n, request_id, body_len), (replay_server.STORE, 3, 7,
+                                                         len(message) - replay_server.HEADER.size))
+        unpacked = replay_server.unpack(n, message[replay_server.HEADER.size:])
+        for a, b in zip(arrays, unpacked):
+            self.assertEqual(a.dtype, b.dtype)
+            np.testing.assert_array_equal(a, b)
+
+    def test_clients(self):
+        actor = replay_server.ReplayClient(self.address)
+        learner = replay_server.ReplayClient(self.address)
+        try:
+            self.assertEqual(learner.sample(1), (False, False, False))
+            # pipelined stores
+            ids = []
+            for i in range(5):
+                s = np.full((4, 3), i, dtype=np.float32)
+                ids.append(actor.submit(replay_server.STORE, (s, np.arange(4), np.ones(4, dtype=np.float32),
+                                                              s + 1, np.zeros(4, dtype=np.bool_))))
+            self.assertEqual([int(actor.result(i)[1][0]) for i in ids], [4] * 5)
+            self.assertTrue(actor.store((np.ones(3), 1, 0.5, np.ones(3), True)))
+            self.assertEqual(self.experience.record_size, 21)
+            (s1, a, r, s2, t), w, e_id = learner.sample(20)
+            self.assertEqual(s1.shape, (4, 3))
+            np.testing.assert_array_equal(s1, self.experience.retrieve(e_id)[0])
+            learner.update_priority(e_id, [5.0, 6.0, 7.0, 8.0])
+            self.assertEqual(self.experience.queue.priority_to_experience([1, 2, 3, 4]), list(e_id[::-1]))
+        finally:
+            actor.close()
+            learner.close()
+
+    def _raw(self, client, op, arrays, dtype=None, extra=b''):
+        # message with the first array's dtype replaced and extra bytes appended to the body
+        buffers = [bytes(b) for b in replay_server.pack(op, 99, arrays)]
+        if dtype is not None:
+            buffers[1] = dtype.ljust(4) + buffers[1][4:]
+        body = b''.join(buffers[1:]) + extra
+        header = replay_server.HEADER.pack(op, len(arrays), 0, 99, len(body))
+        client.sock.sendall(header + body)
+        return client.result(99)
+
+    def test_malformed(self):
+        bad = replay_server.ReplayClient(self.address)
+        good = replay_server.ReplayClient(self.address)
+        s = np.zeros((2, 3), dtype=np.float32)
+        batch = (s, np.arange(2), np.ones(2, dtype=np.float32), s, np.zeros(2, dtype=np.bool_))
+        try:
+            for dtype, extra in ((b'zz', b''), (b'|O8', b''), (None, b'\0' * 3)):
+                op, arrays = self._raw(bad, replay_server.STORE, batch, dtype, extra)
+                self.assertEqual(op, replay_server.ERROR)
+                self.assertIn('malformed', arrays[0].tobytes().decode())
+            # wrong number of columns, mismatched rows
+            self.assertEqual(bad.store_batch(batch[:4]), 0)
+            self.assertEqual(bad.store_batch(batch[:4] + (np.zeros(3, dtype=np.bool_),)), 0)
+            op, _ = bad.result(bad.submit(replay_server.UPDATE, [np.zeros(2), np.zeros(2)]))
+            self.assertEqual(op, replay_server.ERROR)
+            # the server and the offending connection are still up
+            self.assertEqual(good.store_batch(batch), 2)
+            self.assertEqual(bad.store_batch(batch), 2)
+            self.assertEqual(self.experience.record_size, 4)
+            # a body too large to frame closes only that connection
+            bad.sock.sendall(replay_server.HEADER.pack(replay_server.STORE, 1, 0, 1,
+                                                       replay_server.MAX_BODY + 1))
+            self.assertEqual(bad.sock.recv(1), b'')
+            self.assertEqual(good.store_batch(batch), 2)
+        finally:
+            bad.close()
+            good.close()
+
+
+class TestReplayServerBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmp.name, 'replay.sock')
+        self.experience = rank_based.Experience(max_size=10, learn_start=1, partition_num=1,
+                                                total_steps=100, batch_size=2, seed=0,
+                                                storage=storage.ArrayStorage(10, (3,)))
+        self.server = replay_server.ReplayServer(self.experience, self.address)
+        self.clients = [replay_server.ReplayClient(self.address) for _ in range(3)]
+        # accept every client, so their requests are coalesced in one iteration
+        while len(self.server.selector.get_map()) < 4:
+            self.server.serve_once(0.1)
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.close()
+        self.tmp.cleanup()
+
+    def _batch(self, k, state_shape=(3,)):
+        s = np.zeros((k,) + state_shape, dtype=np.float32)
+        return (s, np.arange(k), np.ones(k, dtype=np.float32), s, np.zeros(k, dtype=np.bool_))
+
+    def _serve(self, ids):
+        while not all(select.select([c.sock], [], [], 0)[0] for c in self.clients[:len(ids)]):
+            self.server.serve_once(0.01)
+        return [c.result(i) for c, i in zip(self.clients, ids)]
+
+    def test_store_shares(self):
+        # 6 + 6 rows into 10 free slots, without eviction the first 10 rows are kept
+        ids = [c.submit(replay_server.STORE, self._batch(6)) for c in self.clients[:2]]
+        replies = self._serve(ids)
+        self.assertEqual([int(arrays[0]) for _, arrays in replies], [6, 4])
+        self.assertEqual(self.experience.record_size, 10)
+
+    def test_isolated_failure(self):
+        # shapes that can't be concatenated, every request is stored on its own
+        ids = [self.clients[0].submit(replay_server.STORE, self._batch(2)),
+               self.clients[1].submit(replay_server.STORE, self._batch(2, (4,))),
+               self.clients[2].submit(replay_server.STORE, self._batch(3))]
+        replies = self._serve(ids)
+        self.assertEqual([op for op, _ in replies],
+                         [replay_server.REPLY, replay_server.ERROR, replay_server.REPLY])
+        self.assertEqual(int(replies[0][1][0]), 2)
+        self.assertEqual(int(replies[2][1][0]), 3)
+        self.assertEqual(self.experience.record_size, 5)
+
+    def test_body_growth(self):
+        a, b = socket.socketpair()
+        try:
+            b.setblocking(False)
+            conn = replay_server._Connection(b, max_body=1 << 20)
+            array = np.arange(100000, dtype=np.float32)
+            message = b''.join(bytes(m) for m in replay_server.pack(replay_server.STORE, 3, [array]))
+            # the header claims ~400 KB, the buffer only grows with what arrives
+            a.sendall(message[:replay_server.HEADER.size + 10])
+            self.assertEqual(conn.read(), [])
+            self.assertEqual(len(conn.body), replay_server.BODY_CHUNK)
+            # more than the socket buffer holds, so it is sent while the connection reads
+            sender = threading.Thread(target=a.sendall, args=(message[replay_server.HEADER.size + 10:],))
+            sender.start()
+            messages = []
+            while not messages:
+                select.select([b], [], [], 1)
+                messages = conn.read()
+            sender.join()
+            op, request_id, arrays = messages[0]
+            self.assertEqual((op, request_id), (replay_server.STORE, 3))
+            np.testing.assert_array_equal(arrays[0], array)
+            # over max_body the stream can't be resynchronized
+            a.sendall(replay_server.HEADER.pack(replay_server.STORE, 1, 0, 1, (1 << 20) + 1))
+            self.assertRaises(ValueError, conn.read)
+        finally:
+            a.close()
+            b.close()
+
+    def test_max_body(self):
+        self.server.max_body = 1024
+        client = replay_server.ReplayClient(self.address)
+        try:
+            while len(self.server.selector.get_map()) < 5:
+                self.server.serve_once(0.1)
+            client.submit(replay_server.STORE, self._batch(100))
+            # the body is over max_body, only this client is dropped
+            while len(self.server.selector.get_map()) == 5:
+                self.server.serve_once(0.01)
+            self.server.max_body = replay_server.MAX_BODY
+            # the other clients are unaffected
+            self.assertEqual(self._serve([self.clients[0].submit(replay_server.STORE,
+                                                                 self._batch(2))])[0][0],
+                             replay_server.REPLY)
+        finally:
+            client.close()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the sharded experience replay
+
+import unittest
+import numpy as np
+import rank_based
+import sharded
+
+
+class TestShardedExperience(unittest.TestCase):
+
+    def test_matches_single_process(self):
+        kwargs = dict(max_size=100, learn_start=10, partition_num=10, total_steps=1000,
+                      batch_size=8, seed=5)
+        single = rank_based.Experience(**kwargs)
+        with sharded.ShardedExperience(num_shards=3, num_buckets=2000, bucket_range=1000.0,
+                                       storage_kwargs={}, **kwargs) as experience:
+            columns = (np.arange(99), np.zeros(99), np.zeros(99), np.arange(99), np.zeros(99))
+            experience.store_batch(columns)
+            single.store_batch(columns)
+            # item i went to shard i % 3 with local id i // 3 + 1
+            items = np.arange(99)
+            global_ids = (items // 3 + 1) * 3 + items % 3
+            priorities = (items * 7 % 99) + 1.0
+            experience.update_priority(global_ids, priorities)
+            single.update_priority_batch(items + 1, priorities)
+            for step in range(5):
+                (s1, a, r, s2, t), w, e_id = experience.sample(20 + step)
+                expected, expected_w, expected_id = single.sample(20 + step)
+                np.testing.assert_array_equal(s1, [e[0] for e in expected])
+                np.testing.assert_array_equal(e_id, global_ids[expected_id - 1])
+                np.testing.assert_allclose(w, expected_w)
+
+    def test_approximate_ranks(self):
+        with sharded.ShardedExperience(num_shards=2, max_size=1000, learn_start=100, partition_num=10,
+                                       total_steps=1000, batch_size=16, seed=0) as experience:
+            self.assertEqual(experience.sample(1), (False, False, False))
+            for i in range(1000):
+                experience.store((i, 0, 0, i, 0))
+            items = np.arange(1000)
+            global_ids = (items // 2 + 1) * 2 + items % 2
+            experience.update_priority(global_ids, items + 1.0)
+            sample, w, e_id = experience.sample(200)
+            self.assertEqual(len(set(e_id)), 16)
+            values = [s[0] for s in sample]
+            np.testing.assert_array_equal(global_ids[values], e_id)
+            # the top stratum holds the highest priorities
+            self.assertGreater(values[0], 990)
+
+    def test_shard_error(self):
+        with sharded.ShardedExperience(num_shards=2, max_size=100, learn_start=10, partition_num=10,
+                                       total_steps=1000, batch_size=4, seed=0) as experience:
+            for i in range(20):
+                experience.store((i, 0, 0, i, 0))
+            # raised in the shards, sent back instead of hanging the parent
+            self.assertRaises(TypeError, experience.histograms, ['x'])
+            np.testing.assert_array_equal(experience.histograms([0.0]), [[10], [10]])
+            # store_batch doesn't reply, its error comes back with the next request
+            experience._conns[1].send(('store_batch', (np.zeros(2),)))
+            self.assertRaises(IndexError, experience.sample, 1)
+            sample, w, e_id = experience.sample(1)
+            self.assertEqual(len(e_id), 4)
+
+    def test_shard_without_distributions(self):
+        experience = rank_based.Experience(max_size=100, learn_start=0, total_steps=1, partition_num=1,
+                                           batch_size=1, sampling=False)
+        self.assertIsNone(experience.distributions)
+        self.assertTrue(experience.store((0, 0, 0, 0, 0)))
+        self.assertRaises(ValueError, experience.sample, 1)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the shared-memory replay buffer
+
+import os
+import sys
+import subprocess
+import unittest
+from multiprocessing import shared_memory
+import multiprocessing
+import numpy as np
+import shared_replay
+
+
+def actor(experience, actor_id, steps):
+    for i in range(steps):
+        experience.store((np.full(2, actor_id), actor_id, float(i), np.full(2, actor_id), False))
+    experience.close()
+
+
+class TestSharedExperience(unittest.TestCase):
+
+    def test_actors(self):
+        experience = shared_replay.SharedExperience(max_size=64, state_shape=(2,), learn_start=8,
+                                                    total_steps=100, batch_size=4, seed=0)
+        try:
+            ctx = multiprocessing.get_context('fork')
+            actors = [ctx.Process(target=actor, args=(experience, a, 20)) for a in (1, 2, 3)]
+            for p in actors:
+                p.start()
+            for p in actors:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+            self.assertEqual(experience.record_size, 60)
+            self.assertEqual(experience.tree.total(), 60.0)
+            s1, a, r, s2, t = experience.retrieve(np.arange(1, 61))
+            self.assertEqual(sorted(np.bincount(a)[1:]), [20, 20, 20])
+            np.testing.assert_array_equal(s1[:, 0], a)
+            (s1, a, r, s2, t), w, e_id = experience.sample(50)
+            experience.update_priority(e_id, [4.0, 4.0, 4.0, 4.0])
+            self.assertAlmostEqual(experience.max_priority, (4.0 + 1e-6) ** 0.6)
+        finally:
+            experience.close()
+            experience.unlink()
+
+    def test_spawn(self):
+        # spawn pickles the experience, the actors attach to the block by name
+        ctx = multiprocessing.get_context('spawn')
+        experience = shared_replay.SharedExperience(max_size=64, state_shape=(2,), learn_start=8,
+                                                    total_steps=100, batch_size=4, seed=0,
+                                                    lock=ctx.Lock())
+        try:
+            actors = [ctx.Process(target=actor, args=(experience, a, 10)) for a in (1, 2)]
+            for p in actors:
+                p.start()
+            for p in actors:
+                p.join()
+                self.assertEqual(p.exitcode, 0)
+            # the block outlives the actors
+            self.assertEqual(experience.record_size, 20)
+            attached = shared_replay.SharedExperience.__new__(shared_replay.SharedExperience)
+            attached.__setstate__(experience.__getstate__())
+            self.assertEqual(attached.record_size, 20)
+            attached.close()
+            # a process with its own resource tracker must not unlink the block when it exits
+            code = ('import shared_replay; e = shared_replay.SharedExperience(max_size=64, '
+                    'state_shape=(2,), name={!r}, create=False); e.close()').format(experience.shm.name)
+            # the output pipes close once the child's tracker has exited too
+            res = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+            self.assertNotIn(b'leaked', res.stderr)
+            attached = shared_memory.SharedMemory(name=experience.shm.name)
+            attached.close()
+        finally:
+            experience.close()
+            experience.unlink()
+        self.assertRaises(FileNotFoundError, shared_memory.SharedMemory, name=experience.shm.name)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for saving and restoring the experience replay
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import binary_heap
+import rank_based
+import snapshot
+import storage
+
+
+def build(backend=None, compact_heap=False):
+    experience = rank_based.Experience(max_size=50, learn_start=10, partition_num=5,
+                                       total_steps=100, batch_size=4, seed=0,
+                                       eviction='lowest', storage=backend,
+                                       compact_heap=compact_heap)
+    for i in range(60):
+        experience.store((np.full(3, i), i, 0.5, np.full(3, i + 1), False))
+        if i % 5 == 0 and i >= 10:
+            sample, w, e_id = experience.sample(i)
+            experience.update_priority(e_id, np.arange(1.0, 5.0) * i)
+    return experience
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def check_same(self, a, b):
+        self.assertEqual(list(a.queue.get_e_ids()), list(b.queue.get_e_ids()))
+        self.assertEqual(list(a.queue.get_priorities()), list(b.queue.get_priorities()))
+        self.assertEqual((a.index, a.record_size, a.isFull), (b.index, b.record_size, b.isFull))
+        sa, wa, ia = a.sample(70)
+        sb, wb, ib = b.sample(70)
+        np.testing.assert_array_equal(ia, ib)
+        np.testing.assert_array_equal(wa, wb)
+        if isinstance(sa, tuple):
+            for x, y in zip(sa, sb):
+                np.testing.assert_array_equal(x, y)
+        else:
+            self.assertEqual(len(sa), len(sb))
+
+    def test_array_storage(self):
+        with tempfile.TemporaryDirectory() as path:
+            experience = build(storage.ArrayStorage(50, (3,)))
+            experience.save(path)
+            restored = rank_based.Experience.load(path)
+            self.assertIsInstance(restored.storage.states, np.memmap)
+            self.check_same(experience, restored)
+
+    def test_dict_storage(self):
+        with tempfile.TemporaryDirectory() as path:
+            experience = build()
+            experience.save(path)
+            self.assertTrue(os.path.exists(os.path.join(path, 'experience.0.pkl')))
+            self.check_same(experience, rank_based.Experience.load(path))
+
+    def test_compact_heap(self):
+        with tempfile.TemporaryDirectory() as path:
+            experience = build(storage.ArrayStorage(50, (3,)), compact_heap=True)
+            experience.save(path)
+            restored = rank_based.Experience.load(path)
+            self.assertIsInstance(restored.queue, binary_heap.ArrayBinaryHeap)
+            self.check_same(experience, restored)
+
+    def test_incremental(self):
+        with tempfile.TemporaryDirectory() as path:
+            experience = build(storage.ArrayStorage(50, (3,)))
+            experience.save(path)
+            restored = rank_based.Experience.load(path)
+            for i in range(60, 65):
+                restored.store((np.full(3, i), i, 0.5, np.full(3, i + 1), True))
+            changed = np.nonzero(restored.storage.dirty)[0]
+            self.assertEqual(len(changed), 5)
+            restored.save(path, incremental=True)
+            self.assertFalse(restored.storage.dirty.any())
+            again = rank_based.Experience.load(path, mmap_mode=None)
+            np.testing.assert_array_equal(again.storage.terminals[changed], True)
+            self.check_same(restored, again)
+
+    def test_interrupted(self):
+        with tempfile.TemporaryDirectory() as path:
+            experience = build(storage.ArrayStorage(50, (3,)))
+            experience.save(path)
+            saved = rank_based.Experience.load(path, mmap_mode=None)
+            for i in range(60, 65):
+                experience.store((np.full(3, i), i, 0.5, np.full(3, i + 1), True))
+            # a save failing before its commit leaves the previous snapshot and the dirty slots
+            with mock.patch.object(snapshot, '_write_meta', side_effect=OSError('disk full')):
+                self.assertRaises(OSError, experience.save, path, True)
+            self.assertEqual(int(experience.storage.dirty.sum()), 5)
+            self.check_same(saved, rank_based.Experience.load(path, mmap_mode=None))
+            # failing after the commit, load writes the logged rows
+            with mock.patch.object(snapshot, '_apply_rows', side_effect=OSError('killed')):
+                self.assertRaises(OSError, experience.save, path, True)
+            restored = rank_based.Experience.load(path, mmap_mode=None)
+            np.testing.assert_array_equal(restored.storage.terminals, experience.storage.terminals)
+            experience.save(path, incremental=True)
+            self.assertFalse(experience.storage.dirty.any())
+            self.check_same(experience, rank_based.Experience.load(path, mmap_mode=None))
+            # only the committed generation is left
+            self.assertEqual(sorted(os.listdir(path)),
+                             sorted(['meta.json', 'heap_priorities.2.npy', 'heap_ids.2.npy'] +
+                                    [c + '.0.npy' for c in snapshot.COLUMNS]))
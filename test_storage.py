@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the transition storage backends
+
+import unittest
+import numpy as np
+import storage
+import old_rank_based
+
+
+class TestArrayStorage(unittest.TestCase):
+
+    def test_ring(self):
+        AS = storage.ArrayStorage(3, state_shape=(2,), state_dtype=np.uint8)
+        for i in range(4):
+            slot = AS.append((np.full(2, i), i, i * 0.5, np.full(2, i + 1), i == 3))
+            self.assertEqual(slot, i % 3)
+        self.assertEqual(len(AS), 3)
+        self.assertTrue(AS.is_full())
+        s1, a, r, s2, t = AS.gather([0, 2])
+        self.assertEqual(s1.dtype, np.uint8)
+        np.testing.assert_array_equal(s1, [[3, 3], [2, 2]])
+        np.testing.assert_array_equal(a, [3, 2])
+        np.testing.assert_array_equal(r, [1.5, 1.0])
+        np.testing.assert_array_equal(s2, [[4, 4], [3, 3]])
+        np.testing.assert_array_equal(t, [True, False])
+
+    def test_append_batch(self):
+        AS = storage.ArrayStorage(4)
+        AS.append((0, 0, 0, 0, 0))
+        slots = AS.append_batch((np.arange(1, 6), np.arange(1, 6), np.zeros(5), np.zeros(5), np.zeros(5)))
+        np.testing.assert_array_equal(slots, [1, 2, 3, 0, 1])
+        self.assertEqual((len(AS), AS.cursor), (4, 2))
+        np.testing.assert_array_equal(AS.gather([0, 1, 2, 3])[1], [4, 5, 2, 3])
+
+    def test_old_rank_based(self):
+        conf = {'size': 50, 'learn_start': 10, 'partition_num': 5, 'steps': 100,
+                'batch_size': 4, 'state_shape': (3,)}
+        experience = old_rank_based.Experience(conf)
+        for i in range(1, 52):
+            self.assertTrue(experience.store((np.full(3, i), 1, 1, np.full(3, i + 1), 0)))
+        self.assertEqual(experience.record_size, 50)
+        self.assertEqual(experience.index, 1)
+        (s1, a, r, s2, t), w, e_id = experience.sample(51)
+        self.assertEqual(s1.shape, (4, 3))
+        for row, i in zip(s1, e_id):
+            self.assertEqual(row[0], 51 if i == 1 else i)
+
+
+def stacked_episodes(stack_size, lengths, shape=(2,)):
+    # transitions for consecutive episodes, frame i is full of i, reset stacks repeat the first frame
+    frame = 0
+    transitions = []
+    for length in lengths:
+        frame += 1
+        state = [np.full(shape, frame)] * stack_size
+        for step in range(length):
+            frame += 1
+            next_state = state[1:] + [np.full(shape, frame)]
+            transitions.append((np.array(state), step, float(frame), np.array(next_state),
+                                step == length - 1))
+            state = next_state
+    return transitions
+
+
+class TestFrameStorage(unittest.TestCase):
+
+    def check(self, FS, expected, slots):
+        s1, a, r, s2, t = FS.gather(slots)
+        for i, slot in enumerate(slots):
+            es1, ea, er, es2, et = expected[slot]
+            np.testing.assert_array_equal(s1[i], es1)
+            np.testing.assert_array_equal(s2[i], es2)
+            self.assertEqual((a[i], r[i], t[i]), (ea, er, et))
+
+    def test_episodes(self):
+        transitions = stacked_episodes(4, [1, 3, 7, 2, 10, 5])
+        FS = storage.FrameStorage(10, 4, (2,), frame_dtype=np.int32)
+        slots = {}
+        for i, transition in enumerate(transitions):
+            slots[FS.append(transition)] = transition
+            self.check(FS, slots, list(slots))
+        self.assertLess(FS.nbytes(), 10 * 2 * 4 * 2 * 4)
+
+    def test_truncation(self):
+        first = stacked_episodes(3, [4])
+        second = stacked_episodes(3, [3])
+        # second episode reuses frame values, s1 doesn't continue the last s2
+        second = [(s1 + 10, a, r, s2 + 10, t) for s1, a, r, s2, t in second]
+        truncated = [(s1, a, r, s2, False) for s1, a, r, s2, t in first]
+        FS = storage.FrameStorage(8, 3, (2,), frame_dtype=np.int32)
+        slots = {}
+        for transition in truncated + second:
+            slots[FS.append(transition)] = transition
+        self.check(FS, slots, list(slots))
+        # a reset stack whose newest frame equals the last frame (e.g. a blank screen)
+        blank = np.zeros((3, 2), dtype=np.int32)
+        FS.append((blank + [[1], [2], [3]], 0, 0.0, blank + [[2], [3], [0]], False))
+        reset = (blank, 1, 0.0, blank, False)
+        slots[FS.append(reset)] = reset
+        self.check(FS, slots, [FS.cursor - 1])
+
+    def test_rank_based(self):
+        import rank_based
+        FS = storage.FrameStorage(20, 4, (2,), frame_dtype=np.int32)
+        experience = rank_based.Experience(max_size=20, learn_start=4, partition_num=2,
+                                           total_steps=100, batch_size=4, storage=FS)
+        transitions = stacked_episodes(4, [6, 6, 8])
+        for transition in transitions:
+            self.assertTrue(experience.store(transition))
+        (s1, a, r, s2, t), w, e_id = experience.sample(30)
+        for i, e in enumerate(e_id):
+            np.testing.assert_array_equal(s1[i], transitions[e - 1][0])
+            np.testing.assert_array_equal(s2[i], transitions[e - 1][3])
+
+
+class TestCompressedStorage(unittest.TestCase):
+
+    def frames(self, n, shape=(8, 8)):
+        # pixel like frames normalized to [0, 1], mostly zeros
+        rng = np.random.default_rng(0)
+        frames = np.zeros((n,) + shape, dtype=np.float32)
+        frames[:, :2] = rng.integers(0, 256, (n, 2) + shape[1:]) / np.float32(255)
+        return frames
+
+    def test_codecs(self):
+        frames = self.frames(12)
+        for codec, quantize in (('zlib', None), ('lzma', None), (None, 255), ('zlib', 255)):
+            CS = storage.CompressedStorage(10, (8, 8), codec=codec, quantize=quantize, workers=2)
+            for i in range(11):
+                self.assertEqual(CS.append((frames[i], i, i * 0.5, frames[i + 1], i == 10)), i % 10)
+            s1, a, r, s2, t = CS.gather([0, 3, 5, 0])
+            np.testing.assert_array_equal(s1, frames[[10, 3, 5, 10]])
+            np.testing.assert_array_equal(s2, frames[[11, 4, 6, 11]])
+            np.testing.assert_array_equal(a, [10, 3, 5, 10])
+            np.testing.assert_array_equal(t, [True, False, False, True])
+            stats = CS.stats()
+            self.assertEqual(stats['raw_bytes'], 10 * 2 * 8 * 8 * 4)
+            self.assertGreaterEqual(stats['ratio'], 4.0 if quantize else 1.5)
+            self.assertGreater(stats['decode_mb_per_s'], 0)
+            CS.close()
+
+    def test_quantize_fallback(self):
+        CS = storage.CompressedStorage(2, (3,), codec=None, quantize=255, workers=0)
+        exact = np.array([0, 1, 128], dtype=np.float32) / np.float32(255)
+        other = np.array([0.1, 2.0, -1.0], dtype=np.float32)
+        CS.append((exact, 0, 0, other, False))
+        self.assertEqual(CS.quantized[:, 0].tolist(), [True, False])
+        s1, _, _, s2, _ = CS.gather([0])
+        np.testing.assert_array_equal(s1[0], exact)
+        np.testing.assert_array_equal(s2[0], other)
+        self.assertRaises(ValueError, storage.CompressedStorage, 2, (3,), np.uint8, quantize=255)
+
+    def test_rank_based(self):
+        import rank_based
+        frames = self.frames(41)
+        CS = storage.CompressedStorage(20, (8, 8), quantize=255)
+        experience = rank_based.Experience(max_size=20, learn_start=4, partition_num=2,
+                                           total_steps=100, batch_size=4, storage=CS,
+                                           eviction='lowest')
+        experience.store_batch((frames[:30], np.arange(30), np.zeros(30), frames[1:31], np.zeros(30)))
+        for i in range(30, 40):
+            self.assertTrue(experience.store((frames[i], i, 0, frames[i + 1], False)))
+        (s1, a, r, s2, t), w, e_id = experience.sample(30)
+        np.testing.assert_array_equal(s1, frames[a])
+        np.testing.assert_array_equal(s2, frames[a + 1])
+        self.assertLess(CS.nbytes(), 20 * 2 * 8 * 8 * 4)
+        CS.close()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Unit tests for the priority update log
+
+import unittest
+import numpy as np
+import update_log
+
+
+class TestUpdateLog(unittest.TestCase):
+
+    def test_coalesce(self):
+        UL = update_log.UpdateLog(capacity=2)
+        UL.append([5, 3, 5], [1.0, 2.0, 3.0])
+        UL.append(np.array([3, 7]), np.array([0.5, 4.0]))
+        self.assertEqual(len(UL), 5)
+        self.assertGreaterEqual(len(UL.ids), 5)
+        self.assertEqual(UL.max_priority, 4.0)
+        ids, priorities = UL.coalesce()
+        self.assertEqual(ids.tolist(), [3, 5, 7])
+        self.assertEqual(priorities.tolist(), [0.5, 3.0, 4.0])
+        UL.discard([5, 9])
+        self.assertEqual(UL.ids[:len(UL)].tolist(), [3, 3, 7])
+        self.assertEqual(UL.coalesce()[1].tolist(), [0.5, 4.0])
+        # a discarded victim's priority no longer raises the max
+        UL.discard(np.array([7]))
+        self.assertEqual(UL.max_priority, 2.0)
+        UL.discard(np.arange(10))
+        self.assertEqual((len(UL), UL.max_priority), (0, 0.0))
+        UL.clear()
+        self.assertEqual(len(UL), 0)
+        self.assertEqual(UL.coalesce()[0].tolist(), [])
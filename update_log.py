@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# author: Calum (AverageHomosapien)
+# description: Write-behind log of priority updates, applied to the heap in bulk
+
+import numpy as np
+
+"""
+UpdateLog collects (experience id, priority) updates in two flat numpy arrays instead of applying
+each one to the heap. coalesce() keeps the last update of every id, so updates overwritten before
+the next sample cost one array write, and the survivors are applied with one update_batch.
+rank_based.Experience(update_log_size=k) uses it and flushes before sampling, saving, evicting
+the lowest priorities, and whenever k updates are pending. Updates of other evicted ids are
+discarded. The flush at k pending runs inside the update_priority call that reaches k, which then
+pays for the whole update_batch (k sifts or a rebuild), so k should be above the number of
+updates between two samples for every flush to happen at sampling.
+"""
+
+
+class UpdateLog(object):
+    """
+    param capacity: initial number of entries, the arrays double when it is reached
+    """
+    def __init__(self, capacity=1024):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.priorities = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+        # highest pending priority, so new experiences can still get the max priority, an upper
+        # bound since entries overwritten by a later update of the same id still count
+        self.max_priority = 0.0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, ids, priorities):
+        """
+        :param ids: array of experience id
+        :param priorities: array of new priorities, order correspond to ids
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        k = len(ids)
+        if not k:
+            return
+        if self.size + k > len(self.ids):
+            capacity = max(2 * len(self.ids), self.size + k)
+            self.ids = np.concatenate((self.ids[:self.size], np.zeros(capacity - self.size, dtype=np.int64)))
+            self.priorities = np.concatenate((self.priorities[:self.size],
+                                              np.zeros(capacity - self.size)))
+        self.ids[self.size:self.size + k] = ids
+        new = self.priorities[self.size:self.size + k]
+        new[:] = priorities
+        self.max_priority = max(self.max_priority, float(new.max()))
+        self.size += k
+
+    def discard(self, ids):
+        """
+        drop the pending updates of ids (e.g. evicted experiences)
+        :param ids: array of experience id
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        logged = self.ids[:self.size]
+        if len(ids) <= 4:
+            # np.isin has a large fixed cost, a few comparisons are cheaper for single stores
+            keep = np.ones(self.size, dtype=np.bool_)
+            for e in ids.tolist():
+                keep &= logged != e
+        else:
+            keep = ~np.isin(logged, ids)
+        n = int(keep.sum())
+        self.ids[:n] = logged[keep]
+        self.priorities[:n] = self.priorities[:self.size][keep]
+        self.size = n
+        # the priorities of discarded entries no longer count
+        self.max_priority = float(self.priorities[:n].max()) if n else 0.0
+
+    def coalesce(self):
+        """
+        :return: (ids, priorities) arrays, the last logged priority of every id, sorted by id
+        """
+        ids = self.ids[:self.size][::-1]
+        # np.unique returns the first occurrence, i.e. the last update in the reversed log
+        unique, first = np.unique(ids, return_index=True)
+        return unique, self.priorities[:self.size][::-1][first]
+
+    def clear(self):
+        self.size = 0
+        self.max_priority = 0.0